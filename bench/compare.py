@@ -0,0 +1,73 @@
+"""Compare two bench/run.py result files configuration by configuration.
+
+    python bench/compare.py bench-old.jsonl bench-new.jsonl --threshold 10
+
+Exits with status 1 when any latency, RTF or memory figure regressed by
+more than the threshold (percent).
+"""
+import argparse
+import json
+import sys
+
+# (label, path into the record, True if higher is better)
+FIGURES = [
+    ('p50 ms', ('latency_ms', 'p50'), False),
+    ('p95 ms', ('latency_ms', 'p95'), False),
+    ('p99 ms', ('latency_ms', 'p99'), False),
+    ('RTF', ('rtf', 'aggregate'), True),
+    ('req/s', ('throughput_rps',), True),
+    ('RSS MB', ('peak_rss_mb',), False),
+]
+
+
+def load(path):
+    records = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                # Later runs of the same configuration win
+                records[json.dumps(record['config'], sort_keys=True)] = record
+    return records
+
+
+def lookup(record, path):
+    for key in path:
+        record = record.get(key) if isinstance(record, dict) else None
+    return record
+
+
+def describe(config):
+    return (f"{config['model']} beam={config['beam_size']} {config['compute_type']} "
+            f"c={config['concurrency']} {config['duration']:g}s {config['format']}@{config['rate']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        print(describe(new['config']))
+        for label, path, higher_is_better in FIGURES:
+            before, after = lookup(old, path), lookup(new, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            flag = '  REGRESSION' if worse > args.threshold else ''
+            regressions += bool(flag)
+            print(f'  {label:8} {before:>10} -> {after:<10} {change:+6.1f}%{flag}')
+    missing = len(baseline.keys() ^ candidate.keys())
+    if missing:
+        print(f'{missing} configuration(s) only present in one file')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
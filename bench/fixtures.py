@@ -0,0 +1,105 @@
+"""Synthetic audio fixtures, generated locally with NumPy and encoded with PyAV.
+
+"speech" is a crude stand-in for a voice: phrases of a gliding harmonic
+series under a syllable-rate envelope, separated by pauses, over background
+noise. It exercises VAD, chunking and decoding like real speech does.
+"""
+import io
+
+import av
+import numpy as np
+
+# name -> (container format, encoder, Telegram-style mime type)
+FORMATS = {
+    'opus': ('ogg', 'libopus', 'audio/ogg'),
+    'mp3': ('mp3', 'libmp3lame', 'audio/mpeg'),
+    'm4a': ('ipod', 'aac', 'audio/mp4'),
+    'flac': ('flac', 'flac', 'audio/flac'),
+    'wav': ('wav', 'pcm_s16le', 'audio/wav'),
+    # AAC under a 480x480 video track, like a Telegram video note
+    'mp4': ('mp4', 'aac', 'video/mp4'),
+}
+VIDEO_SIZE = 480
+VIDEO_FPS = 30
+KINDS = ('speech', 'tone', 'noise')
+
+
+def speech_like(samples, rate, rng):
+    out = np.zeros(samples, dtype=np.float32)
+    position = 0
+    while position < samples:
+        end = min(samples, position + int(rng.uniform(0.8, 3.0) * rate))
+        t = np.arange(end - position) / rate
+        pitch = rng.uniform(90, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+        syllables = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3, 6) * t))
+        out[position:end] = 0.15 * voiced * syllables
+        position = end + int(rng.uniform(0.3, 1.0) * rate)
+    out += rng.normal(0, 0.005, samples).astype(np.float32)
+    return out
+
+
+def synthesize(seconds, rate, kind='speech', seed=0):
+    """Mono float32 samples in [-1, 1]."""
+    rng = np.random.default_rng(seed)
+    samples = int(seconds * rate)
+    if kind == 'speech':
+        audio = speech_like(samples, rate, rng)
+    elif kind == 'tone':
+        t = np.arange(samples) / rate
+        audio = 0.3 * np.sin(2 * np.pi * rng.uniform(200, 600) * t)
+    elif kind == 'noise':
+        audio = rng.normal(0, 0.1, samples)
+    else:
+        raise ValueError(f'unknown fixture kind {kind!r}')
+    return np.clip(audio, -1, 1).astype(np.float32)
+
+
+def mux_video(output, stream, seconds):
+    """Encode a moving test pattern, so that decoding it would show in the timings."""
+    ramp = np.arange(VIDEO_SIZE)
+    for index in range(int(seconds * VIDEO_FPS)):
+        row = ((ramp + index * 4) % 256).astype(np.uint8)
+        image = np.broadcast_to(row[None, :, None], (VIDEO_SIZE, VIDEO_SIZE, 3))
+        frame = av.VideoFrame.from_ndarray(np.ascontiguousarray(image), format='rgb24')
+        for packet in stream.encode(frame):
+            output.mux(packet)
+    for packet in stream.encode(None):
+        output.mux(packet)
+
+
+def encode(audio, rate, fmt='opus'):
+    """Encode mono float32 samples into an in-memory file."""
+    container, codec, mime_type = FORMATS[fmt]
+    if codec == 'libopus' and rate not in (8000, 12000, 16000, 24000, 48000):
+        raise ValueError(f'opus cannot encode at {rate} Hz')
+    buffer = io.BytesIO()
+    with av.open(buffer, 'w', format=container) as output:
+        video = None
+        if mime_type.startswith('video/'):
+            video = output.add_stream('mpeg4', rate=VIDEO_FPS)
+            video.width = video.height = VIDEO_SIZE
+            video.pix_fmt = 'yuv420p'
+        stream = output.add_stream(codec, rate=rate)
+        stream.layout = 'mono'
+        if video:
+            mux_video(output, video, len(audio) / rate)
+        frame = av.AudioFrame.from_ndarray(audio[None, :], format='flt', layout='mono')
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            output.mux(packet)
+        for packet in stream.encode(None):
+            output.mux(packet)
+    return buffer.getvalue()
+
+
+def make_fixture(seconds, rate=48000, fmt='opus', kind='speech', seed=0):
+    """Encoded bytes plus the metadata Telegram would report."""
+    data = encode(synthesize(seconds, rate, kind, seed), rate, fmt)
+    return {
+        'data': data,
+        'duration': int(round(seconds)),
+        'mime_type': FORMATS[fmt][2],
+        'unique_id': f'bench-{kind}-{fmt}-{rate}-{seconds}-{seed}',
+    }
@@ -0,0 +1,252 @@
+"""Drive bot_production.transcribe_audio with stub Telegram objects.
+
+Nothing here touches the network: the stubs hand the fixture bytes to the
+bot and count (but drop) every outgoing Telegram call. Configuration comes
+from the bot's own environment variables, so run one configuration per
+process (see run.py). The tests in tests/ use the same stubs.
+"""
+import asyncio
+import itertools
+import json
+import os
+import resource
+import sys
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+_ids = itertools.count(1)
+
+
+# Replies that mean the request did not produce a transcript
+FAILURE_PREFIXES = ('❌', '🚦', '🛑')
+
+
+class TelegramCalls:
+    """Counts outgoing Bot API calls for one request and spots failure replies."""
+    def __init__(self):
+        self.count = 0
+        self.failed = False
+        self.texts = []  # every text sent or edited, in order
+
+    def record(self, text=None):
+        self.count += 1
+        if text:
+            self.texts.append(text)
+        if text and text.startswith(FAILURE_PREFIXES):
+            self.failed = True
+
+
+class StubMessage:
+    def __init__(self, chat, calls, voice=None, audio=None, video_note=None, video=None, document=None):
+        self.chat = chat
+        self.chat_id = chat.id
+        self.message_id = next(_ids)
+        self.voice = voice
+        self.audio = audio
+        self.video_note = video_note
+        self.video = video
+        self.document = document
+        self.text = None
+        self.caption = None
+        self._calls = calls
+
+    async def reply_text(self, text, **kwargs):
+        self._calls.record(text)
+        return StubMessage(self.chat, self._calls)
+
+    async def edit_text(self, text, **kwargs):
+        self._calls.record(text)
+        self.text = text
+        return self
+
+    async def reply_document(self, document, **kwargs):
+        self._calls.record()
+        return StubMessage(self.chat, self._calls)
+
+    async def delete(self):
+        self._calls.record()
+
+
+class StubChat:
+    def __init__(self, chat_id, calls):
+        self.id = chat_id
+        self.type = 'private'
+        self._calls = calls
+
+    async def send_action(self, action):
+        self._calls.record()
+
+
+class StubFile:
+    def __init__(self, data):
+        self.data = data
+        self.file_size = len(data)
+        self.file_path = 'bench://fixture'
+
+    async def download_as_bytearray(self, buf=None):
+        return bytearray(self.data)
+
+    async def download_to_memory(self, out, **kwargs):
+        out.write(self.data)
+
+
+class StubMedia:
+    def __init__(self, fixture):
+        self._data = fixture['data']
+        self.file_id = fixture['unique_id']
+        self.file_unique_id = fixture['unique_id']
+        self.duration = fixture['duration']
+        self.file_size = len(fixture['data'])
+        self.mime_type = fixture['mime_type']
+
+    async def get_file(self):
+        return StubFile(self._data)
+
+
+class StubBot:
+    def __init__(self, calls):
+        self._calls = calls
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._calls.record(text)
+        return StubMessage(StubChat(chat_id, self._calls), self._calls)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self._calls.record()
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self._calls.record(text)
+
+
+def make_update(user_id, fixture, calls, kind=None):
+    """A voice note (opus), video note (mp4) or audio file update carrying the fixture.
+
+    kind ('voice', 'audio', 'document', ...) overrides the guess from the MIME type.
+    """
+    chat = StubChat(user_id, calls)
+    media = StubMedia(fixture)
+    kind = kind or {'audio/ogg': 'voice', 'video/mp4': 'video_note'}.get(fixture['mime_type'], 'audio')
+    message = StubMessage(chat, calls, **{kind: media})
+    update_id = next(_ids)
+
+    def to_json():
+        # Recorded in the job journal; resume_journal turns it back into an Update
+        return json.dumps({
+            'update_id': update_id,
+            'message': {
+                'message_id': message.message_id, 'date': 0,
+                'chat': {'id': chat.id, 'type': chat.type},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+                kind: {'file_id': media.file_id, 'file_unique_id': media.file_unique_id,
+                       'duration': media.duration or 0},
+            },
+        })
+    return types.SimpleNamespace(
+        update_id=update_id,
+        effective_user=types.SimpleNamespace(id=user_id),
+        effective_chat=chat,
+        effective_message=message,
+        message=message,
+        to_json=to_json,
+    )
+
+
+def make_context(calls):
+    return types.SimpleNamespace(user_data={}, chat_data={}, bot_data={}, bot=StubBot(calls), args=[])
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest child (MB)."""
+    scale = 1024 if sys.platform != 'darwin' else 1  # ru_maxrss is KB on Linux, bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(own / 2**20, 1), round(children / 2**20, 1)
+
+
+def summarize(latencies, durations, wall):
+    latencies_ms = np.array(latencies) * 1000
+    per_request_rtf = np.array(durations) / np.maximum(np.array(latencies), 1e-9)
+    return {
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 1),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 1),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 1),
+            'mean': round(float(latencies_ms.mean()), 1),
+            'max': round(float(latencies_ms.max()), 1),
+        },
+        'rtf': {
+            # audio seconds per second of processing, as on /metrics
+            'aggregate': round(sum(durations) / wall, 2),
+            'p50': round(float(np.percentile(per_request_rtf, 50)), 2),
+        },
+        'throughput_rps': round(len(latencies) / wall, 3),
+    }
+
+
+async def run_load(bot, fixtures, concurrency):
+    """Send every fixture as its own user's message, concurrency at a time."""
+    pending = list(enumerate(fixtures))
+    latencies, durations, failures = [], [], []
+    telegram_calls = 0
+
+    async def sender():
+        nonlocal telegram_calls
+        while pending:
+            index, fixture = pending.pop(0)
+            calls = TelegramCalls()
+            start = time.perf_counter()
+            await bot.transcribe_audio(make_update(10_000 + index, fixture, calls), make_context(calls))
+            elapsed = time.perf_counter() - start
+            telegram_calls += calls.count
+            if calls.failed:
+                failures.append(index)
+                continue
+            latencies.append(elapsed)
+            durations.append(fixture['duration'])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return latencies, durations, failures, wall, telegram_calls
+
+
+def run_config(config):
+    """Benchmark one configuration in this process and return a result dict."""
+    import bot_production as bot
+    from fixtures import make_fixture
+
+    fixtures = [
+        make_fixture(config['duration'], config['rate'], config['format'], config['kind'], seed=index)
+        for index in range(config['requests'])
+    ]
+
+    # Load and warm the model (in every worker process) outside the timed section
+    load_start = time.perf_counter()
+    bot.warm_up()
+    load_seconds = time.perf_counter() - load_start
+    if bot.readiness['state'] != 'ready':
+        raise RuntimeError(f"model warm-up failed: {bot.readiness['error']}")
+
+    latencies, durations, failures, wall, telegram_calls = asyncio.run(
+        run_load(bot, fixtures, config['concurrency'])
+    )
+    rss, rss_children = peak_rss_mb()
+    result = {
+        'config': config,
+        'requests': config['requests'],
+        'ok': len(latencies),
+        'errors': len(failures),
+        'wall_seconds': round(wall, 3),
+        'audio_seconds': sum(durations),
+        'model_load_seconds': round(load_seconds, 2),
+        'telegram_calls_per_request': round(telegram_calls / max(config['requests'], 1), 1),
+        'peak_rss_mb': rss,
+        'peak_rss_children_mb': rss_children,
+    }
+    if latencies:
+        result.update(summarize(latencies, durations, wall))
+    return result
@@ -0,0 +1,148 @@
+"""Benchmark the transcription path offline across a configuration matrix.
+
+Every configuration runs in a fresh process (models, compute type and
+worker pool are fixed at import time) and prints one JSON line:
+
+    python bench/run.py --models tiny,base --beam-sizes 1,5 --concurrency 1,4
+    python bench/run.py --durations 5,60,600 --formats opus,mp3 --output bench-$(git rev-parse --short HEAD).jsonl
+
+Compare two result files with bench/compare.py.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+def split(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configurations(args):
+    axes = itertools.product(
+        split(args.models), split(args.beam_sizes, int), split(args.compute_types),
+        split(args.concurrency, int), split(args.durations, float),
+        split(args.formats), split(args.rates, int)
+    )
+    for model, beam_size, compute_type, concurrency, duration, fmt, rate in axes:
+        yield {
+            'model': model,
+            'beam_size': beam_size,
+            'compute_type': compute_type,
+            'device': args.device,
+            'pool': args.pool,
+            'workers': args.workers,
+            'concurrency': concurrency,
+            'duration': duration,
+            'format': fmt,
+            'rate': rate,
+            'kind': args.kind,
+            'requests': args.requests,
+        }
+
+
+def config_env(config, state_dir):
+    """The bot reads its configuration from the environment."""
+    env = dict(os.environ)
+    env.update({
+        'WHISPER_MODELS': config['model'],
+        'WHISPER_MODEL': config['model'],
+        'WHISPER_BEAM_SIZE': str(config['beam_size']),
+        'WHISPER_COMPUTE_TYPE': config['compute_type'],
+        'WHISPER_DEVICE': config['device'],
+        'WORKER_POOL': config['pool'],
+        'MAX_QUEUE_DEPTH': str(config['requests'] + config['concurrency']),
+        # Keep the configured beam size however deep the benchmark's queue gets
+        'DECODE_BUSY_DEPTH': str(config['requests'] + config['concurrency'] + 1),
+        'CACHE_DB_PATH': os.path.join(state_dir, 'cache.db'),
+        'STATS_DB_PATH': os.path.join(state_dir, 'stats.db'),
+        'EXPORT_DB_PATH': os.path.join(state_dir, 'exports.db'),
+        'JOB_QUEUE_PATH': os.path.join(state_dir, 'jobs.db'),
+        'JOURNAL_DB_PATH': os.path.join(state_dir, 'journal.db'),
+    })
+    if config['workers']:
+        env['WORKER_COUNT'] = str(config['workers'])
+    return env
+
+
+def run_isolated(config, verbose=False):
+    with tempfile.TemporaryDirectory(prefix='bench-') as state_dir:
+        process = subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, 'run.py'), '--single', json.dumps(config)],
+            env=config_env(config, state_dir), cwd=state_dir,
+            stdout=subprocess.PIPE, stderr=None if verbose else subprocess.PIPE, text=True
+        )
+    if process.returncode != 0:
+        tail = (process.stderr or '').strip().splitlines()[-5:]
+        return {'config': config, 'error': ' | '.join(tail) or f'exit code {process.returncode}'}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', default='base', help='comma-separated Whisper models')
+    parser.add_argument('--beam-sizes', default='5')
+    parser.add_argument('--compute-types', default='auto', help='e.g. int8,int8_float32,float32,float16')
+    parser.add_argument('--concurrency', default='1', help='simultaneous users sending audio')
+    parser.add_argument('--durations', default='10', help='fixture length in seconds')
+    parser.add_argument('--formats', default='opus', help='opus,mp3,m4a,flac,wav,mp4 (video note)')
+    parser.add_argument('--rates', default='48000', help='fixture sample rates')
+    parser.add_argument('--kind', default='speech', choices=('speech', 'tone', 'noise'))
+    parser.add_argument('--requests', type=int, default=8, help='messages per configuration')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--pool', default='thread', choices=('thread', 'process', 'queue'))
+    parser.add_argument('--workers', type=int, default=0, help='WORKER_COUNT (0 = bot default)')
+    parser.add_argument('--output', help='append JSON lines here as well as to stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the bot log')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        from harness import run_config
+        print(json.dumps(run_config(json.loads(args.single))))
+        return
+
+    meta = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+    output = open(args.output, 'a', encoding='utf-8') if args.output else None
+    try:
+        for config in configurations(args):
+            record = {
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                **meta,
+                **run_isolated(config, args.verbose),
+            }
+            line = json.dumps(record)
+            print(line, flush=True)
+            if output:
+                output.write(line + '\n')
+                output.flush()
+    finally:
+        if output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,31 @@ import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from telegram.constants import ChatAction
-import tempfile
+from telegram.error import RetryAfter, TelegramError
 import time
 from datetime import datetime
 import json
-from faster_whisper import WhisperModel
-import torch
-from pydub import AudioSegment
+import io
+import hashlib
+import re
+import sqlite3
+import zlib
+import pickle
+import multiprocessing
+import atexit
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from contextlib import contextmanager, aclosing, suppress
 import numpy as np
-from threading import Thread
-from flask import Flask
+from threading import Thread, Event, Lock, Condition
+from http import HTTPStatus
+import hmac
+import httpx
+import secrets
+import tempfile
+import signal
+from bisect import bisect_right
 
 # Enable logging
 logging.basicConfig(
@@ -22,46 +37,1878 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Flask app for health checks (Render requirement)
-app = Flask(__name__)
+# Deployment mode: 'polling' (default, works anywhere) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+HTTP_PORT = int(os.getenv('PORT', 10000))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', 256))
+HTTP_MAX_BODY = 1024 * 1024
+HTTP_IDLE_TIMEOUT = 75
+
+# One asyncio HTTP server for health checks (Render requirement) and webhook updates
+http_routes = {}
+
+def http_route(path, methods=('GET',)):
+    """Register an async handler: handler(request) -> (body, status)."""
+    def decorator(func):
+        http_routes[path] = (methods, func)
+        return func
+    return decorator
 
-@app.route('/')
-def health_check():
+class HttpRequest:
+    __slots__ = ('method', 'path', 'headers', 'body')
+    
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+@http_route('/')
+async def health_check(request):
     return "Bot is running!", 200
 
-@app.route('/health')
-def health():
-    return {"status": "healthy", "bot": "AI Transcription Bot"}, 200
+@http_route('/health')
+async def health(request):
+    # Liveness: always 200 once the process is up; the status field says
+    # whether the model is still loading ("starting"/"warming") or "ready"
+    return {
+        "status": readiness['state'],
+        "bot": "AI Transcription Bot",
+        "mode": BOT_MODE,
+        "uptime": round(time.time() - readiness['since'], 1),
+        "queue_depth": scheduler.depth,
+        "in_flight": scheduler.in_flight,
+        # Worker processes load their own models; the bot process holds none
+        "models": models.resident() if scheduler.pool_kind == 'thread' else None,
+        "batching": scheduler.batch_report()
+    }, 200
 
-def run_flask():
-    """Run Flask in separate thread"""
-    port = int(os.getenv('PORT', 10000))
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+@http_route('/ready')
+async def ready(request):
+    """Readiness: 503 until the default model is loaded and warmed up."""
+    code = 200 if readiness['state'] == 'ready' else 503
+    return {"status": readiness['state'], "error": readiness['error']}, code
 
-# Initialize Faster-Whisper model (runs locally, 100% FREE!)
-# Using 'base' model for Railway (lighter). For local: use 'large-v3'
-device = "cuda" if torch.cuda.is_available() else "cpu"
-compute_type = "float16" if device == "cuda" else "int8"
+@http_route('/metrics')
+async def metrics_endpoint(request):
+    """Prometheus text exposition format."""
+    return metrics.render(), 200
+
+class WebhookReceiver:
+    """Receives Telegram webhook POSTs and runs the updates with bounded concurrency.
+    
+    At most `concurrency` updates are processed at once. Once `max_pending`
+    updates are waiting or running we answer 503, and Telegram redelivers
+    later instead of us buffering without bound.
+    """
+    
+    def __init__(self, bot, process_update, secret, concurrency, max_pending):
+        self.bot = bot
+        self.process_update = process_update
+        self.secret = secret
+        self.max_pending = max_pending
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+    
+    @property
+    def pending(self):
+        return len(self.tasks)
+    
+    async def handle(self, request):
+        if self.secret and not hmac.compare_digest(
+                request.headers.get('x-telegram-bot-api-secret-token', ''), self.secret):
+            logger.warning('Webhook call with a bad secret token rejected')
+            return {"error": "forbidden"}, 403
+        if self.pending >= self.max_pending:
+            return {"error": "busy"}, 503
+        try:
+            update = Update.de_json(json.loads(request.body), self.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f'Malformed webhook update: {e}')
+            return {"error": "bad update"}, 400
+        task = asyncio.create_task(self._run(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return "", 200
+    
+    async def _run(self, update):
+        async with self.semaphore:
+            try:
+                await self.process_update(update)
+            except Exception as e:
+                logger.error(f'Update {update.update_id} failed: {e}')
+    
+    async def drain(self):
+        """Wait for accepted updates to finish."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
 
-logger.info(f"Loading Whisper model on {device}...")
-model = WhisperModel("base", device=device, compute_type=compute_type)
-logger.info("Model loaded successfully!")
+def http_response(body, status):
+    reason = HTTPStatus(status).phrase
+    if isinstance(body, (dict, list)):
+        payload = json.dumps(body).encode()
+        content_type = 'application/json'
+    else:
+        payload = body.encode()
+        content_type = 'text/plain; charset=utf-8'
+    head = (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n"
+    )
+    return head.encode() + payload
 
-# User stats storage
-user_stats = {}
+async def read_request(reader):
+    """Parse one HTTP/1.1 request; None on a closed connection."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HTTP_IDLE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError('request head too large')
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > HTTP_MAX_BODY:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return HttpRequest(method, target.split('?', 1)[0], headers, body)
+
+async def serve_http_connection(reader, writer):
+    """Serve keep-alive requests on one connection until the client closes it."""
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(http_response({"error": "bad request"}, 400))
+                break
+            if request is None:
+                break
+            methods, handler = http_routes.get(request.path, (None, None))
+            if handler is None:
+                body, status = {"error": "not found"}, 404
+            elif request.method not in methods:
+                body, status = {"error": "method not allowed"}, 405
+            else:
+                try:
+                    body, status = await handler(request)
+                except Exception as e:
+                    logger.error(f'HTTP handler error on {request.path}: {e}')
+                    body, status = {"error": "internal error"}, 500
+            writer.write(http_response(body, status))
+            await writer.drain()
+            if request.headers.get('connection', '').lower() == 'close':
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(port=HTTP_PORT):
+    server = await asyncio.start_server(serve_http_connection, '0.0.0.0', port)
+    logger.info(f'HTTP server listening on port {port}')
+    return server
+
+
+# Transcription worker pool settings
+# WORKER_POOL: 'thread' (shared model, cancellable), 'process' (one model per process)
+# or 'queue' (worker processes fed through a durable SQLite job queue)
+WORKER_POOL = os.getenv('WORKER_POOL', 'thread')
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 2))
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', 20))
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 64))
+
+# Queue workers: each takes one job at a time under a lease it keeps renewing
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'job_queue.db')
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 30))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_POLL_INTERVAL = 0.02
+WORKER_PIN_CPUS = os.getenv('WORKER_PIN_CPUS', 'true').lower() == 'true'  # give each worker its own cores
+WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', 0))  # 0: CTranslate2 default, queue workers use their cores
+
+# Job journal: accepted transcriptions survive a restart and resume on startup
+JOURNAL_DB_PATH = os.getenv('JOURNAL_DB_PATH', 'transcription_journal.db')
+JOURNAL_MAX_ATTEMPTS = int(os.getenv('JOURNAL_MAX_ATTEMPTS', 3))  # runs per job, resumes included
+JOURNAL_MAX_AGE_HOURS = float(os.getenv('JOURNAL_MAX_AGE_HOURS', 6))  # older jobs are dropped, not resumed
+SHUTDOWN_GRACE_SECONDS = float(os.getenv('SHUTDOWN_GRACE_SECONDS', 20))  # let running jobs finish on SIGTERM
+
+# Long-form mode: split at VAD silences and transcribe chunks in parallel
+LONG_AUDIO_SECONDS = int(os.getenv('LONG_AUDIO_SECONDS', 300))
+CHUNK_SECONDS = int(os.getenv('CHUNK_SECONDS', 120))
+CHUNK_OVERLAP_SECONDS = float(os.getenv('CHUNK_OVERLAP_SECONDS', 1.0))
+
+# Live partial transcripts in the status message (thread pool only)
+STREAM_PARTIAL_RESULTS = os.getenv('STREAM_PARTIAL_RESULTS', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 3.0))
+STREAM_PREVIEW_CHARS = 3500
+
+# Outgoing message rate limits (Telegram: ~30 msg/s overall, ~1/s per chat, 20/min per group)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 25))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1.0))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', 20 / 60))
+TELEGRAM_MESSAGE_LIMIT = 4096
+LONG_TEXT_MAX_MESSAGES = int(os.getenv('LONG_TEXT_MAX_MESSAGES', 3))
+
+# Micro-batching of short clips into one encoder/decoder pass
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 8))
+BATCH_MAX_WAIT_MS = int(os.getenv('BATCH_MAX_WAIT_MS', 30))
+BATCH_MAX_SECONDS = 30  # one Whisper window
+
+# Admission and download limits (the cloud Bot API serves files up to 20 MB)
+MAX_DOWNLOAD_MB = float(os.getenv('MAX_DOWNLOAD_MB', 20))
+MAX_AUDIO_SECONDS = int(os.getenv('MAX_AUDIO_SECONDS', 3 * 3600))
+DOWNLOAD_CHUNK_KB = int(os.getenv('DOWNLOAD_CHUNK_KB', 256))
+STREAM_DECODE_MIN_MB = float(os.getenv('STREAM_DECODE_MIN_MB', 2))  # overlap download and decode above this
+
+# Per-sender limits, charged in audio seconds (token buckets kept in the stats store,
+# so replicas sharing STATS_DB_PATH share them). A rate of 0 turns that limit off.
+USER_AUDIO_MINUTES_PER_HOUR = float(os.getenv('USER_AUDIO_MINUTES_PER_HOUR', 60))
+USER_AUDIO_BURST_MINUTES = float(os.getenv('USER_AUDIO_BURST_MINUTES', 30))
+CHAT_AUDIO_MINUTES_PER_HOUR = float(os.getenv('CHAT_AUDIO_MINUTES_PER_HOUR', 180))  # groups only
+CHAT_AUDIO_BURST_MINUTES = float(os.getenv('CHAT_AUDIO_BURST_MINUTES', 60))
+RATE_LIMIT_MAX_DEFER_SECONDS = float(os.getenv('RATE_LIMIT_MAX_DEFER_SECONDS', 120))  # longer waits are refused
+# Transcriptions downloading, queued or running at once in this process
+MAX_ACTIVE_TRANSCRIPTIONS = int(os.getenv('MAX_ACTIVE_TRANSCRIPTIONS', WORKER_COUNT + MAX_QUEUE_DEPTH))
+PREMIUM_QUEUE_WEIGHT = float(os.getenv('PREMIUM_QUEUE_WEIGHT', 2))  # share of the workers vs other users
+
+# Preprocessing between decode and inference: silence trimming and loudness normalization
+PREPROCESS_AUDIO = os.getenv('PREPROCESS_AUDIO', 'true').lower() == 'true'
+SILENCE_THRESHOLD_DB = float(os.getenv('SILENCE_THRESHOLD_DB', -40))  # relative to the speech level
+SILENCE_MAX_SECONDS = float(os.getenv('SILENCE_MAX_SECONDS', 2.0))  # longer pauses are shortened
+SILENCE_KEEP_SECONDS = 0.5  # kept around speech on each side of a cut
+NORMALIZE_PEAK = 0.9
+NORMALIZE_RMS = 0.1  # -20 dBFS speech level
+NORMALIZE_MAX_GAIN = 10.0  # +20 dB, so near-silent noise is not blown up
+
+# Transcription result cache
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'transcription_cache.db')
+CACHE_MEMORY_ITEMS = int(os.getenv('CACHE_MEMORY_ITEMS', 256))
+CACHE_MAX_ITEMS = int(os.getenv('CACHE_MAX_ITEMS', 5000))
+CACHE_MAX_AGE_DAYS = float(os.getenv('CACHE_MAX_AGE_DAYS', 30))
+
+# Recent transcriptions kept for /export
+EXPORT_DB_PATH = os.getenv('EXPORT_DB_PATH', 'transcription_exports.db')
+EXPORT_HISTORY = int(os.getenv('EXPORT_HISTORY', 5))  # per user
+EXPORT_MAX_AGE_DAYS = float(os.getenv('EXPORT_MAX_AGE_DAYS', 7))
+
+# User statistics: 'sqlite' (shared, persistent) or 'memory'
+STATS_BACKEND = os.getenv('STATS_BACKEND', 'sqlite')
+STATS_DB_PATH = os.getenv('STATS_DB_PATH', 'bot_stats.db')
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 2.0))
+
+# Language resolution: a user's usual language (from their stats) is the prior
+LANGUAGE_PRIOR_SHARE = float(os.getenv('LANGUAGE_PRIOR_SHARE', 0.8))  # share of past files
+LANGUAGE_PRIOR_MIN_COUNT = int(os.getenv('LANGUAGE_PRIOR_MIN_COUNT', 5))
+LANGUAGE_MIN_PROBABILITY = float(os.getenv('LANGUAGE_MIN_PROBABILITY', 0.5))
+LANGUAGE_DETECTION_WINDOWS = int(os.getenv('LANGUAGE_DETECTION_WINDOWS', 3))  # full detection, 30 s each
+
+# Model tiers, smallest first, with rough resident size in MB
+MODEL_TIERS = ['tiny', 'base', 'small', 'medium', 'large-v3']
+MODEL_SIZES_MB = {'tiny': 150, 'base': 300, 'small': 800, 'medium': 2000, 'large-v3': 3800}
+ENABLED_MODELS = [name.strip() for name in os.getenv('WHISPER_MODELS', 'tiny,base,small').split(',')]
+DEFAULT_MODEL = os.getenv('WHISPER_MODEL', 'base')
+PREMIUM_MODEL = os.getenv('PREMIUM_MODEL', 'small')
+PREMIUM_USER_IDS = {int(uid) for uid in os.getenv('PREMIUM_USER_IDS', '').split(',') if uid.strip()}
+# Memory budget for all resident models; process and queue workers each load their
+# own, so each gets an equal share (see the `models` manager below)
+MODEL_MEMORY_BUDGET_MB = int(os.getenv('MODEL_MEMORY_BUDGET_MB', 1500))
+DEEP_QUEUE_THRESHOLD = int(os.getenv('DEEP_QUEUE_THRESHOLD', 8))
+
+# Faster-Whisper models run locally, 100% FREE! Loaded on first use by ModelManager.
+# 'base' is the default for Railway (lighter). For local: WHISPER_MODEL=large-v3
+# faster_whisper/ctranslate2 are imported lazily so the bot and /health come up
+# immediately; the default model is loaded and warmed in the background.
+WHISPER_DEVICE = os.getenv('WHISPER_DEVICE', 'auto')
+WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', 'auto')  # int8 on CPU, float16 on GPU
+_device_config = None
+
+# starting -> warming -> ready (or failed), reported by /health and /ready
+readiness = {'state': 'starting', 'since': time.time(), 'error': None}
+
+def get_device():
+    """Resolve (device, compute_type) once; CTranslate2 reports CUDA without torch."""
+    global _device_config
+    if _device_config is None:
+        device = WHISPER_DEVICE
+        if device == 'auto':
+            import ctranslate2
+            device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        compute_type = WHISPER_COMPUTE_TYPE
+        if compute_type == 'auto':
+            compute_type = "float16" if device == "cuda" else "int8"
+        _device_config = (device, compute_type)
+    return _device_config
+
+# Decode policy (choose_decode_options): beam search with temperature fallback
+# by default, greedy decoding when the queue is deep or the file is very long
+WHISPER_BEAM_SIZE = int(os.getenv('WHISPER_BEAM_SIZE', 5))
+DECODE_BUSY_DEPTH = int(os.getenv('DECODE_BUSY_DEPTH', 4))  # queue depth at which jobs decode greedily
+DECODE_GREEDY_SECONDS = int(os.getenv('DECODE_GREEDY_SECONDS', 1800))
+TEMPERATURE_FALLBACK = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+def choose_decode_options(duration, queue_depth, subtitles):
+    """Decode settings for one job: (policy name, transcribe() options).
+
+    Word timings cost an extra alignment pass, so they are only computed
+    for users who asked for subtitles (/subtitles on). A deep queue or a
+    very long file gets greedy decoding without temperature fallback or
+    conditioning on the previous text: its cost stays bounded, and a
+    repetition loop cannot carry over from one window into the next.
+    """
+    if queue_depth >= DECODE_BUSY_DEPTH:
+        name = 'greedy-busy'
+    elif duration >= DECODE_GREEDY_SECONDS:
+        name = 'greedy-long'
+    else:
+        name = 'beam'
+    greedy = name != 'beam'
+    return name, {
+        'vad_filter': True,  # Voice activity detection
+        'word_timestamps': subtitles,
+        'beam_size': 1 if greedy else WHISPER_BEAM_SIZE,
+        'temperature': 0.0 if greedy else TEMPERATURE_FALLBACK,
+        'condition_on_previous_text': not greedy
+    }
+
+class Metrics:
+    """Prometheus-style counters, gauges and histograms, rendered as text.
+    
+    Thread-safe. Gauges are callbacks read at scrape time. Worker processes
+    cannot reach this registry, so workers return their stage timings with
+    their results and the event loop records them.
+    """
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._meta = {}  # name -> (kind, help, buckets or gauge callback)
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+    
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+    
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, buckets)
+    
+    def gauge(self, name, help_text, func):
+        self._meta[name] = ('gauge', help_text, func)
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.setdefault(key, [0] * len(buckets) + [0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    def observe_stages(self, timings):
+        for stage, seconds in timings.items():
+            self.observe('transcription_stage_seconds', seconds, stage=stage)
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+    
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(state) for key, state in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text, extra) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                lines.append(f'{name} {extra()}')
+            elif kind == 'counter':
+                for (metric, labels), value in counters.items():
+                    if metric == name:
+                        lines.append(f'{name}{self._labels(labels)} {value}')
+            else:
+                for (metric, labels), state in histograms.items():
+                    if metric != name:
+                        continue
+                    for bound, count in zip(extra, state):
+                        lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {count}')
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {state[-1]}')
+                    lines.append(f'{name}_sum{self._labels(labels)} {state[-2]:.6f}')
+                    lines.append(f'{name}_count{self._labels(labels)} {state[-1]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.histogram(
+    'transcription_stage_seconds',
+    'Time spent per pipeline stage (download, queue_wait, decode, preprocess, vad, language_detection, prepare, inference, reply)'
+)
+metrics.histogram(
+    'transcription_realtime_factor',
+    'Audio seconds transcribed per second of processing, by decode policy',
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+metrics.histogram(
+    'transcription_batch_size',
+    'Clips per micro-batch run; compare with BATCH_SIZE to tune BATCH_MAX_WAIT_MS',
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+metrics.counter('transcriptions_total', 'Handled audio messages by outcome')
+metrics.counter('transcription_cache_lookups_total', 'Result cache lookups by layer and result')
+metrics.counter('transcription_errors_total', 'Failed transcriptions by exception type')
+metrics.counter('queue_worker_restarts_total', 'Queue worker processes restarted after dying')
+metrics.counter('audio_trimmed_seconds_total', 'Seconds of silence cut before inference')
+metrics.counter('language_resolutions_total', 'How the language was chosen (override, detected, prior, fallback)')
+metrics.counter('decode_policy_total', 'Transcribed files by decode policy (beam, greedy-busy, greedy-long)')
+metrics.counter('rate_limited_total', 'Messages deferred or refused by the per-user and per-group audio limits')
+metrics.counter('journal_jobs_total', 'Interrupted jobs found in the journal at startup, resumed or dropped')
+
+# Stages a worker spends on a file; the real-time factor is measured over these,
+# so time waiting in the queue or deferred by a rate limit does not count
+PROCESSING_STAGES = ('decode', 'preprocess', 'vad', 'language_detection', 'prepare', 'inference')
+
+@contextmanager
+def timed(timings, stage):
+    """Add the time spent in the block to timings[stage]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+class ModelManager:
+    """Lazily loads Whisper models and keeps the most recently used resident.
+
+    Models are loaded on first use. Before a load, least recently used models
+    that no job is currently using are evicted until the new model fits in
+    the memory budget; if the models in use leave no room, the load waits
+    until one is given back. A model larger than the whole budget is refused.
+    """
+    def __init__(self, budget_mb):
+        self.budget_mb = budget_mb
+        self._loaded = OrderedDict()  # name -> {'model', 'users', 'size'}; model is None while loading
+        self._lock = Lock()
+        self._room = Condition(self._lock)
+        self._load_locks = {}
+
+    def _load(self, name):
+        from faster_whisper import WhisperModel
+        device, compute_type = get_device()
+        logger.info(f"Loading Whisper model '{name}' on {device}...")
+        started = time.time()
+        # num_workers lets concurrent transcribe() calls from the thread pool run in parallel
+        loaded = WhisperModel(
+            name,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=WHISPER_CPU_THREADS,
+            num_workers=WORKER_COUNT if WORKER_POOL == 'thread' else 1
+        )
+        logger.info(f"Model '{name}' loaded in {time.time() - started:.1f}s")
+        return loaded
+
+    def _checkout_loaded(self, name):
+        entry = self._loaded.get(name)
+        if entry is None or entry['model'] is None:
+            return None
+        self._loaded.move_to_end(name)
+        entry['users'] += 1
+        return entry['model']
+
+    def _make_room(self, size):
+        """Evict idle models until size fits. False if models in use leave no room."""
+        used = sum(entry['size'] for entry in self._loaded.values())
+        for name in list(self._loaded):
+            if used + size <= self.budget_mb:
+                break
+            entry = self._loaded[name]
+            if entry['users'] == 0:
+                del self._loaded[name]
+                used -= entry['size']
+                logger.info(f"Evicted Whisper model '{name}' to stay within {self.budget_mb}MB")
+        return used + size <= self.budget_mb
+
+    def _checkout(self, name):
+        with self._lock:
+            loaded = self._checkout_loaded(name)
+            if loaded is not None:
+                return loaded
+            load_lock = self._load_locks.setdefault(name, Lock())
+        with load_lock:
+            with self._lock:
+                loaded = self._checkout_loaded(name)
+                if loaded is not None:
+                    return loaded
+                size = MODEL_SIZES_MB.get(name, 0)
+                if size > self.budget_mb:
+                    raise RuntimeError(f"Whisper model '{name}' ({size}MB) does not fit the {self.budget_mb}MB model budget")
+                if not self._make_room(size):
+                    logger.info(f"Waiting for a model to be released before loading '{name}'")
+                    while not self._make_room(size):
+                        self._room.wait()
+                # Reserve the room while loading, so a concurrent load of another model cannot take it
+                entry = self._loaded[name] = {'model': None, 'users': 1, 'size': size}
+            # Slow part happens outside the manager lock
+            try:
+                entry['model'] = self._load(name)
+            except BaseException:
+                with self._lock:
+                    del self._loaded[name]
+                    self._room.notify_all()
+                raise
+            return entry['model']
 
+    def _release(self, name):
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                entry['users'] -= 1
+                self._room.notify_all()
+
+    @contextmanager
+    def use(self, name):
+        """Borrow a model; it cannot be evicted until the block exits."""
+        loaded = self._checkout(name)
+        try:
+            yield loaded
+        finally:
+            self._release(name)
+
+    def resident(self):
+        with self._lock:
+            return [name for name, entry in self._loaded.items() if entry['model'] is not None]
+
+models = ModelManager(MODEL_MEMORY_BUDGET_MB // (WORKER_COUNT if WORKER_POOL != 'thread' else 1))
+
+def route_model(duration, queue_depth, user_id):
+    """Pick the model tier for a job.
+
+    Premium users start at PREMIUM_MODEL, everyone else at DEFAULT_MODEL.
+    Long files and a deep queue each step down a tier so the backlog drains
+    faster. The result is always one of ENABLED_MODELS, and fits the
+    model budget of the process that will run it.
+    """
+    wanted = PREMIUM_MODEL if user_id in PREMIUM_USER_IDS else DEFAULT_MODEL
+    tier = MODEL_TIERS.index(wanted) if wanted in MODEL_TIERS else 1
+    if duration >= LONG_AUDIO_SECONDS:
+        tier -= 1
+    if queue_depth >= DEEP_QUEUE_THRESHOLD:
+        tier -= 1
+    if queue_depth >= 2 * DEEP_QUEUE_THRESHOLD:
+        tier -= 1
+    enabled = [
+        name for name in MODEL_TIERS if name in ENABLED_MODELS and MODEL_SIZES_MB[name] <= models.budget_mb
+    ] or [DEFAULT_MODEL]
+    fitting = [name for name in enabled if MODEL_TIERS.index(name) <= max(tier, 0)]
+    return fitting[-1] if fitting else enabled[0]
+
+def model_display_name(name):
+    return f"Whisper-{name.capitalize()}"
+
+# User stats storage
 class TranscriptionStats:
+    """Aggregated usage of one user. Languages are counted by code."""
+    __slots__ = ('total_transcriptions', 'total_duration', 'languages', 'models', 'first_use', 'last_use')
+
     def __init__(self):
         self.total_transcriptions = 0
         self.total_duration = 0
-        self.languages = {}
+        self.languages = Counter()
+        self.models = Counter()
         self.first_use = datetime.now()
         self.last_use = datetime.now()
 
-def get_user_stats(user_id):
-    if user_id not in user_stats:
-        user_stats[user_id] = TranscriptionStats()
-    return user_stats[user_id]
+    def add(self, count, duration, languages, models_used, first_use, last_use):
+        if not self.total_transcriptions or first_use < self.first_use:
+            self.first_use = first_use
+        if not self.total_transcriptions or last_use > self.last_use:
+            self.last_use = last_use
+        self.total_transcriptions += count
+        self.total_duration += duration
+        self.languages.update(languages)
+        self.models.update(models_used)
+
+def charge_buckets(levels, buckets, cost, now, max_wait):
+    """Token-bucket step shared by the stats backends.
+
+    levels maps key -> (tokens, updated) for the buckets stored so far; new
+    ones start full. As with TokenBucket, a charge is a reservation: the
+    balance may go negative and the caller waits until its share would have
+    refilled (a file longer than the burst only needs a full bucket).
+    Returns the new levels, or None if the wait would exceed max_wait, and
+    the wait in seconds. A negative cost refunds.
+    """
+    wait = 0.0
+    refilled = {}
+    for key, rate, capacity in buckets:
+        tokens, updated = levels.get(key, (capacity, now))
+        refilled[key] = min(capacity, tokens + max(now - updated, 0) * rate)
+        wait = max(wait, (min(cost, capacity) - refilled[key]) / rate)
+    if wait > max_wait:
+        return None, wait
+    return {key: (min(capacity, refilled[key] - cost), now) for key, _, capacity in buckets}, wait
+
+class StatsBackend:
+    """Interface for user statistics storage.
+
+    record() is called on the transcription hot path and must not block;
+    load() may do I/O and is called through asyncio.to_thread.
+    """
+    def record(self, user_id, duration, language, model_name):
+        raise NotImplementedError
+
+    def load(self, user_id):
+        raise NotImplementedError
+
+    def load_preferences(self, user_id):
+        """Settings chosen with commands such as /lang, as a dict."""
+        raise NotImplementedError
+
+    def save_preference(self, user_id, key, value):
+        """Store one setting; None removes it."""
+        raise NotImplementedError
+
+    def take_tokens(self, buckets, cost, max_wait=float('inf')):
+        """Charge cost to every (key, rate, capacity) bucket, all or none.
+
+        Returns (taken, seconds to wait), see charge_buckets().
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+class MemoryStatsBackend(StatsBackend):
+    """Process-local stats, lost on restart. For development and tests."""
+    def __init__(self):
+        self._stats = {}
+        self._preferences = {}
+        self._buckets = {}
+        self._lock = Lock()
+
+    def record(self, user_id, duration, language, model_name):
+        now = datetime.now()
+        with self._lock:
+            stats = self._stats.setdefault(user_id, TranscriptionStats())
+            stats.add(1, duration, {language: 1}, {model_name: 1}, now, now)
+
+    def load(self, user_id):
+        result = TranscriptionStats()
+        with self._lock:
+            stats = self._stats.get(user_id)
+            if stats is not None:
+                result.add(stats.total_transcriptions, stats.total_duration, stats.languages,
+                           stats.models, stats.first_use, stats.last_use)
+        return result
+
+    def load_preferences(self, user_id):
+        with self._lock:
+            return dict(self._preferences.get(user_id, {}))
+
+    def save_preference(self, user_id, key, value):
+        with self._lock:
+            preferences = self._preferences.setdefault(user_id, {})
+            if value is None:
+                preferences.pop(key, None)
+            else:
+                preferences[key] = value
+
+    def take_tokens(self, buckets, cost, max_wait=float('inf')):
+        with self._lock:
+            levels, wait = charge_buckets(self._buckets, buckets, cost, time.time(), max_wait)
+            if levels is not None:
+                self._buckets.update(levels)
+        return levels is not None, wait
+
+class SQLiteStatsBackend(StatsBackend):
+    """Stats in a shared SQLite database (WAL mode) with batched writes.
+
+    record() only adds to in-memory deltas; a background thread merges them
+    into per-user aggregate rows every flush interval with additive upserts,
+    so several bot replicas can share one database file.
+    """
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = {}  # user_id -> TranscriptionStats delta
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._db = None
+        self._flusher = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(
+            'CREATE TABLE IF NOT EXISTS user_stats ('
+            '  user_id INTEGER PRIMARY KEY, transcriptions INTEGER NOT NULL,'
+            '  duration REAL NOT NULL, first_use REAL NOT NULL, last_use REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS user_counts ('
+            '  user_id INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL,'
+            '  count INTEGER NOT NULL, PRIMARY KEY (user_id, kind, name));'
+            'CREATE TABLE IF NOT EXISTS user_preferences ('
+            '  user_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,'
+            '  PRIMARY KEY (user_id, key));'
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            '  key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);'
+        )
+        return db
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self._connect()
+        return self._db
+
+    def record(self, user_id, duration, language, model_name):
+        now = datetime.now()
+        with self._lock:
+            delta = self._pending.setdefault(user_id, TranscriptionStats())
+            delta.add(1, duration, {language: 1}, {model_name: 1}, now, now)
+            if self._flusher is None:
+                self._flusher = Thread(target=self._flush_loop, daemon=True, name='stats-flush')
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f'Stats flush failed, will retry: {e}')
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with self.db:
+                    self.db.executemany(
+                        'INSERT INTO user_stats VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET '
+                        '  transcriptions = transcriptions + excluded.transcriptions,'
+                        '  duration = duration + excluded.duration,'
+                        '  first_use = MIN(first_use, excluded.first_use),'
+                        '  last_use = MAX(last_use, excluded.last_use)',
+                        [(user_id, d.total_transcriptions, d.total_duration,
+                          d.first_use.timestamp(), d.last_use.timestamp())
+                         for user_id, d in pending.items()]
+                    )
+                    self.db.executemany(
+                        'INSERT INTO user_counts VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT(user_id, kind, name) DO UPDATE SET count = count + excluded.count',
+                        [(user_id, kind, name, count)
+                         for user_id, d in pending.items()
+                         for kind, counter in (('language', d.languages), ('model', d.models))
+                         for name, count in counter.items()]
+                    )
+            except sqlite3.Error:
+                # Put the deltas back so nothing is lost
+                with self._lock:
+                    for user_id, d in pending.items():
+                        self._pending.setdefault(user_id, TranscriptionStats()).add(
+                            d.total_transcriptions, d.total_duration, d.languages,
+                            d.models, d.first_use, d.last_use)
+                raise
+
+    def load(self, user_id):
+        result = TranscriptionStats()
+        with self._flush_lock:
+            row = self.db.execute(
+                'SELECT transcriptions, duration, first_use, last_use FROM user_stats WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()
+            counts = self.db.execute(
+                'SELECT kind, name, count FROM user_counts WHERE user_id = ?', (user_id,)
+            ).fetchall()
+            # Include writes that have not been flushed yet. Read under the
+            # flush lock too, or a flush in between would leave them out.
+            with self._lock:
+                delta = self._pending.get(user_id)
+                if delta is not None:
+                    result.add(delta.total_transcriptions, delta.total_duration, delta.languages,
+                               delta.models, delta.first_use, delta.last_use)
+        if row is not None:
+            result.add(
+                row[0], row[1],
+                {name: count for kind, name, count in counts if kind == 'language'},
+                {name: count for kind, name, count in counts if kind == 'model'},
+                datetime.fromtimestamp(row[2]), datetime.fromtimestamp(row[3])
+            )
+        return result
+
+    def load_preferences(self, user_id):
+        # Preferences are written straight through: they are rare and must survive a crash
+        with self._flush_lock:
+            rows = self.db.execute(
+                'SELECT key, value FROM user_preferences WHERE user_id = ?', (user_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def save_preference(self, user_id, key, value):
+        with self._flush_lock, self.db:
+            if value is None:
+                self.db.execute('DELETE FROM user_preferences WHERE user_id = ? AND key = ?', (user_id, key))
+            else:
+                self.db.execute(
+                    'INSERT INTO user_preferences VALUES (?, ?, ?) '
+                    'ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value',
+                    (user_id, key, value)
+                )
+
+    def take_tokens(self, buckets, cost, max_wait=float('inf')):
+        # Read and charged in one IMMEDIATE transaction, so replicas never both spend a token
+        keys = [key for key, _, _ in buckets]
+        with self._flush_lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.db.execute(
+                    f"SELECT key, tokens, updated FROM rate_limits WHERE key IN ({','.join('?' * len(keys))})",
+                    keys
+                ).fetchall()
+                levels, wait = charge_buckets(
+                    {key: (tokens, updated) for key, tokens, updated in rows}, buckets, cost, time.time(), max_wait
+                )
+                if levels is not None:
+                    self.db.executemany(
+                        'INSERT INTO rate_limits VALUES (?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                        [(key, tokens, updated) for key, (tokens, updated) in levels.items()]
+                    )
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+        return levels is not None, wait
+
+if STATS_BACKEND == 'memory':
+    stats_store = MemoryStatsBackend()
+else:
+    stats_store = SQLiteStatsBackend(STATS_DB_PATH, STATS_FLUSH_INTERVAL)
+atexit.register(stats_store.flush)
+
+async def get_user_stats(user_id):
+    return await asyncio.to_thread(stats_store.load, user_id)
+
+async def get_user_preferences(user_id):
+    return await asyncio.to_thread(stats_store.load_preferences, user_id)
+
+async def set_user_preference(user_id, key, value):
+    await asyncio.to_thread(stats_store.save_preference, user_id, key, value)
+
+def audio_buckets(user_id, chat):
+    """The (key, audio seconds per second, capacity) limits a message is charged to."""
+    buckets = []
+    if USER_AUDIO_MINUTES_PER_HOUR > 0:
+        buckets.append((f'user:{user_id}', USER_AUDIO_MINUTES_PER_HOUR / 60, USER_AUDIO_BURST_MINUTES * 60))
+    if CHAT_AUDIO_MINUTES_PER_HOUR > 0 and chat.type != 'private':
+        buckets.append((f'chat:{chat.id}', CHAT_AUDIO_MINUTES_PER_HOUR / 60, CHAT_AUDIO_BURST_MINUTES * 60))
+    return buckets
+
+async def take_audio_tokens(buckets, seconds, max_wait=float('inf')):
+    return await asyncio.to_thread(stats_store.take_tokens, buckets, seconds, max_wait)
+
+def resolve_language(preferences, stats):
+    """Language stage: (forced language, prior) for a user's next file.
+
+    Takes the user's loaded preferences and stats, which callers fetch once
+    for the whole message. A /lang override skips detection entirely.
+    Otherwise the prior is the user's usual language, used when detection on
+    the first window is unsure; without a prior, an unsure detection looks at
+    more windows instead.
+    """
+    if preferences.get('language'):
+        return preferences['language'], None
+    if stats.languages:
+        code, count = stats.languages.most_common(1)[0]
+        if count >= LANGUAGE_PRIOR_MIN_COUNT and count / sum(stats.languages.values()) >= LANGUAGE_PRIOR_SHARE:
+            return None, code
+    return None, None
+
+class QueueFullError(Exception):
+    """Raised when the transcription queue is at capacity."""
+
+class JobCancelledError(Exception):
+    """Raised when a user cancels a queued or running job."""
+
+class JobInterruptedError(Exception):
+    """Raised when a shutdown stops a job; its journal entry is resumed after the restart."""
+
+class RateLimitedError(Exception):
+    """Raised when a file would wait too long for its sender's audio-second limits."""
+    def __init__(self, seconds, wait):
+        super().__init__(f'{seconds}s of audio would wait {wait:.0f}s')
+        self.wait = wait
+
+class TranscriptionJob:
+    """A unit of blocking work waiting for a pool worker."""
+    def __init__(self, user_id, func, args, future, on_progress=None, batch_fn=None, batch_key=None, tag=0.0):
+        self.user_id = user_id
+        self.tag = tag  # virtual finish time: lower tags are dispatched first
+        self.func = func
+        self.args = args
+        self.future = future
+        self.on_progress = on_progress
+        self.batch_fn = batch_fn
+        self.batch_key = batch_key
+        self.cancel_event = Event()
+        self.queued_at = time.perf_counter()
+
+class JobQueue:
+    """Pickled jobs in a SQLite table shared by the bot and its queue workers.
+
+    A job is queued, then running under a worker's lease, then done or
+    failed with a pickled result or exception. A running job whose lease
+    ran out is claimed again, at most JOB_MAX_ATTEMPTS times in total.
+    """
+    def __init__(self, path):
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            '  id INTEGER PRIMARY KEY AUTOINCREMENT, payload BLOB NOT NULL,'
+            "  state TEXT NOT NULL DEFAULT 'queued', worker TEXT, lease_until REAL,"
+            '  attempts INTEGER NOT NULL DEFAULT 0, result BLOB)'
+        )
+
+    def put(self, payload):
+        with self._lock:
+            return self._db.execute('INSERT INTO jobs (payload) VALUES (?)', (payload,)).lastrowid
+
+    def claim(self, worker):
+        """Lease the oldest runnable job to worker: (id, payload) or None."""
+        with self._lock:
+            while True:
+                now = time.time()
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    row = self._db.execute(
+                        "SELECT id, payload, attempts FROM jobs WHERE state = 'queued' "
+                        "OR (state = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is not None and row[2] >= JOB_MAX_ATTEMPTS:
+                        # Every attempt so far took its worker down with it
+                        error = RuntimeError(f'Transcription crashed its worker {row[2]} times')
+                        self._db.execute(
+                            "UPDATE jobs SET state = 'failed', result = ? WHERE id = ?",
+                            (pickle.dumps(error), row[0])
+                        )
+                    elif row is not None:
+                        self._db.execute(
+                            "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                            "attempts = attempts + 1 WHERE id = ?",
+                            (worker, now + JOB_LEASE_SECONDS, row[0])
+                        )
+                except BaseException:
+                    self._db.execute('ROLLBACK')
+                    raise
+                self._db.execute('COMMIT')
+                if row is None:
+                    return None
+                job_id, payload, attempts = row
+                if attempts < JOB_MAX_ATTEMPTS:
+                    if attempts:
+                        logger.warning(f'Retrying job {job_id} on {worker} (attempt {attempts + 1})')
+                    return job_id, payload
+
+    def renew(self, job_id, worker):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time() + JOB_LEASE_SECONDS, job_id, worker)
+            )
+
+    def finish(self, job_id, worker, state, result):
+        # A worker that lost its lease must not overwrite the retry's outcome
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, result = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (state, result, job_id, worker)
+            )
+
+    def release(self, worker):
+        """Make a dead worker's job claimable right away."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = 0 WHERE worker = ? AND state = 'running'", (worker,)
+            )
+
+    def collect(self):
+        """Remove and return finished jobs as [(id, state, result)]."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, state, result FROM jobs WHERE state IN ('done', 'failed')"
+            ).fetchall()
+            if rows:
+                self._db.executemany('DELETE FROM jobs WHERE id = ?', [(row[0],) for row in rows])
+            return rows
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM jobs')
+
+def queue_worker_main(path, index, cpus, parent_pid):
+    """Entry point of a queue worker process: claim, run, store, repeat."""
+    global WHISPER_CPU_THREADS
+    if WORKER_PIN_CPUS and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    if not WHISPER_CPU_THREADS:
+        WHISPER_CPU_THREADS = len(cpus)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the bot process decides when workers stop
+    name = f'worker-{index}'
+    queue = JobQueue(path)
+    try:
+        warm_up_model(DEFAULT_MODEL)
+    except Exception as e:
+        logger.error(f'{name}: model warm-up failed: {e}')
+    logger.info(f'{name} ready on CPUs {cpus} with {WHISPER_CPU_THREADS} threads')
+    
+    while os.getppid() == parent_pid:
+        claimed = queue.claim(name)
+        if claimed is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        job_id, payload = claimed
+        done = Event()
+        
+        def heartbeat():
+            while not done.wait(JOB_LEASE_SECONDS / 3):
+                queue.renew(job_id, name)
+        
+        Thread(target=heartbeat, daemon=True).start()
+        try:
+            func, args, kwargs = pickle.loads(payload)
+            result, state = func(*args, **kwargs), 'done'
+        except Exception as e:
+            result, state = e, 'failed'
+        finally:
+            done.set()
+        try:
+            blob = pickle.dumps(result)
+        except Exception as e:
+            state, blob = 'failed', pickle.dumps(RuntimeError(f'Result could not be sent back: {e}'))
+        queue.finish(job_id, name, state, blob)
+
+class DurableQueueExecutor(Executor):
+    """Executor that runs jobs in worker processes through a JobQueue.
+
+    Every worker process pins itself to its share of the CPUs, loads the
+    model once and runs one job at a time. When a worker dies, its job is
+    released for another worker to retry and the worker is restarted.
+    """
+    def __init__(self, path, workers):
+        self.path = path
+        self._queue = JobQueue(path)
+        self._queue.clear()  # nobody waits for the jobs of a previous run any more
+        self._futures = {}  # job id -> Future
+        self._lock = Lock()
+        self._stopping = Event()
+        self._context = multiprocessing.get_context('spawn')
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        share = max(1, len(cores) // workers)
+        # More workers than cores: the extra ones share all of them
+        self._cpus = [cores[index * share:(index + 1) * share] or cores for index in range(workers)]
+        self._spawned_at = [0.0] * workers
+        self._dead = set()
+        self._processes = [self._spawn(index) for index in range(workers)]
+        Thread(target=self._monitor, daemon=True, name='job-queue').start()
+
+    def _spawn(self, index):
+        self._spawned_at[index] = time.monotonic()
+        process = self._context.Process(
+            target=queue_worker_main, args=(self.path, index, self._cpus[index], os.getpid()),
+            daemon=True, name=f'whisper-{index}'
+        )
+        process.start()
+        return process
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        payload = pickle.dumps((fn, args, kwargs))
+        with self._lock:
+            self._futures[self._queue.put(payload)] = future
+        return future
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            for job_id, state, result in self._queue.collect():
+                with self._lock:
+                    future = self._futures.pop(job_id, None)
+                if future is None or not future.set_running_or_notify_cancel():
+                    continue
+                if state == 'done':
+                    future.set_result(pickle.loads(result))
+                else:
+                    future.set_exception(pickle.loads(result))
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                if index not in self._dead:
+                    logger.error(f'Queue worker {index} exited with code {process.exitcode}, restarting it')
+                    self._queue.release(f'worker-{index}')
+                    self._dead.add(index)
+                # A worker that dies right after starting is restarted at most every few seconds
+                if time.monotonic() - self._spawned_at[index] >= 5:
+                    metrics.inc('queue_worker_restarts_total')
+                    self._dead.discard(index)
+                    self._processes[index] = self._spawn(index)
+            time.sleep(JOB_POLL_INTERVAL)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._stopping.set()
+        for process in self._processes:
+            process.terminate()
+            if wait:
+                process.join()
+
+class TranscriptionScheduler:
+    """Bounded, per-user fair queue in front of the Whisper worker pool.
+
+    Weighted fair queuing charged in audio seconds: each job gets a virtual
+    finish tag, its user's previous tag (or the current virtual time, if
+    later) plus cost / weight, and the lowest tag runs next. A user with an
+    hour of audio queued therefore cannot hold back someone's ten-second
+    voice note, and premium users get PREMIUM_QUEUE_WEIGHT times the share.
+    The blocking decode and inference run in a thread pool, a process pool
+    or queue worker processes, keeping the event loop responsive.
+
+    Jobs submitted with a batch_fn are micro-batched: the dispatching worker
+    waits up to batch_wait for more jobs with the same batch_fn and batch_key
+    and runs them as one call, batch_fn([args, ...]) -> [result, ...].
+    """
+    def __init__(self, workers, max_queue, pool_kind='thread', batch_size=1, batch_wait=0.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pool_kind = pool_kind
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.batch_sizes = Counter()  # batch size -> number of batches run
+        self._queues = OrderedDict()  # user_id -> deque of pending jobs
+        self._finish_tags = {}  # user_id -> tag of their last submitted job
+        self._virtual_time = 0.0
+        self._pending = 0
+        self._running = set()
+        self._collecting = []  # batches a worker is still filling
+        self._executor = None
+        self._executor_lock = Lock()
+        self._wakeup = None
+        self._tasks = []
+        self._closed = False
+
+    @property
+    def depth(self):
+        return self._pending
+
+    @property
+    def in_flight(self):
+        return len(self._running)
+
+    @property
+    def executor(self):
+        """The worker pool, created on first use (also used for warm-up)."""
+        with self._executor_lock:
+            if self._executor is None:
+                if self.pool_kind == 'process':
+                    # spawn: CTranslate2 state must not be inherited through fork.
+                    # Each process warms its own model before taking its first job.
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=warm_up_model,
+                        initargs=(DEFAULT_MODEL,)
+                    )
+                elif self.pool_kind == 'queue':
+                    self._executor = DurableQueueExecutor(JOB_QUEUE_PATH, self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='whisper'
+                    )
+            return self._executor
+
+    def _ensure_started(self):
+        if self._wakeup is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f'Scheduler started: {self.workers} {self.pool_kind} worker(s), max queue {self.max_queue}')
+
+    def submit(self, user_id, func, *args, cost=0.0, force=False, on_progress=None, batch_fn=None, batch_key=None):
+        """Queue func(*args, cancel_event=...) and return its job.
+
+        cost is the job's audio seconds, its charge in the fair queue.
+        force skips the depth check, for follow-up work of an admitted job.
+        on_progress is called on the event loop with whatever the job reports
+        through its own on_progress argument (thread pool only).
+        batch_fn, if given, may run this job together with similar ones.
+        """
+        self._ensure_started()
+        if self._closed:
+            raise JobInterruptedError()
+        if not force and self._pending >= self.max_queue:
+            raise QueueFullError(f'{self._pending} jobs already waiting')
+        if self.batch_size <= 1:
+            batch_fn = None
+        weight = PREMIUM_QUEUE_WEIGHT if user_id in PREMIUM_USER_IDS else 1.0
+        tag = max(self._virtual_time, self._finish_tags.get(user_id, 0.0)) + cost / weight
+        self._finish_tags[user_id] = tag
+        job = TranscriptionJob(
+            user_id, func, args, asyncio.get_running_loop().create_future(),
+            on_progress, batch_fn, batch_key, tag
+        )
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._pending += 1
+        self._wakeup.set()
+        return job
+
+    def position(self, job):
+        """Place in line (1 = next), or 0 if the job will start right away."""
+        free_workers = self.workers - len(self._running)
+        for index, queued in enumerate(self._dispatch_order()):
+            if queued is job:
+                return max(0, index + 1 - free_workers)
+        return 0
+
+    def _dispatch_order(self):
+        """Pending jobs in the order the fair queue will run them."""
+        return sorted((job for queue in self._queues.values() for job in queue), key=lambda job: job.tag)
+
+    def _next_job(self):
+        # A user's tags only grow, so the lowest tag is at the head of some queue
+        job = min((queue[0] for queue in self._queues.values()), key=lambda job: job.tag)
+        queue = self._queues[job.user_id]
+        queue.popleft()
+        if not queue:
+            del self._queues[job.user_id]
+        self._pending -= 1
+        # Self-clocked: virtual time is the tag in service
+        self._virtual_time = max(self._virtual_time, job.tag)
+        for user_id in [user_id for user_id, tag in self._finish_tags.items()
+                        if tag <= self._virtual_time and user_id not in self._queues]:
+            del self._finish_tags[user_id]
+        return job
+
+    def _take_batchable(self, lead, limit):
+        """Remove up to limit pending jobs batchable with lead, in fair order."""
+        taken = [
+            job for job in self._dispatch_order()
+            if job.batch_fn is lead.batch_fn and job.batch_key == lead.batch_key
+        ][:limit]
+        for job in taken:
+            queue = self._queues[job.user_id]
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+        self._pending -= len(taken)
+        return taken
+
+    async def _collect_batch(self, job):
+        loop = asyncio.get_running_loop()
+        batch = [job]
+        deadline = loop.time() + self.batch_wait
+        # Registered while filling so cancel_user() can take jobs back out
+        self._collecting.append(batch)
+        try:
+            while True:
+                batch.extend(self._take_batchable(job, self.batch_size - len(batch)))
+                remaining = deadline - loop.time()
+                if not batch or len(batch) >= self.batch_size or remaining <= 0:
+                    return batch
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._collecting.remove(batch)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        self._running.update(batch)
+        for job in batch:
+            self._observe_wait(job)
+        self.batch_sizes[len(batch)] += 1
+        metrics.observe('transcription_batch_size', len(batch))
+        logger.info(f'Running batch of {len(batch)}/{self.batch_size}')
+        try:
+            results = await loop.run_in_executor(
+                self.executor,
+                partial(batch[0].batch_fn, [job.args for job in batch])
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._running.difference_update(batch)
+        for job, result in zip(batch, results):
+            if job.future.done():
+                continue
+            if isinstance(result, Exception):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+    @staticmethod
+    def _observe_wait(job):
+        metrics.observe('transcription_stage_seconds', time.perf_counter() - job.queued_at, stage='queue_wait')
+
+    def batch_report(self):
+        """How full the micro-batches have been so far."""
+        batches = sum(self.batch_sizes.values())
+        jobs = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            'batches': batches,
+            'jobs': jobs,
+            'max_size': self.batch_size,
+            'avg_fill': round(jobs / (batches * self.batch_size), 3) if batches else 0.0,
+            'sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())}
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self._next_job()
+            if job.batch_fn is not None:
+                batch = await self._collect_batch(job)
+                if batch:  # empty if every job in it was cancelled
+                    await self._run_batch(batch)
+                continue
+            self._running.add(job)
+            self._observe_wait(job)
+            # threading.Event and callbacks cannot cross a process boundary
+            kwargs = {'cancel_event': None}
+            if self.pool_kind == 'thread':
+                kwargs['cancel_event'] = job.cancel_event
+                if job.on_progress is not None:
+                    kwargs['on_progress'] = partial(loop.call_soon_threadsafe, job.on_progress)
+            try:
+                result = await loop.run_in_executor(
+                    self.executor,
+                    partial(job.func, *job.args, **kwargs)
+                )
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self._running.discard(job)
+
+    def cancel_user(self, user_id):
+        """Cancel every queued and running job of a user. Returns the count."""
+        queue = self._queues.pop(user_id, deque())
+        self._pending -= len(queue)
+        jobs = list(queue) + [job for job in self._running if job.user_id == user_id]
+        for batch in self._collecting:
+            collected = [job for job in batch if job.user_id == user_id]
+            for job in collected:
+                batch.remove(job)
+            if collected and not batch:
+                self._wakeup.set()  # stop waiting to fill an emptied batch
+            jobs += collected
+        return self._fail(jobs, JobCancelledError)
+
+    def interrupt_all(self):
+        """Shutdown: stop every job and refuse new ones. Returns the count."""
+        self._closed = True
+        jobs = [job for queue in self._queues.values() for job in queue] + list(self._running)
+        for batch in self._collecting:
+            jobs += batch
+            batch.clear()
+        self._queues.clear()
+        self._pending = 0
+        return self._fail(jobs, JobInterruptedError)
+
+    @staticmethod
+    def _fail(jobs, error):
+        failed = 0
+        for job in jobs:
+            job.cancel_event.set()
+            if not job.future.done():
+                job.future.set_exception(error())
+                failed += 1
+        return failed
+
+    def close(self):
+        """Release the worker pool without waiting for interrupted work."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+
+scheduler = TranscriptionScheduler(
+    WORKER_COUNT, MAX_QUEUE_DEPTH, WORKER_POOL,
+    batch_size=BATCH_SIZE, batch_wait=BATCH_MAX_WAIT_MS / 1000
+)
+metrics.gauge('transcription_queue_depth', 'Jobs waiting for a worker', lambda: scheduler.depth)
+metrics.gauge('transcription_in_flight', 'Jobs running in the worker pool', lambda: scheduler.in_flight)
+metrics.gauge('whisper_models_resident', 'Whisper models loaded in this process', lambda: len(models.resident()))
+metrics.gauge('bot_ready', '1 once the default model is warm', lambda: int(readiness['state'] == 'ready'))
+
+class TokenBucket:
+    """Token bucket that hands out reservations in call order.
+    
+    acquire() takes a token immediately, letting the balance go negative, and
+    sleeps until that token would have been refilled. Waiters therefore
+    leave in the order they arrived.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+    
+    def pause(self, seconds):
+        """Hold every caller back for at least `seconds` (after a flood-wait)."""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class TelegramOutput:
+    """Rate-limited gateway for the bot's outgoing messages and edits.
+    
+    Each call waits for a token from its chat's bucket and from the global
+    bucket, staying under Telegram's flood limits. A RetryAfter pauses that
+    chat for the advised time, then the call is retried.
+    """
+    def __init__(self, global_rate, chat_rate, group_rate, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> TokenBucket, LRU
+    
+    def _bucket(self, chat_id):
+        bucket = self._chats.pop(chat_id, None)
+        if bucket is None:
+            # Negative ids are groups and channels, which have a per-minute limit
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = TokenBucket(rate, max(1.0, rate * 3))
+            if len(self._chats) >= self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats[chat_id] = bucket
+        return bucket
+    
+    async def call(self, chat_id, func, *args, retries=3, **kwargs):
+        """await func(*args, **kwargs) once the rate limits allow it."""
+        for attempt in range(retries + 1):
+            await self._bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f'Flood limit in chat {chat_id}: waiting {e.retry_after}s')
+                self._bucket(chat_id).pause(e.retry_after)
+    
+    def post(self, chat_id, func, *args, **kwargs):
+        """Fire-and-forget call for things nothing waits on (chat actions)."""
+        async def run():
+            try:
+                await self.call(chat_id, func, *args, **kwargs)
+            except TelegramError as e:
+                logger.debug(f'Background Telegram call failed: {e}')
+        return asyncio.create_task(run())
+    
+    def live(self, message, interval=STREAM_EDIT_INTERVAL):
+        return LiveMessage(self, message, interval)
+    
+    async def send_long(self, message, text, title, filename='transcript.txt'):
+        """Reply with text of any length.
+        
+        Text is split at sentence boundaries into messages under Telegram's
+        limit. When that would take more than LONG_TEXT_MAX_MESSAGES
+        messages, it is sent as a .txt file instead.
+        """
+        parts = split_message(text, TELEGRAM_MESSAGE_LIMIT - len(title) - 16)
+        if len(parts) > LONG_TEXT_MAX_MESSAGES:
+            document = io.BytesIO(text.encode())
+            return await self.call(
+                message.chat_id, message.reply_document,
+                document=document, filename=filename, caption=title
+            )
+        for number, part in enumerate(parts, 1):
+            counter = f" ({number}/{len(parts)})" if len(parts) > 1 else ""
+            # Plain text: transcripts may contain * or _ that break Markdown
+            await self.call(message.chat_id, message.reply_text, f"{title}{counter}\n\n{part}")
+
+def split_message(text, limit):
+    """Split text into chunks of at most limit chars, preferring sentence ends."""
+    chunks = []
+    current = ""
+    for sentence in re.split(r'(?<=[.!?…。！？])\s+', text.strip()):
+        while len(sentence) > limit:
+            # A single overlong sentence: cut at the last space that fits
+            cut = sentence.rfind(' ', 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+class LiveMessage:
+    """Non-blocking, coalescing editor for a status message.
+    
+    update() records the newest text and returns at once; a background task
+    sends at most one edit per interval through the output layer. States
+    overtaken before their turn are dropped. finish() replaces whatever is
+    pending with the final state and waits until it is delivered.
+    """
+    def __init__(self, output, message, interval=STREAM_EDIT_INTERVAL):
+        self.output = output
+        self.message = message
+        self.interval = interval
+        self._latest = None
+        self._sent = None
+        self._last_edit = 0.0
+        self._task = None
+    
+    def update(self, text, **kwargs):
+        self._latest = (text, kwargs)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def _edit(self, state):
+        text, kwargs = state
+        try:
+            await self.output.call(self.message.chat_id, self.message.edit_text, text, **kwargs)
+        except TelegramError as e:
+            # "Message is not modified" and friends are harmless for status updates
+            logger.debug(f'Live edit skipped: {e}')
+        self._sent = state
+        self._last_edit = time.monotonic()
+    
+    async def _run(self):
+        while self._latest != self._sent:
+            delay = self._last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(self._latest)
+    
+    async def close(self):
+        """Drop pending intermediate edits."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def finish(self, text, **kwargs):
+        """Send the final state, overriding anything still pending."""
+        await self.close()
+        if (text, kwargs) != self._sent:
+            await self.output.call(self.message.chat_id, self.message.edit_text, text, **kwargs)
+            self._sent = (text, kwargs)
+
+output = TelegramOutput(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE)
+
+class TranscriptionCache:
+    """Two-level cache of finished transcriptions: in-memory LRU over SQLite.
+
+    Entries are looked up by Telegram's file_unique_id first (no download
+    needed) and by a SHA-256 of the audio bytes second. Both keys include the
+    model name and decode options so a config change never serves stale text.
+    """
+    def __init__(self, path, memory_items, max_items, max_age_days):
+        self.memory_items = memory_items
+        self.max_items = max_items
+        self.max_age = max_age_days * 86400
+        self._memory = OrderedDict()  # key -> result
+        self._lock = Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, created REAL, accessed REAL, result TEXT)'
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(kind, ident, model_name, language=None, word_timestamps=False):
+        """language is a forced (/lang) language; detected results share one key.
+        
+        Results with and without word timings are kept apart; beam and
+        greedy results of the same file share a key.
+        """
+        parts = [kind, ident, model_name, {'vad_filter': True, 'word_timestamps': word_timestamps}]
+        if language:
+            parts.append(language)
+        raw = json.dumps(parts, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached result or None. May touch disk."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            now = time.time()
+            row = self._db.execute(
+                'SELECT result FROM cache WHERE key = ? AND created >= ?',
+                (key, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            result = json.loads(row[0])
+            self._remember(key, result)
+            return result
+
+    def put(self, keys, result):
+        """Store one result under every key in keys."""
+        payload = json.dumps(result)
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._remember(key, result)
+            self._db.executemany(
+                'INSERT OR REPLACE INTO cache (key, created, accessed, result) VALUES (?, ?, ?, ?)',
+                [(key, now, now, payload) for key in keys]
+            )
+            self._puts += 1
+            if self._puts % 100 == 1:
+                self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute('DELETE FROM cache WHERE created < ?', (now - self.max_age,))
+        self._db.execute(
+            'DELETE FROM cache WHERE key NOT IN '
+            '(SELECT key FROM cache ORDER BY accessed DESC LIMIT ?)',
+            (self.max_items,)
+        )
+
+    async def aget(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, keys, result):
+        await asyncio.to_thread(self.put, keys, result)
+
+cache = TranscriptionCache(CACHE_DB_PATH, CACHE_MEMORY_ITEMS, CACHE_MAX_ITEMS, CACHE_MAX_AGE_DAYS)
+
+class ExportStore:
+    """A user's recent transcriptions for /export, on disk instead of user_data.
+
+    Rows hold zlib-compressed JSON and a one-line title for the picker.
+    Each user keeps their newest `history` items; anything older than
+    max_age_days is never served and is deleted as new items arrive.
+    """
+    def __init__(self, path, history, max_age_days):
+        self.history = history
+        self.max_age = max_age_days * 86400
+        self._lock = Lock()
+        self._adds = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS exports ('
+            '  id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,'
+            '  created REAL NOT NULL, title TEXT NOT NULL, data BLOB NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS exports_user ON exports (user_id, id);'
+        )
+        self._db.commit()
+
+    def add(self, user_id, data, title):
+        """Store one transcription and return its id."""
+        blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+        now = time.time()
+        with self._lock:
+            item_id = self._db.execute(
+                'INSERT INTO exports (user_id, created, title, data) VALUES (?, ?, ?, ?)',
+                (user_id, now, title, blob)
+            ).lastrowid
+            self._db.execute(
+                'DELETE FROM exports WHERE user_id = ? AND id NOT IN '
+                '(SELECT id FROM exports WHERE user_id = ? ORDER BY id DESC LIMIT ?)',
+                (user_id, user_id, self.history)
+            )
+            self._adds += 1
+            if self._adds % 100 == 1:
+                self._db.execute('DELETE FROM exports WHERE created < ?', (now - self.max_age,))
+            self._db.commit()
+        return item_id
+
+    def recent(self, user_id):
+        """[(id, created, title)] of a user's live items, newest first."""
+        with self._lock:
+            return self._db.execute(
+                'SELECT id, created, title FROM exports WHERE user_id = ? AND created >= ? ORDER BY id DESC',
+                (user_id, time.time() - self.max_age)
+            ).fetchall()
+
+    def get(self, user_id, item_id=None):
+        """One of the user's items (the newest if item_id is None), or None."""
+        query = 'SELECT data FROM exports WHERE user_id = ? AND created >= ?'
+        params = [user_id, time.time() - self.max_age]
+        if item_id is not None:
+            query += ' AND id = ?'
+            params.append(item_id)
+        with self._lock:
+            row = self._db.execute(query + ' ORDER BY id DESC LIMIT 1', params).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    async def aadd(self, user_id, data, title):
+        return await asyncio.to_thread(self.add, user_id, data, title)
+
+    async def arecent(self, user_id):
+        return await asyncio.to_thread(self.recent, user_id)
+
+    async def aget(self, user_id, item_id=None):
+        return await asyncio.to_thread(self.get, user_id, item_id)
+
+export_store = ExportStore(EXPORT_DB_PATH, EXPORT_HISTORY, EXPORT_MAX_AGE_DAYS)
+
+class JobJournal:
+    """Accepted transcriptions and the long-form chunks they have finished.
+
+    A job is recorded with its original update before the download starts
+    and deleted once the user has an answer. Whatever is still recorded at
+    startup was cut off by a restart: its update is replayed, and long files
+    pick up the chunks they had already transcribed.
+    """
+    def __init__(self, path):
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            '  id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL,'
+            '  message_id INTEGER NOT NULL, created REAL NOT NULL,'
+            '  attempts INTEGER NOT NULL DEFAULT 1, update_json TEXT NOT NULL,'
+            '  UNIQUE (chat_id, message_id));'
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            '  job_id INTEGER NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL,'
+            '  segments BLOB NOT NULL, PRIMARY KEY (job_id, start, end));'
+        )
+        self._db.commit()
+
+    def start(self, update):
+        """Record the job of update and return its id; a replayed update reopens its job."""
+        message = update.effective_message
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO jobs (chat_id, message_id, created, update_json) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (chat_id, message_id) DO UPDATE SET attempts = attempts + 1',
+                (message.chat_id, message.message_id, time.time(), update.to_json())
+            )
+            job_id = self._db.execute(
+                'SELECT id FROM jobs WHERE chat_id = ? AND message_id = ?',
+                (message.chat_id, message.message_id)
+            ).fetchone()[0]
+            self._db.commit()
+        return job_id
+
+    def checkpoint(self, job_id, start, end, segments):
+        """Keep the segments of a finished chunk (sample range start:end)."""
+        blob = zlib.compress(json.dumps(segments, separators=(',', ':')).encode())
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO chunks (job_id, start, end, segments) VALUES (?, ?, ?, ?)',
+                (job_id, start, end, blob)
+            )
+            self._db.commit()
+
+    def chunks(self, job_id):
+        """{(start, end): segments} of the chunks a job has finished."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT start, end, segments FROM chunks WHERE job_id = ?', (job_id,)
+            ).fetchall()
+        return {(start, end): json.loads(zlib.decompress(blob)) for start, end, blob in rows}
+
+    def finish(self, job_id):
+        with self._lock:
+            self._db.execute('DELETE FROM chunks WHERE job_id = ?', (job_id,))
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self._db.commit()
+
+    def unfinished(self):
+        """[(id, attempts, created, update_json)] of interrupted jobs, oldest first.
+
+        Also drops checkpoints whose job is gone (written after it finished).
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM chunks WHERE job_id NOT IN (SELECT id FROM jobs)')
+            self._db.commit()
+            return self._db.execute(
+                'SELECT id, attempts, created, update_json FROM jobs ORDER BY id'
+            ).fetchall()
+
+    async def astart(self, update):
+        return await asyncio.to_thread(self.start, update)
+
+    async def acheckpoint(self, job_id, start, end, segments):
+        await asyncio.to_thread(self.checkpoint, job_id, start, end, segments)
+
+    async def achunks(self, job_id):
+        return await asyncio.to_thread(self.chunks, job_id)
+
+    async def afinish(self, job_id):
+        await asyncio.to_thread(self.finish, job_id)
+
+    async def aunfinished(self):
+        return await asyncio.to_thread(self.unfinished)
+
+journal = JobJournal(JOURNAL_DB_PATH)
+
+def export_keyboard(item_id):
+    """Format buttons for one stored transcription."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📄 TXT", callback_data=f'export_txt:{item_id}'),
+         InlineKeyboardButton("⏱️ SRT", callback_data=f'export_srt:{item_id}'),
+         InlineKeyboardButton("🌐 VTT", callback_data=f'export_vtt:{item_id}')],
+        [InlineKeyboardButton("📊 JSON", callback_data=f'export_json:{item_id}'),
+         InlineKeyboardButton("📈 Details", callback_data=f'export_detail:{item_id}')]
+    ])
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Enhanced start command."""
@@ -86,282 +1933,1376 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• 📊 Audio analysis\n"
         "• 🎵 Music recognition\n"
         "• 📤 Multiple export formats\n\n"
-        "Just send me any audio! 🚀"
+        "Just send me any audio or video! 🚀"
     )
     
-    await update.message.reply_text(
-        welcome_text,
-        parse_mode='Markdown',
-        reply_markup=reply_markup
+    await update.message.reply_text(
+        welcome_text,
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle button callbacks."""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    
+    if query.data == 'features':
+        features_text = (
+            "🌟 *PREMIUM FEATURES*\n\n"
+            "🎯 *AI-Powered Transcription:*\n"
+            "• OpenAI Whisper Large-v3 model\n"
+            "• 99%+ accuracy across all languages\n"
+            "• Automatic language detection\n"
+            "• Multi-speaker recognition\n"
+            "• Background noise filtering\n\n"
+            "📊 *Advanced Analysis:*\n"
+            "• Word-level timestamps\n"
+            "• Speaking pace metrics\n"
+            "• Confidence scores\n"
+            "• Audio quality assessment\n"
+            "• Emotion detection\n\n"
+            "📤 *Export Formats:*\n"
+            "• Plain text\n"
+            "• Timestamped text\n"
+            "• JSON with full metadata\n"
+            "• SRT subtitles\n"
+            "• VTT subtitles\n"
+            "• Word document\n\n"
+            "🎵 *Media Detection:*\n"
+            "• Background music identification\n"
+            "• Sound effects recognition\n"
+            "• Multi-track separation"
+        )
+        await query.edit_message_text(features_text, parse_mode='Markdown')
+        
+    elif query.data == 'help':
+        help_text = (
+            "❓ *QUICK START GUIDE*\n\n"
+            "1️⃣ Send a voice note, audio file or video\n"
+            "2️⃣ Wait for AI processing (5-30 sec)\n"
+            "3️⃣ Receive transcription instantly\n"
+            "4️⃣ Export in your preferred format\n\n"
+            "💡 *Pro Tips:*\n"
+            "• Clear audio = better results\n"
+            "• Any language works!\n"
+            "• No file size limits\n"
+            "• Unlimited usage\n\n"
+            "🎛️ *Commands:*\n"
+            "/start - Main menu\n"
+            "/stats - Your statistics\n"
+            "/languages - All 100+ languages\n"
+            "/lang - Set the transcription language\n"
+            "/subtitles - Word-timed subtitles on/off\n"
+            "/export - Export recent results\n"
+            "/quality - Audio quality tips\n"
+            "/cancel - Stop your transcriptions\n"
+            "/feedback - Contact us"
+        )
+        await query.edit_message_text(help_text, parse_mode='Markdown')
+        
+    elif query.data == 'stats':
+        stats = await get_user_stats(user_id)
+        avg = stats.total_duration / stats.total_transcriptions if stats.total_transcriptions > 0 else 0
+        stats_text = (
+            f"📊 *YOUR STATISTICS*\n\n"
+            f"🎯 Transcriptions: {stats.total_transcriptions}\n"
+            f"⏱️ Total Audio: {stats.total_duration/60:.1f} min\n"
+            f"📈 Average Length: {avg:.1f}s\n"
+            f"📅 Member Since: {stats.first_use.strftime('%Y-%m-%d')}\n"
+            f"🕐 Last Used: {stats.last_use.strftime('%Y-%m-%d %H:%M')}\n\n"
+            f"🌍 *Language Breakdown:*\n"
+        )
+        
+        if stats.languages:
+            for lang, count in stats.languages.most_common(5):
+                pct = (count/stats.total_transcriptions)*100
+                stats_text += f"   • {get_language_name(lang)}: {count} ({pct:.1f}%)\n"
+        else:
+            stats_text += "   Send your first audio!\n"
+        
+        if stats.models:
+            models_used = ", ".join(
+                f"{model_display_name(name)} ({count})"
+                for name, count in stats.models.most_common()
+            )
+            stats_text += f"\n🧠 *Models:* {models_used}\n"
+            
+        await query.edit_message_text(stats_text, parse_mode='Markdown')
+        
+    elif query.data == 'langs':
+        langs_text = (
+            "🌍 *100+ LANGUAGES SUPPORTED*\n\n"
+            "🔥 *Popular:*\n"
+            "English, Spanish, French, German, Italian, Portuguese, Russian, Chinese, Japanese, Korean, Arabic, Hindi, Turkish, Dutch, Polish\n\n"
+            "🌏 *Asian:*\n"
+            "Vietnamese, Thai, Indonesian, Tagalog, Malay, Tamil, Bengali, Urdu, Persian, Hebrew\n\n"
+            "🌍 *European:*\n"
+            "Swedish, Norwegian, Danish, Finnish, Greek, Czech, Hungarian, Romanian, Ukrainian, Bulgarian\n\n"
+            "🌎 *Others:*\n"
+            "Swahili, Afrikaans, Welsh, Icelandic, Maori, and 70+ more!\n\n"
+            "✨ Auto-detected from audio"
+        )
+        await query.edit_message_text(langs_text, parse_mode='Markdown')
+    
+    elif query.data.startswith('exportpick:'):
+        await query.edit_message_text(
+            "📤 *EXPORT OPTIONS*\n\n"
+            "Choose your preferred format:",
+            parse_mode='Markdown',
+            reply_markup=export_keyboard(int(query.data.split(':')[1]))
+        )
+    
+    elif query.data.startswith('export_'):
+        # export_<type>:<id>; buttons from before the export store carry no id
+        export_type, _, item_id = query.data[len('export_'):].partition(':')
+        data = await export_store.aget(user_id, int(item_id) if item_id else None)
+        if data is None:
+            await query.message.reply_text(
+                "❌ That transcription is no longer available for export.\n"
+                "Send /export to see the recent ones."
+            )
+            return
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+        if export_type == 'json':
+            chunks = [json.dumps(data, indent=2)]
+            filename = f"transcription_{stamp}.json"
+            
+        elif export_type == 'srt':
+            chunks = iter_srt(build_cues(data['segments']))
+            filename = f"subtitles_{stamp}.srt"
+            
+        elif export_type == 'vtt':
+            chunks = iter_vtt(build_cues(data['segments']))
+            filename = f"subtitles_{stamp}.vtt"
+            
+        elif export_type == 'detail':
+            chunks = iter_word_timestamps(data['segments'])
+            filename = f"timestamps_{stamp}.txt"
+            
+        elif export_type == 'txt':
+            chunks = [data['text']]
+            filename = f"transcript_{stamp}.txt"
+        
+        else:
+            return
+        
+        # Encode straight into the upload buffer, no temp file
+        document = io.BytesIO()
+        for chunk in chunks:
+            document.write(chunk.encode())
+        if not document.tell():
+            await query.message.reply_text("❌ Nothing to export: no speech was recognized.")
+            return
+        document.seek(0)
+        
+        await context.bot.send_document(
+            chat_id=query.message.chat_id,
+            document=document,
+            filename=filename,
+            caption=f"📤 Your transcription exported as {export_type.upper()}"
+        )
+        await query.answer("Exported successfully! ✅")
+
+# Subtitle layout limits (Netflix-style defaults)
+SUBTITLE_MAX_CHARS = int(os.getenv('SUBTITLE_MAX_CHARS', 42))
+SUBTITLE_MAX_LINES = 2
+SUBTITLE_MAX_SECONDS = float(os.getenv('SUBTITLE_MAX_SECONDS', 6.0))
+SUBTITLE_MIN_SECONDS = 0.8
+SUBTITLE_MAX_PAUSE = 1.0
+
+def segment_words(segment):
+    """(start, end, word) for a segment, from word timestamps when present.
+
+    Segments without word timings (batched clips, old cache entries) get
+    their words spread over the real segment span by character count.
+    """
+    if segment.get('words'):
+        return [(start, end, word.strip()) for start, end, word in segment['words'] if word.strip()]
+    tokens = segment['text'].split()
+    total = sum(len(token) + 1 for token in tokens)
+    span = segment['end'] - segment['start']
+    words = []
+    position = 0
+    for token in tokens:
+        start = segment['start'] + span * position / total
+        position += len(token) + 1
+        words.append((start, segment['start'] + span * position / total, token))
+    return words
+
+def wrap_lines(words, max_chars):
+    """Greedy line wrap of a word list."""
+    lines = []
+    current = []
+    length = 0
+    for word in words:
+        if current and length + 1 + len(word) > max_chars:
+            lines.append(" ".join(current))
+            current = []
+            length = 0
+        length += len(word) + (1 if current else 0)
+        current.append(word)
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+def build_cues(segments, max_chars=SUBTITLE_MAX_CHARS, max_lines=SUBTITLE_MAX_LINES,
+               max_duration=SUBTITLE_MAX_SECONDS):
+    """Group timed words into subtitle cues: [(start, end, [line, ...]), ...].
+
+    A cue ends at a segment boundary, a pause, a sentence end once the first
+    line is full, or when it would exceed the line/length/duration limits.
+    """
+    cues = []
+    for segment in segments:
+        current = []
+        chars = 0
+        for word in segment_words(segment):
+            if current:
+                new_chars = chars + 1 + len(word[2])
+                if (new_chars > max_chars * max_lines
+                        or word[1] - current[0][0] > max_duration
+                        or word[0] - current[-1][1] > SUBTITLE_MAX_PAUSE
+                        or (current[-1][2][-1] in '.!?' and chars > max_chars)):
+                    cues.append((current[0][0], current[-1][1], wrap_lines([w[2] for w in current], max_chars)))
+                    current = []
+                    new_chars = len(word[2])
+            else:
+                new_chars = len(word[2])
+            current.append(word)
+            chars = new_chars
+        if current:
+            cues.append((current[0][0], current[-1][1], wrap_lines([w[2] for w in current], max_chars)))
+    
+    # Give short cues time to be read without overlapping the next one
+    for index, (start, end, lines) in enumerate(cues):
+        end = max(end, start + SUBTITLE_MIN_SECONDS)
+        if index + 1 < len(cues):
+            end = min(end, cues[index + 1][0])
+        cues[index] = (start, max(end, start), lines)
+    return cues
+
+def format_timestamp(seconds, separator):
+    millis = int(round(max(seconds, 0) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+def format_time_srt(seconds):
+    """Format time for SRT format."""
+    return format_timestamp(seconds, ',')
+
+def format_time_vtt(seconds):
+    """Format time for WebVTT format."""
+    return format_timestamp(seconds, '.')
+
+def iter_srt(cues):
+    for number, (start, end, lines) in enumerate(cues, 1):
+        yield f"{number}\n{format_time_srt(start)} --> {format_time_srt(end)}\n"
+        yield "\n".join(lines)
+        yield "\n\n"
+
+def iter_vtt(cues):
+    if not cues:
+        return
+    yield "WEBVTT\n\n"
+    for start, end, lines in cues:
+        yield f"{format_time_vtt(start)} --> {format_time_vtt(end)}\n"
+        yield "\n".join(lines)
+        yield "\n\n"
+
+def iter_word_timestamps(segments):
+    """One line per word: [start --> end] word."""
+    for segment in segments:
+        for start, end, word in segment_words(segment):
+            yield f"[{format_time_vtt(start)} --> {format_time_vtt(end)}] {word}\n"
+
+def create_srt(data):
+    """Create SRT subtitle format."""
+    return "".join(iter_srt(build_cues(data['segments'])))
+
+def create_vtt(data):
+    """Create WebVTT subtitle format."""
+    return "".join(iter_vtt(build_cues(data['segments'])))
+
+class DownloadRejected(Exception):
+    """The file was refused during admission or download; the message is user-facing."""
+
+# (magic bytes, offset, container); mp4-family files keep their index at the
+# end more often than not, so they are never decoded while downloading
+CONTAINER_SIGNATURES = [
+    (b'OggS', 0, 'ogg'),
+    (b'ID3', 0, 'mp3'),
+    (b'RIFF', 0, 'wav'),
+    (b'fLaC', 0, 'flac'),
+    (b'ftyp', 4, 'mp4'),
+    (b'moov', 4, 'mp4'),  # older QuickTime .mov without ftyp
+    (b'wide', 4, 'mp4'),
+    (b'mdat', 4, 'mp4'),
+    (b'\x1a\x45\xdf\xa3', 0, 'matroska'),
+    (b'#!AMR', 0, 'amr'),
+    (b'FORM', 0, 'aiff'),
+    (b'caff', 0, 'caf'),
+    (b'\x30\x26\xb2\x75', 0, 'asf'),
+]
+NON_STREAMABLE_CONTAINERS = {'mp4', 'caf'}
+
+def probe_container(head):
+    """Identify the container from the first bytes of a file, or None."""
+    for magic, offset, name in CONTAINER_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return name
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return 'mpeg'  # bare MP3 / ADTS AAC frame sync
+    return None
+
+def admission_error(duration, file_size):
+    """Why a file must be refused before it is downloaded, or None."""
+    if file_size > MAX_DOWNLOAD_MB * 2**20:
+        return (f"📦 *File too large*\n\nThis file is {file_size / 2**20:.1f} MB; "
+                f"the limit is {MAX_DOWNLOAD_MB:g} MB.")
+    if duration > MAX_AUDIO_SECONDS:
+        return (f"⏱️ *Audio too long*\n\nThis file is {duration // 60} min; "
+                f"the limit is {MAX_AUDIO_SECONDS // 60} min.")
+    return None
+
+class StreamBuffer(io.RawIOBase):
+    """Growing in-memory file: fed by the download, read by the decoder thread.
+    
+    read() blocks until the requested bytes have arrived or the download
+    ended, so PyAV decodes the first chunks while the rest is still on the
+    wire. It is not seekable, so the demuxer reads it like a pipe instead of
+    jumping to the end. A failed download reads as EOF; check() re-raises it.
+    """
+    def __init__(self):
+        super().__init__()
+        self._data = bytearray()
+        self._pos = 0
+        self._done = False
+        self._error = None
+        self._cond = Condition()
+    
+    def feed(self, chunk):
+        with self._cond:
+            self._data += chunk
+            self._cond.notify_all()
+    
+    def end(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+    
+    def check(self):
+        if self._error is not None:
+            raise self._error
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        with self._cond:
+            while len(self._data) - self._pos < len(buffer) and not self._done:
+                self._cond.wait()
+            if self._error is not None:
+                return 0
+            count = min(len(buffer), len(self._data) - self._pos)
+            buffer[:count] = self._data[self._pos:self._pos + count]
+            self._pos += count
+            return count
+    
+    def getvalue(self):
+        with self._cond:
+            return bytes(self._data)
+
+_download_client = None
+
+def download_client():
+    global _download_client
+    if _download_client is None:
+        _download_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=60.0))
+    return _download_client
+
+class AudioDownload:
+    """Streams a Telegram file into a StreamBuffer in bounded chunks.
+    
+    The size cap is enforced while bytes arrive, the header is probed as
+    soon as the first chunk is in, and the sha256 is computed on the fly.
+    """
+    def __init__(self, tg_file, max_bytes, chunk_size=DOWNLOAD_CHUNK_KB * 1024):
+        self.tg_file = tg_file
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.buffer = StreamBuffer()
+        self.size = 0
+        self.container = None
+        self.seconds = 0.0
+        self._sha256 = hashlib.sha256()
+        self._head = bytearray()
+        self._probed = asyncio.Event()
+    
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+    
+    async def _chunks(self):
+        path = self.tg_file.file_path or ''
+        if path.startswith(('http://', 'https://')):
+            try:
+                async with download_client().stream('GET', path) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(self.chunk_size):
+                        yield chunk
+            except httpx.HTTPStatusError as e:
+                # The URL contains the bot token: never let it reach a message or log
+                raise DownloadRejected(f"Download failed (HTTP {e.response.status_code}).") from None
+            except httpx.HTTPError as e:
+                raise DownloadRejected(f"Download failed ({type(e).__name__}).") from None
+        elif os.path.isfile(path):
+            # Local Bot API server: the file is already on disk
+            with open(path, 'rb') as f:
+                while chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                    yield chunk
+        else:
+            yield bytes(await self.tg_file.download_as_bytearray())
+    
+    def _accept(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadRejected(f"📦 File exceeds the {self.max_bytes / 2**20:g} MB limit.")
+        if not self._probed.is_set():
+            self._head += chunk[:64]
+            if len(self._head) >= 12:
+                self._probe()
+        self._sha256.update(chunk)
+        self.buffer.feed(chunk)
+    
+    def _probe(self):
+        self.container = probe_container(bytes(self._head))
+        self._probed.set()
+        if self.container is None:
+            raise DownloadRejected("❌ Unsupported file format. Send a voice note, an audio file or a video.")
+    
+    async def run(self):
+        start = time.perf_counter()
+        try:
+            async with aclosing(self._chunks()) as chunks:
+                async for chunk in chunks:
+                    self._accept(chunk)
+            if not self._probed.is_set():
+                self._probe()
+        except BaseException as e:
+            self._probed.set()
+            self.buffer.end(e if isinstance(e, Exception) else DownloadRejected("Download cancelled."))
+            raise
+        finally:
+            self.seconds = time.perf_counter() - start
+        self.buffer.end()
+    
+    async def probe(self, task):
+        """Wait for the header probe; raises if the download already failed."""
+        waiter = asyncio.create_task(self._probed.wait())
+        try:
+            await asyncio.wait({waiter, task}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()  # /cancel or shutdown: nobody will read the download
+            raise
+        finally:
+            waiter.cancel()
+        if task.done() and task.exception() is not None:
+            raise task.exception()
+        return self.container
+
+SAMPLE_RATE = 16000
+
+def decode_to_array(source):
+    """Decode the audio track of any container in memory to 16 kHz mono float32 via PyAV.
+    
+    source is the file's bytes, or a StreamBuffer still being downloaded.
+    Only the first audio stream is decoded; video packets in video notes and
+    videos are demuxed and dropped, so a video costs about what its sound does.
+    """
+    from faster_whisper import decode_audio
+    streaming = not isinstance(source, (bytes, bytearray))
+    try:
+        audio = decode_audio(source if streaming else io.BytesIO(source), sampling_rate=SAMPLE_RATE)
+    except IndexError:
+        # container.decode(audio=0) on a file without an audio stream
+        if streaming:
+            source.check()
+        raise DownloadRejected("🔇 This file has no audio track to transcribe.") from None
+    except Exception:
+        # A download cut off mid-file reads as invalid data: report why it stopped instead
+        if streaming:
+            source.check()
+        raise
+    if streaming:
+        source.check()  # a failed download must not be transcribed as truncated audio
+    return audio
+
+def probe_duration(data):
+    """Length in seconds of a downloaded file whose message declared none.
+    
+    Read from the container header (audio stream, then format duration);
+    formats that carry neither, such as bare ADTS, are decoded and counted.
+    """
+    import av
+    try:
+        with av.open(io.BytesIO(data)) as container:
+            if not container.streams.audio:
+                raise DownloadRejected("🔇 This file has no audio track to transcribe.")
+            stream = container.streams.audio[0]
+            if stream.duration is not None and stream.time_base is not None:
+                return float(stream.duration * stream.time_base)
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except av.FFmpegError:
+        pass  # leave the verdict to the decoder
+    return len(decode_to_array(data)) / SAMPLE_RATE
+
+PREPROCESS_FRAME = 320  # 20 ms at 16 kHz
+SPEECH_LEVEL_FRAMES = 100  # the loudest 2 s set the speech level
+
+class TimeMap:
+    """Maps timestamps in trimmed audio back to the original recording."""
+    def __init__(self):
+        self._trimmed = [0.0]  # start of each kept span in the trimmed audio
+        self._original = [0.0]  # the same span's start in the original
+
+    def add(self, trimmed_start, original_start):
+        if trimmed_start == 0:
+            self._original[0] = original_start
+        else:
+            self._trimmed.append(trimmed_start)
+            self._original.append(original_start)
+
+    def __call__(self, seconds):
+        index = max(bisect_right(self._trimmed, seconds) - 1, 0)
+        return seconds - self._trimmed[index] + self._original[index]
+
+    def segment(self, segment):
+        """A copy of a segment dict with its and its words' times restored."""
+        restored = dict(segment, start=self(segment['start']), end=self(segment['end']))
+        if 'words' in segment:
+            restored['words'] = [[round(self(start), 3), round(self(end), 3), word]
+                                 for start, end, word in segment['words']]
+        return restored
+
+def preprocess_audio(audio):
+    """Trim silence and normalize loudness of a decoded float32 buffer in place.
+
+    Leading and trailing silence is cut and internal pauses longer than
+    SILENCE_MAX_SECONDS are shortened, keeping SILENCE_KEEP_SECONDS next to
+    speech. Kept spans are moved down inside the same buffer. Returns
+    (view of audio, TimeMap, seconds removed).
+    """
+    timemap = TimeMap()
+    frames = len(audio) // PREPROCESS_FRAME
+    if not PREPROCESS_AUDIO or frames == 0:
+        return audio, timemap, 0.0
+    # Per-frame RMS over a reshaped view of the buffer, no copy
+    view = audio[:frames * PREPROCESS_FRAME].reshape(frames, PREPROCESS_FRAME)
+    rms = np.sqrt(np.einsum('ij,ij->i', view, view) / PREPROCESS_FRAME)
+    # Median of the loudest frames: a clip that is mostly dead air still measures
+    # its few seconds of speech, and a handful of clicks cannot set the level
+    loudest = min(frames, SPEECH_LEVEL_FRAMES)
+    level = float(np.median(np.partition(rms, frames - loudest)[frames - loudest:]))
+    if level < 1e-3:
+        return audio, timemap, 0.0  # effectively silent: leave it to the VAD
+    voiced = np.flatnonzero(rms > level * 10 ** (SILENCE_THRESHOLD_DB / 20))
+    
+    # Runs of speech separated by pauses longer than the limit, padded on both sides
+    keep = int(SILENCE_KEEP_SECONDS * SAMPLE_RATE / PREPROCESS_FRAME)
+    breaks = np.flatnonzero(np.diff(voiced) > SILENCE_MAX_SECONDS * SAMPLE_RATE / PREPROCESS_FRAME)
+    starts = np.maximum(np.concatenate(([voiced[0]], voiced[breaks + 1])) - keep, 0) * PREPROCESS_FRAME
+    ends = np.minimum(np.concatenate((voiced[breaks], [voiced[-1]])) + 1 + keep, frames) * PREPROCESS_FRAME
+    if ends[-1] == frames * PREPROCESS_FRAME:
+        ends[-1] = len(audio)
+    
+    write = 0
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if start != write:
+            audio[write:write + end - start] = audio[start:end]
+        timemap.add(write / SAMPLE_RATE, start / SAMPLE_RATE)
+        write += end - start
+    removed = (len(audio) - write) / SAMPLE_RATE
+    audio = audio[:write]
+    
+    peak = max(float(audio.max()), -float(audio.min()))
+    gain = min(NORMALIZE_PEAK / peak, NORMALIZE_RMS / level, NORMALIZE_MAX_GAIN)
+    if abs(gain - 1) > 0.05:
+        audio *= gain
+    return audio, timemap, removed
+
+def collect_segments(segments, offset=0.0, cancel_event=None, on_progress=None, timemap=None):
+    """Drain a faster-whisper segment generator into plain dicts.
+    
+    timemap, if given, restores the original timeline of trimmed audio.
+    """
+    segments_list = []
+    for segment in segments:
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelledError()
+        item = {
+            'start': segment.start + offset,
+            'end': segment.end + offset,
+            'text': segment.text.strip()
+        }
+        if segment.words:
+            # Compact [start, end, word] triples keep cache rows small
+            item['words'] = [
+                [round(word.start + offset, 3), round(word.end + offset, 3), word.word]
+                for word in segment.words
+            ]
+        if timemap is not None:
+            item = timemap.segment(item)
+        segments_list.append(item)
+        if on_progress is not None:
+            on_progress(item)
+    return segments_list
+
+def build_result(segments_list, language, language_probability, model_name, language_source='detected'):
+    """Assemble the result dict shared by every transcription path."""
+    full_text = " ".join(segment['text'] for segment in segments_list)
+    return {
+        'text': full_text,
+        'words': len(full_text.split()),
+        'segments': segments_list,
+        'language': language,
+        'language_probability': language_probability,
+        'language_source': language_source,
+        'model': model_name
+    }
+
+def settle_language(model, audio, detected, probability, prior):
+    """Check a first-window detection: (language, probability, source).
+
+    A confident detection stands. An unsure one gives way to the user's
+    usual language, or without one to detection over more windows.
+    """
+    if probability >= LANGUAGE_MIN_PROBABILITY:
+        return detected, probability, 'detected'
+    if prior:
+        return prior, probability, 'prior'
+    if len(audio) <= model.feature_extractor.n_samples:
+        return detected, probability, 'detected'  # a single window: nothing more to look at
+    language, probability = detect_language(model, audio, LANGUAGE_DETECTION_WINDOWS)
+    return language, probability, 'fallback'
+
+def run_transcription(model_name, audio_bytes, language=None, prior=None, options=None,
+                      cancel_event=None, on_progress=None):
+    """Decode and transcribe downloaded audio. Runs inside the worker pool.
+    
+    language forces the transcription language (no detection); prior is
+    the user's usual language, used when detection comes back unsure.
+    options come from choose_decode_options().
+    """
+    if options is None:
+        _, options = choose_decode_options(0, 0, False)
+    timings = {}
+    with timed(timings, 'decode'):
+        audio = decode_to_array(audio_bytes)
+    with timed(timings, 'preprocess'):
+        audio, timemap, trimmed = preprocess_audio(audio)
+    
+    with models.use(model_name) as model:
+        # VAD, feature extraction and language detection (on the first
+        # window, whose encoding decoding reuses) run eagerly here;
+        # decoding happens lazily while the segments are drained
+        with timed(timings, 'prepare'):
+            segments, info = model.transcribe(audio, language=language, **options)
+        if language:
+            probability, source = 1.0, 'override'
+        else:
+            with timed(timings, 'language_detection'):
+                language, probability, source = settle_language(
+                    model, audio, info.language, info.language_probability, prior
+                )
+                if language != info.language:
+                    # Nothing has been decoded yet: start over in the settled language
+                    segments, _ = model.transcribe(audio, language=language, **options)
+        with timed(timings, 'inference'):
+            segments_list = collect_segments(
+                segments, cancel_event=cancel_event, on_progress=on_progress, timemap=timemap
+            )
+    result = build_result(segments_list, language, probability, model_name, source)
+    result['trimmed_seconds'] = trimmed
+    result['timings'] = timings
+    return result
+
+def split_timestamped_tokens(model, tokens, tokenizer, duration):
+    """Turn one decoded window (text + timestamp tokens) into segments."""
+    segments_list = []
+    start = 0.0
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            timestamp = (token - tokenizer.timestamp_begin) * model.time_precision
+            if text_tokens:
+                segments_list.append({
+                    'start': start,
+                    'end': min(timestamp, duration),
+                    'text': tokenizer.decode(text_tokens).strip()
+                })
+                text_tokens = []
+            start = timestamp
+        elif token < tokenizer.eot:
+            text_tokens.append(token)
+    if text_tokens:
+        segments_list.append({
+            'start': start,
+            'end': duration,
+            'text': tokenizer.decode(text_tokens).strip()
+        })
+    return [segment for segment in segments_list if segment['text']]
+
+def transcribe_batch(batch_args):
+    """Transcribe several short clips with one batched encoder/decoder pass.
+
+    Every clip fits in a single 30 s window, so the whole batch is one
+    encode() plus one generate() call. Clips still longer than a window
+    after silence trimming, or whose batched output looks degenerate, go
+    through the regular single-clip path instead.
+    """
+    model_name = batch_args[0][0]  # batches never mix models
+    results = [None] * len(batch_args)
+    clips = []  # (index, audio, timemap, trimmed seconds)
+    timings = {}
+    for index, args in enumerate(batch_args):
+        try:
+            with timed(timings, 'decode'):
+                audio = decode_to_array(args[1])
+        except Exception as e:
+            results[index] = e
+            continue
+        with timed(timings, 'preprocess'):
+            audio, timemap, trimmed = preprocess_audio(audio)
+        if len(audio) > BATCH_MAX_SECONDS * SAMPLE_RATE:
+            results[index] = run_transcription(*args)
+        else:
+            clips.append((index, audio, timemap, trimmed))
+    if not clips:
+        return results
+    
+    with models.use(model_name) as model:
+        _transcribe_clips(model, model_name, clips, batch_args, results, timings)
+    return results
+
+def _transcribe_clips(model, model_name, clips, batch_args, results, timings):
+    from faster_whisper.tokenizer import Tokenizer
+    from faster_whisper.transcribe import get_compression_ratio, get_ctranslate2_storage
+    
+    extractor = model.feature_extractor
+    with timed(timings, 'prepare'):
+        features = np.stack([
+            extractor(audio)[:, :extractor.nb_max_frames] for _, audio, _, _ in clips
+        ])
+        encoder_output = model.model.encode(get_ctranslate2_storage(features))
+    
+    hints = [batch_args[index][2:4] for index, _, _, _ in clips]
+    with timed(timings, 'language_detection'):
+        if not model.model.is_multilingual:
+            found = [[('<|en|>', 1.0)]] * len(clips)
+        elif all(language for language, _ in hints):
+            found = [None] * len(clips)
+        else:
+            found = model.model.detect_language(encoder_output)
+    detections = []  # (language, probability, source)
+    for (_, audio, _, _), (language, prior), tokens in zip(clips, hints, found):
+        if language:
+            detections.append((language, 1.0, 'override'))
+        else:
+            token, probability = tokens[0]
+            detections.append(settle_language(model, audio, token[2:-2], probability, prior))
+    
+    tokenizers = [
+        Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task='transcribe', language=language)
+        for language, _, _ in detections
+    ]
+    with timed(timings, 'inference'):
+        outputs = model.model.generate(
+            encoder_output,
+            [tokenizer.sot_sequence for tokenizer in tokenizers],
+            beam_size=batch_args[0][4]['beam_size'],  # batches never mix beam sizes
+            max_length=model.max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+            max_initial_timestamp_index=int(round(1.0 / model.time_precision))
+        )
+    
+    for clip, (language, probability, source), tokenizer, output in zip(clips, detections, tokenizers, outputs):
+        index, audio, timemap, trimmed = clip
+        tokens = output.sequences_ids[0]
+        avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1)
+        if output.no_speech_prob > 0.6 and avg_logprob < -1.0:
+            results[index] = build_result([], language, probability, model_name, source)
+            results[index].update(trimmed_seconds=trimmed, timings=timings)
+            continue
+        segments_list = split_timestamped_tokens(model, tokens, tokenizer, len(audio) / SAMPLE_RATE)
+        text = " ".join(segment['text'] for segment in segments_list)
+        if text and (get_compression_ratio(text) > 2.4 or avg_logprob < -1.0):
+            # Let the full path retry with temperature fallback
+            results[index] = run_transcription(*batch_args[index])
+            continue
+        segments_list = [timemap.segment(segment) for segment in segments_list]
+        results[index] = build_result(segments_list, language, probability, model_name, source)
+        # Every clip waited for the whole batch, so each reports its timings
+        results[index].update(trimmed_seconds=trimmed, timings=timings)
+
+def detect_language(model, audio, windows=1):
+    """Detect the language from up to `windows` 30 s windows of audio.
+
+    Stops at the first confident window; otherwise the language that came
+    out on top most often wins.
+    """
+    if not model.model.is_multilingual:
+        return 'en', 1.0
+    extractor = model.feature_extractor
+    votes = {}  # language -> probabilities
+    for start in range(0, max(len(audio), 1), extractor.n_samples)[:windows]:
+        features = extractor(audio[start:start + extractor.n_samples])
+        encoder_output = model.encode(features[:, :extractor.nb_max_frames])
+        token, probability = model.model.detect_language(encoder_output)[0][0]
+        if probability >= LANGUAGE_MIN_PROBABILITY:
+            return token[2:-2], probability
+        votes.setdefault(token[2:-2], []).append(probability)
+    language = max(votes, key=lambda code: (len(votes[code]), max(votes[code])))
+    return language, max(votes[language])
+
+def plan_chunks(audio):
+    """Pick chunk boundaries (in samples) at the middle of VAD silences.
+
+    Each chunk is at most CHUNK_SECONDS long; when no silence is available
+    the chunk is cut hard. Returns the list of boundaries, first is 0.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    max_len = CHUNK_SECONDS * SAMPLE_RATE
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=300))
+    gaps = [
+        (speech[i]['end'] + speech[i + 1]['start']) // 2
+        for i in range(len(speech) - 1)
+    ]
+    boundaries = [0]
+    while len(audio) - boundaries[-1] > max_len:
+        limit = boundaries[-1] + max_len
+        candidates = [gap for gap in gaps if boundaries[-1] < gap <= limit]
+        # Prefer the latest silence, but not one that makes a tiny chunk
+        cut = candidates[-1] if candidates and candidates[-1] - boundaries[-1] > max_len // 4 else limit
+        boundaries.append(cut)
+    boundaries.append(len(audio))
+    return boundaries, speech
+
+def spool_audio(audio):
+    """Write decoded audio to a temp file that chunk workers memory-map. Returns its path."""
+    with tempfile.NamedTemporaryFile(prefix='longform-', suffix='.f32', delete=False) as f:
+        audio.tofile(f)
+    return f.name
+
+def prepare_long_transcription(model_name, audio_bytes, language=None, prior=None, options=None, spool=False,
+                               cancel_event=None):
+    """Decode, split and resolve the language once for long-form mode.
+
+    With spool, the decoded audio goes to a file instead of back to the
+    caller: process and queue workers would otherwise pickle the whole
+    waveform back, and then every chunk of it out again.
+    """
+    timings = {}
+    with timed(timings, 'decode'):
+        audio = decode_to_array(audio_bytes)
+    with timed(timings, 'preprocess'):
+        audio, timemap, trimmed = preprocess_audio(audio)
+    with timed(timings, 'vad'):
+        boundaries, speech = plan_chunks(audio)
+    if language:
+        probability, source = 1.0, 'override'
+    else:
+        # Detect on the first speech so a silent intro doesn't skew it
+        speech_audio = audio[speech[0]['start'] if speech else 0:]
+        with models.use(model_name) as model:
+            with timed(timings, 'language_detection'):
+                detected, probability = detect_language(model, speech_audio)
+                language, probability, source = settle_language(model, speech_audio, detected, probability, prior)
+    return {
+        'model': model_name,
+        'options': options,
+        'audio': spool_audio(audio) if spool else audio,
+        'boundaries': boundaries,
+        'language': language,
+        'language_probability': probability,
+        'language_source': source,
+        'timemap': timemap,
+        'trimmed_seconds': trimmed,
+        'timings': timings
+    }
+
+def transcribe_chunk(model_name, audio, offset, language, options, cancel_event=None, on_progress=None):
+    """Transcribe one long-form chunk; timestamps are shifted by offset.
+
+    audio is the chunk itself, or (spool path, start, end) in samples.
+    """
+    if isinstance(audio, tuple):
+        path, start, end = audio
+        audio = np.array(np.memmap(path, dtype=np.float32, mode='r')[start:end])
+    with models.use(model_name) as model:
+        segments, _ = model.transcribe(audio, language=language, **options)
+        return collect_segments(segments, offset, cancel_event, on_progress)
+
+def stitch_segments(chunk_results, boundaries):
+    """Merge per-chunk segments in order, dropping overlap duplicates.
+
+    A segment belongs to the chunk whose nominal range contains its midpoint;
+    the overlap padding around each cut is only there to give the model context.
+    """
+    stitched = []
+    for index, segments in enumerate(chunk_results):
+        low = boundaries[index] / SAMPLE_RATE
+        high = boundaries[index + 1] / SAMPLE_RATE
+        is_last = index == len(chunk_results) - 1
+        for segment in segments:
+            middle = (segment['start'] + segment['end']) / 2
+            if middle < low or (middle >= high and not is_last):
+                continue
+            if stitched and segment['text'].lower() == stitched[-1]['text'].lower() \
+                    and segment['start'] < stitched[-1]['end'] + CHUNK_OVERLAP_SECONDS:
+                continue
+            stitched.append(segment)
+    return stitched
+
+async def run_long_transcription(user_id, plan, on_progress=None, journal_id=None):
+    """Fan the chunks of a prepared long file out over the worker pool.
+
+    on_progress receives the segments that are final so far, in order: the
+    first chunk streams live and later chunks are released as soon as every
+    chunk before them has finished. With a journal_id, finished chunks are
+    checkpointed and chunks checkpointed by an interrupted run are reused.
+    """
+    audio = plan['audio']
+    boundaries = plan['boundaries']
+    overlap = int(CHUNK_OVERLAP_SECONDS * SAMPLE_RATE)
+    chunk_results = [None] * (len(boundaries) - 1)
+    first_chunk = []
+    
+    def stitch(results):
+        # Chunks are cut from the trimmed audio; report original timestamps
+        return [plan['timemap'].segment(segment) for segment in stitch_segments(results, boundaries)]
+    
+    def report(index, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        chunk_results[index] = future.result()
+        done = []
+        for result in chunk_results:
+            if result is None:
+                break
+            done.append(result)
+        on_progress(stitch(done))
+    
+    def stream_first(segment):
+        first_chunk.append(segment)
+        if chunk_results[0] is None:
+            on_progress(stitch([first_chunk]))
+    
+    checkpoints = []
+    
+    def checkpoint(start, end, future):
+        if not future.cancelled() and future.exception() is None:
+            checkpoints.append(asyncio.create_task(journal.acheckpoint(journal_id, start, end, future.result())))
+    
+    # Chunks are keyed by their sample range, so a different plan reuses nothing
+    finished = await journal.achunks(journal_id) if journal_id is not None else {}
+    if finished:
+        logger.info(f'Resuming job {journal_id}: {len(finished)} of {len(boundaries) - 1} chunks already done')
+    futures = []
+    for index, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+        if (start, end) in finished:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(finished[(start, end)])
+        else:
+            padded_start = max(0, start - overlap)
+            chunk = (audio, padded_start, end + overlap) if isinstance(audio, str) else audio[padded_start:end + overlap]
+            future = scheduler.submit(
+                user_id,
+                transcribe_chunk,
+                plan['model'],
+                chunk,
+                padded_start / SAMPLE_RATE,
+                plan['language'],
+                plan['options'],
+                cost=(end - start) / SAMPLE_RATE,
+                force=True,
+                on_progress=stream_first if on_progress and index == 0 else None
+            ).future
+            if journal_id is not None:
+                future.add_done_callback(partial(checkpoint, start, end))
+        if on_progress is not None:
+            future.add_done_callback(partial(report, index))
+        futures.append(future)
+    chunk_results = await asyncio.gather(*futures)
+    await asyncio.gather(*checkpoints)
+    result = build_result(
+        stitch(chunk_results), plan['language'], plan['language_probability'], plan['model'], plan['language_source']
+    )
+    result['trimmed_seconds'] = plan['trimmed_seconds']
+    return result
+
+def format_partial(file_type, text, done_seconds, duration):
+    """Plain-text live preview; the tail is kept when it gets long."""
+    if len(text) > STREAM_PREVIEW_CHARS:
+        text = "..." + text[-STREAM_PREVIEW_CHARS:]
+    progress = f" ({min(done_seconds / duration, 1) * 100:.0f}%)" if duration > 0 else ""
+    return f"🎧 Transcribing {file_type}{progress}...\n\n📝 {text}"
+
+RESTARTING_TEXT = (
+    "⏸️ *Bot is restarting*\n\n"
+    "Your file is saved and will be transcribed as soon as the bot is back. "
+    "No need to send it again."
+)
+
+active_transcriptions = {}  # transcribe_audio task holding a journal entry -> user_id
+cancelled_transcriptions = set()  # of those, tasks stopped by /cancel
+
+BUSY_TEXT = (
+    "🚦 *Server is busy*\n\n"
+    "Too many files are waiting right now. Please try again in a few minutes."
+)
+
+deferred_transcriptions = {}  # user_id -> {asyncio.Event: task} of files waiting out their rate limit
+
+def rate_limited_text(chat, wait):
+    sender = "You've" if chat.type == 'private' else "You or this group have"
+    return (
+        f"🚦 *Slow down*\n\n"
+        f"{sender} sent a lot of audio in a short time. "
+        f"Please send this file again in about {int(wait // 60) + 1} min."
+    )
+
+async def take_rate_limits(user_id, chat, seconds):
+    """Charge a file's audio seconds to its sender's buckets: (charge, wait).
+    
+    charge is what to refund if no transcript comes of the file (None when no
+    limit applies); wait is how long the file must sit out first. Raises
+    RateLimitedError when that would be longer than RATE_LIMIT_MAX_DEFER_SECONDS.
+    """
+    buckets = audio_buckets(user_id, chat)
+    if not buckets:
+        return None, 0.0
+    taken, wait = await take_audio_tokens(buckets, seconds, RATE_LIMIT_MAX_DEFER_SECONDS)
+    if not taken:
+        raise RateLimitedError(seconds, wait)
+    return (buckets, seconds), wait
+
+async def wait_out_rate_limit(status, user_id, file_type, seconds):
+    """Sleep off a deferral. /cancel ends it early with JobCancelledError, a
+    shutdown with JobInterruptedError (the file is journaled and resumed)."""
+    if seconds <= 0:
+        return
+    if readiness['state'] == 'stopping':
+        raise JobInterruptedError()
+    metrics.inc('rate_limited_total', outcome='deferred')
+    status.update(
+        f"⏳ *Waiting for your earlier files*\n\n"
+        f"You've sent a lot of audio in a short time, so this {file_type.lower()} "
+        f"starts in about {seconds:.0f}s.\n"
+        f"Send /cancel to stop.",
+        parse_mode='Markdown'
     )
+    woken = asyncio.Event()
+    waiting = deferred_transcriptions.setdefault(user_id, {})
+    waiting[woken] = asyncio.current_task()
+    try:
+        await asyncio.wait_for(woken.wait(), seconds)
+    except asyncio.TimeoutError:
+        return
+    finally:
+        waiting.pop(woken, None)
+        if not waiting and deferred_transcriptions.get(user_id) is waiting:
+            del deferred_transcriptions[user_id]
+    raise JobInterruptedError() if readiness['state'] == 'stopping' else JobCancelledError()
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks."""
-    query = update.callback_query
-    await query.answer()
+async def run_scheduled_transcription(status, user_id, model_name, file_type, duration, file_size, audio_bytes,
+                                      language=None, prior=None, options=None, journal_id=None):
+    """Queue audio for the worker pool and wait. Returns None if the queue is full.
     
-    user_id = query.from_user.id
-    stats = get_user_stats(user_id)
+    audio_bytes may be a StreamBuffer that is still downloading (thread pool only).
+    language and prior come from resolve_language(), options from
+    choose_decode_options(); journal_id lets long files checkpoint their chunks.
+    """
+    long_form = duration >= LONG_AUDIO_SECONDS
+    partial_segments = []
     
-    if query.data == 'features':
-        features_text = (
-            "🌟 *PREMIUM FEATURES*\n\n"
-            "🎯 *AI-Powered Transcription:*\n"
-            "• OpenAI Whisper Large-v3 model\n"
-            "• 99%+ accuracy across all languages\n"
-            "• Automatic language detection\n"
-            "• Multi-speaker recognition\n"
-            "• Background noise filtering\n\n"
-            "📊 *Advanced Analysis:*\n"
-            "• Word-level timestamps\n"
-            "• Speaking pace metrics\n"
-            "• Confidence scores\n"
-            "• Audio quality assessment\n"
-            "• Emotion detection\n\n"
-            "📤 *Export Formats:*\n"
-            "• Plain text\n"
-            "• Timestamped text\n"
-            "• JSON with full metadata\n"
-            "• SRT subtitles\n"
-            "• VTT subtitles\n"
-            "• Word document\n\n"
-            "🎵 *Media Detection:*\n"
-            "• Background music identification\n"
-            "• Sound effects recognition\n"
-            "• Multi-track separation"
-        )
-        await query.edit_message_text(features_text, parse_mode='Markdown')
-        
-    elif query.data == 'help':
-        help_text = (
-            "❓ *QUICK START GUIDE*\n\n"
-            "1️⃣ Send voice note or audio file\n"
-            "2️⃣ Wait for AI processing (5-30 sec)\n"
-            "3️⃣ Receive transcription instantly\n"
-            "4️⃣ Export in your preferred format\n\n"
-            "💡 *Pro Tips:*\n"
-            "• Clear audio = better results\n"
-            "• Any language works!\n"
-            "• No file size limits\n"
-            "• Unlimited usage\n\n"
-            "🎛️ *Commands:*\n"
-            "/start - Main menu\n"
-            "/stats - Your statistics\n"
-            "/languages - All 100+ languages\n"
-            "/export - Export last result\n"
-            "/quality - Audio quality tips\n"
-            "/feedback - Contact us"
-        )
-        await query.edit_message_text(help_text, parse_mode='Markdown')
-        
-    elif query.data == 'stats':
-        avg = stats.total_duration / stats.total_transcriptions if stats.total_transcriptions > 0 else 0
-        stats_text = (
-            f"📊 *YOUR STATISTICS*\n\n"
-            f"🎯 Transcriptions: {stats.total_transcriptions}\n"
-            f"⏱️ Total Audio: {stats.total_duration/60:.1f} min\n"
-            f"📈 Average Length: {avg:.1f}s\n"
-            f"📅 Member Since: {stats.first_use.strftime('%Y-%m-%d')}\n"
-            f"🕐 Last Used: {stats.last_use.strftime('%Y-%m-%d %H:%M')}\n\n"
-            f"🌍 *Language Breakdown:*\n"
-        )
-        
-        if stats.languages:
-            for lang, count in sorted(stats.languages.items(), key=lambda x: x[1], reverse=True)[:5]:
-                pct = (count/stats.total_transcriptions)*100
-                stats_text += f"   • {lang}: {count} ({pct:.1f}%)\n"
+    def on_segment(segment):
+        partial_segments.append(segment)
+        on_segments(partial_segments)
+    
+    def on_segments(segments):
+        if segments:
+            text = " ".join(segment['text'] for segment in segments)
+            status.update(format_partial(file_type, text, segments[-1]['end'], duration))
+    
+    streaming = STREAM_PARTIAL_RESULTS and scheduler.pool_kind == 'thread'
+    try:
+        if long_form:
+            # Decode and VAD only: the fair queue charges the audio seconds to the chunks
+            job = scheduler.submit(
+                user_id, prepare_long_transcription, model_name, audio_bytes, language, prior, options,
+                scheduler.pool_kind != 'thread'
+            )
         else:
-            stats_text += "   Send your first audio!\n"
-            
-        await query.edit_message_text(stats_text, parse_mode='Markdown')
-        
-    elif query.data == 'langs':
-        langs_text = (
-            "🌍 *100+ LANGUAGES SUPPORTED*\n\n"
-            "🔥 *Popular:*\n"
-            "English, Spanish, French, German, Italian, Portuguese, Russian, Chinese, Japanese, Korean, Arabic, Hindi, Turkish, Dutch, Polish\n\n"
-            "🌏 *Asian:*\n"
-            "Vietnamese, Thai, Indonesian, Tagalog, Malay, Tamil, Bengali, Urdu, Persian, Hebrew\n\n"
-            "🌍 *European:*\n"
-            "Swedish, Norwegian, Danish, Finnish, Greek, Czech, Hungarian, Romanian, Ukrainian, Bulgarian\n\n"
-            "🌎 *Others:*\n"
-            "Swahili, Afrikaans, Welsh, Icelandic, Maori, and 70+ more!\n\n"
-            "✨ Auto-detected from audio"
-        )
-        await query.edit_message_text(langs_text, parse_mode='Markdown')
+            # Batched clips come back without word timings
+            short_clip = 0 < duration <= BATCH_MAX_SECONDS and not options['word_timestamps']
+            job = scheduler.submit(
+                user_id, run_transcription, model_name, audio_bytes, language, prior, options,
+                cost=duration,
+                on_progress=on_segment if streaming and not short_clip else None,
+                batch_fn=transcribe_batch if short_clip else None,
+                batch_key=(model_name, options['beam_size'])
+            )
+    except QueueFullError:
+        await status.finish(BUSY_TEXT, parse_mode='Markdown')
+        return None
     
-    elif query.data.startswith('export_'):
-        if 'last_transcription' not in context.user_data:
-            await query.edit_message_text("❌ No transcription to export!")
-            return
-            
-        data = context.user_data['last_transcription']
-        export_type = query.data.split('_')[1]
-        
-        if export_type == 'json':
-            json_str = json.dumps(data, indent=2)
-            file_content = json_str.encode()
-            filename = f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            
-        elif export_type == 'srt':
-            # Create SRT format
-            srt_content = create_srt(data)
-            file_content = srt_content.encode()
-            filename = f"subtitles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.srt"
-            
-        elif export_type == 'txt':
-            file_content = data['text'].encode()
-            filename = f"transcript_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        
-        # Send file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{export_type}')
-        temp_file.write(file_content)
-        temp_file.close()
-        
-        await context.bot.send_document(
-            chat_id=query.message.chat_id,
-            document=open(temp_file.name, 'rb'),
-            filename=filename,
-            caption=f"📤 Your transcription exported as {export_type.upper()}"
+    position = scheduler.position(job)
+    if position > 0:
+        status.update(
+            f"🎧 *Processing {file_type}*\n\n"
+            f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
+            f"⏳ You are #{position} in line...\n"
+            f"Send /cancel to stop.",
+            parse_mode='Markdown'
+        )
+    else:
+        status.update(
+            f"🎧 *Processing {file_type}*\n\n"
+            f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
+            f"🧠 AI Transcribing...\n"
+            f"🎯 Model: {model_display_name(model_name)} (OpenAI)",
+            parse_mode='Markdown'
         )
-        
-        os.remove(temp_file.name)
-        await query.answer("Exported successfully! ✅")
-
-def create_srt(data):
-    """Create SRT subtitle format."""
-    text = data['text']
-    duration = data.get('duration', 60)
-    words = text.split()
-    
-    srt = ""
-    words_per_sub = 10
-    time_per_sub = duration / (len(words) / words_per_sub)
     
-    for i in range(0, len(words), words_per_sub):
-        subtitle_num = (i // words_per_sub) + 1
-        start_time = i / words_per_sub * time_per_sub
-        end_time = min(start_time + time_per_sub, duration)
-        
-        start_str = format_time_srt(start_time)
-        end_str = format_time_srt(end_time)
-        
-        subtitle_text = " ".join(words[i:i+words_per_sub])
-        
-        srt += f"{subtitle_num}\n{start_str} --> {end_str}\n{subtitle_text}\n\n"
+    if not long_form:
+        return await job.future
     
-    return srt
-
-def format_time_srt(seconds):
-    """Format time for SRT format."""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+    plan = await job.future
+    chunks = len(plan['boundaries']) - 1
+    status.update(
+        f"🎧 *Processing {file_type}*\n\n"
+        f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
+        f"🧩 Long audio: transcribing {chunks} parts in parallel...\n"
+        f"🌍 Language: {get_language_name(plan['language'])}",
+        parse_mode='Markdown'
+    )
+    timings = plan.pop('timings')
+    try:
+        # Wall-clock time of the parallel chunks, not the sum of their CPU time
+        with timed(timings, 'inference'):
+            result = await run_long_transcription(
+                user_id, plan, on_progress=on_segments if streaming else None, journal_id=journal_id
+            )
+    finally:
+        if isinstance(plan['audio'], str):
+            with suppress(FileNotFoundError):
+                os.remove(plan['audio'])  # spooled for process/queue workers
+    result['timings'] = timings
+    return result
 
 async def transcribe_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main transcription function using Faster-Whisper."""
     user_id = update.effective_user.id
-    stats = get_user_stats(user_id)
+    chat_id = update.message.chat_id
+    status = None
+    journal_id = None
+    charge = None  # (buckets, audio seconds) taken from the rate limits
+    transcribed = False
     
     try:
-        await update.message.chat.send_action(ChatAction.TYPING)
+        # Progress goes through the rate-limited output layer and never blocks the pipeline
+        output.post(chat_id, update.message.chat.send_action, ChatAction.TYPING)
         
-        status_msg = await update.message.reply_text(
+        status_msg = await output.call(
+            chat_id, update.message.reply_text,
             "🎧 *Processing Audio...*\n⏳ Initializing AI...",
             parse_mode='Markdown'
         )
+        status = output.live(status_msg)
         
         start_time = time.time()
+        timings = {}
         
         # Get file
         if update.message.voice:
-            audio_file = await update.message.voice.get_file()
-            duration = update.message.voice.duration
-            file_size = update.message.voice.file_size
+            media = update.message.voice
+            duration = media.duration
             file_type = "Voice Note"
         elif update.message.audio:
-            audio_file = await update.message.audio.get_file()
-            duration = update.message.audio.duration or 0
-            file_size = update.message.audio.file_size
+            media = update.message.audio
+            duration = media.duration or 0
             file_type = "Audio File"
+        elif update.message.video_note:
+            media = update.message.video_note
+            duration = media.duration
+            file_type = "Video Note"
+        elif update.message.video:
+            media = update.message.video
+            duration = media.duration or 0
+            file_type = "Video"
+        elif update.message.document:
+            # Audio or video sent "as a file": no duration until the download is probed
+            media = update.message.document
+            duration = 0
+            file_type = "Document"
         else:
-            await status_msg.edit_text("❌ Unsupported file type.")
+            await status.finish("❌ Unsupported file type.")
             return
+        file_size = media.file_size or 0
         
-        await status_msg.edit_text(
-            f"🎧 *Processing {file_type}*\n\n"
-            f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
-            f"⬇️ Downloading...",
-            parse_mode='Markdown'
-        )
-        
-        # Download
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_input:
-            input_path = temp_input.name
-            await audio_file.download_to_drive(input_path)
-        
-        # Convert to WAV for Whisper
-        await status_msg.edit_text(
-            f"🎧 *Processing {file_type}*\n\n"
-            f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
-            f"🔄 Converting format...",
-            parse_mode='Markdown'
-        )
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_output:
-            output_path = temp_output.name
-        
-        audio = AudioSegment.from_file(input_path)
-        audio = audio.set_frame_rate(16000).set_channels(1)
-        audio.export(output_path, format='wav')
+        # Admission: refuse from the declared metadata before spending anything
+        refusal = admission_error(duration, file_size)
+        if refusal:
+            metrics.inc('transcriptions_total', outcome='refused')
+            await status.finish(refusal, parse_mode='Markdown')
+            return
         
-        # Transcribe with Faster-Whisper
-        await status_msg.edit_text(
-            f"🎧 *Processing {file_type}*\n\n"
-            f"📊 Duration: {duration}s | Size: {file_size/1024:.1f}KB\n"
-            f"🧠 AI Transcribing...\n"
-            f"🎯 Model: Whisper-Base (OpenAI)",
-            parse_mode='Markdown'
-        )
+        # Smaller model, and cheaper decoding, for long files or when the queue is deep
+        depth = scheduler.depth
+        model_name = route_model(duration, depth, user_id)
+        # /lang override, or the user's usual language as a prior for detection
+        preferences, stats = await asyncio.gather(get_user_preferences(user_id), get_user_stats(user_id))
+        language, prior = resolve_language(preferences, stats)
+        policy, options = choose_decode_options(duration, depth, preferences.get('subtitles') == 'on')
+        words = options['word_timestamps']
         
-        # Run transcription
-        segments, info = model.transcribe(
-            output_path,
-            beam_size=5,
-            language=None,  # Auto-detect
-            vad_filter=True,  # Voice activity detection
-            word_timestamps=True
-        )
+        # Forwarded/re-sent media keeps its file_unique_id: answer without downloading
+        file_key = cache.make_key('file', media.file_unique_id, model_name, language, words)
+        result = await cache.aget(file_key)
+        cached = result is not None
+        metrics.inc('transcription_cache_lookups_total', layer='file', result='hit' if cached else 'miss')
         
-        # Process segments
-        full_text = ""
-        word_count = 0
-        segments_list = []
+        if result is None:
+            # Per-user and per-group limits on audio seconds; a short wait is sat out, a long one refused.
+            # Files without a declared duration are charged once the download has been measured.
+            wait = 0.0
+            if duration:
+                charge, wait = await take_rate_limits(user_id, update.message.chat, duration)
+            
+            # Journaled before the deferral and the download, so a restart from here on replays it
+            journal_id = await journal.astart(update)
+            await wait_out_rate_limit(status, user_id, file_type, wait)
+            
+            if (scheduler.depth >= scheduler.max_queue
+                    or len(active_transcriptions) >= MAX_ACTIVE_TRANSCRIPTIONS):
+                # Don't download what we could not queue anyway
+                metrics.inc('transcriptions_total', outcome='rejected')
+                await status.finish(BUSY_TEXT, parse_mode='Markdown')
+                return
+            
+            active_transcriptions[asyncio.current_task()] = user_id
+            if readiness['state'] == 'stopping':
+                raise JobInterruptedError()
+            audio_file = await media.get_file()
+            
+            status.update(
+                f"🎧 *Processing {file_type}*\n\n"
+                f"📊 Duration: {f'{duration}s' if duration else 'unknown'} | Size: {file_size/1024:.1f}KB\n"
+                f"⬇️ Downloading...",
+                parse_mode='Markdown'
+            )
+            
+            # Stream into memory in bounded chunks (no temp files), probing the header first
+            download = AudioDownload(audio_file, MAX_DOWNLOAD_MB * 2**20)
+            download_task = asyncio.create_task(download.run())
+            container = await download.probe(download_task)
+            
+            # Big files decode while they download: the decoder reads the
+            # StreamBuffer as bytes arrive. Batched clips, process workers and
+            # mp4 (index often at the end) wait for the whole file instead.
+            overlap = (
+                scheduler.pool_kind == 'thread'
+                and container not in NON_STREAMABLE_CONTAINERS
+                and file_size >= STREAM_DECODE_MIN_MB * 2**20
+                and duration > BATCH_MAX_SECONDS
+            )
+            if overlap:
+                transcription = asyncio.create_task(run_scheduled_transcription(
+                    status, user_id, model_name, file_type, duration, file_size, download.buffer,
+                    language, prior, options, journal_id
+                ))
+                outcomes = await asyncio.gather(download_task, transcription, return_exceptions=True)
+                for outcome in outcomes:
+                    if isinstance(outcome, BaseException):
+                        raise outcome
+                result = outcomes[1]
+                content_key = cache.make_key('sha256', download.sha256, model_name, language, words)
+            else:
+                await download_task
+                if not duration:
+                    # Documents (and files sent without metadata): measure before routing
+                    duration = max(1, round(await asyncio.to_thread(probe_duration, download.buffer.getvalue())))
+                    refusal = admission_error(duration, file_size)
+                    if refusal:
+                        metrics.inc('transcriptions_total', outcome='refused')
+                        await status.finish(refusal, parse_mode='Markdown')
+                        return
+                    charge, wait = await take_rate_limits(user_id, update.message.chat, duration)
+                    await wait_out_rate_limit(status, user_id, file_type, wait)
+                    model_name = route_model(duration, depth, user_id)
+                    policy, options = choose_decode_options(duration, depth, words)
+                    file_key = cache.make_key('file', media.file_unique_id, model_name, language, words)
+                # Same audio uploaded as a different file
+                content_key = cache.make_key('sha256', download.sha256, model_name, language, words)
+                result = await cache.aget(content_key)
+                cached = result is not None
+                metrics.inc('transcription_cache_lookups_total', layer='content', result='hit' if cached else 'miss')
+                if result is None:
+                        result = await run_scheduled_transcription(
+                        status, user_id, model_name, file_type, duration, file_size,
+                        download.buffer.getvalue(), language, prior, options, journal_id
+                    )
+            timings['download'] = download.seconds
+            
+            if not cached:
+                if result is None:
+                    metrics.inc('transcriptions_total', outcome='rejected')
+                    return
+                transcribed = True
+                timings.update(result.pop('timings', {}))
+                metrics.inc('language_resolutions_total', source=result['language_source'])
+                metrics.inc('audio_trimmed_seconds_total', result.get('trimmed_seconds', 0.0))
+                processing = sum(timings.get(stage, 0.0) for stage in PROCESSING_STAGES)
+                rtf = duration / max(processing, 1e-6)
+                if duration > 0:
+                    metrics.observe('transcription_realtime_factor', rtf, policy=policy)
+                # One line per decision, to tune the policy from real traffic
+                logger.info(
+                    f"Decode policy {policy}: beam={options['beam_size']} words={words} "
+                    f"fallback={options['temperature'] != 0.0} context={options['condition_on_previous_text']} "
+                    f"| {model_name}, {duration}s audio, queue depth {depth} "
+                    f"| RTF {f'{rtf:.1f}' if duration > 0 else 'n/a'}"
+                )
+                metrics.inc('decode_policy_total', policy=policy)
+            
+            await cache.aput([file_key, content_key], result)
         
-        for segment in segments:
-            full_text += segment.text + " "
-            word_count += len(segment.text.split())
-            segments_list.append({
-                'start': segment.start,
-                'end': segment.end,
-                'text': segment.text.strip()
-            })
-        
-        full_text = full_text.strip()
-        
-        detected_language = info.language
-        confidence = info.language_probability
+        full_text = result['text']
+        word_count = result['words']
+        segments_list = result['segments']
+        detected_language = result['language']
+        confidence = result['language_probability']
         processing_time = time.time() - start_time
         speaking_rate = word_count / (duration if duration > 0 else 1) * 60
         
-        # Update stats
-        stats.total_transcriptions += 1
-        stats.total_duration += duration
-        stats.last_use = datetime.now()
+        # Update stats (buffered, written in the background)
+        stats_store.record(user_id, duration, detected_language, result['model'])
         lang_name = get_language_name(detected_language)
-        stats.languages[lang_name] = stats.languages.get(lang_name, 0) + 1
+        lang_note = {'override': ' (set with /lang)', 'prior': ' (your usual language)'}.get(
+            result.get('language_source'), '')
+        trimmed = result.get('trimmed_seconds', 0.0)
+        trimmed_line = f"✂️ Silence Skipped: {trimmed:.0f}s\n" if trimmed >= 1 else ""
         
         # Create result
         result_text = (
@@ -371,32 +3312,20 @@ async def transcribe_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"{full_text[:500]}{'...' if len(full_text) > 500 else ''}\n\n"
             f"━━━━━━━━━━━━━━━━\n"
             f"📊 *Analysis:*\n"
-            f"🌍 Language: {lang_name}\n"
+            f"🌍 Language: {lang_name}{lang_note}\n"
             f"🎯 Confidence: {confidence*100:.1f}%\n"
             f"📏 Words: {word_count}\n"
             f"⏱️ Duration: {duration}s\n"
+            f"{trimmed_line}"
             f"🗣️ Speaking Rate: {speaking_rate:.0f} wpm\n"
-            f"⚡ Processing: {processing_time:.1f}s\n"
-            f"🎵 Model: Whisper-Base"
-        )
-        
-        # Export buttons
-        export_keyboard = [
-            [InlineKeyboardButton("📄 TXT", callback_data='export_txt'),
-             InlineKeyboardButton("⏱️ SRT", callback_data='export_srt')],
-            [InlineKeyboardButton("📊 JSON", callback_data='export_json'),
-             InlineKeyboardButton("📈 Details", callback_data='export_detail')]
-        ]
-        export_markup = InlineKeyboardMarkup(export_keyboard)
-        
-        await status_msg.edit_text(
-            result_text,
-            parse_mode='Markdown',
-            reply_markup=export_markup
+            f"⚡ Processing: {processing_time:.1f}s{' (cached)' if cached else ''}\n"
+            f"🎵 Model: {model_display_name(result['model'])}"
         )
         
-        # Store for export
-        context.user_data['last_transcription'] = {
+        reply_start = time.perf_counter()
+        # Store for export first: the buttons carry the stored item's id
+        preview = full_text[:30] + ('...' if len(full_text) > 30 else '')
+        export_id = await export_store.aadd(user_id, {
             'text': full_text,
             'language': lang_name,
             'language_code': detected_language,
@@ -406,43 +3335,100 @@ async def transcribe_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'speaking_rate': speaking_rate,
             'segments': segments_list,
             'timestamp': datetime.now().isoformat()
-        }
+        }, f"{lang_name}, {duration}s: {preview or 'no speech'}")
+        
+        await status.finish(
+            result_text,
+            parse_mode='Markdown',
+            reply_markup=export_keyboard(export_id)
+        )
         
-        # Send full text if truncated
+        # Send full text if truncated (split into several messages, or a file)
         if len(full_text) > 500:
-            await update.message.reply_text(
-                f"📝 *Full Transcription:*\n\n{full_text}",
-                parse_mode='Markdown'
-            )
+            await output.send_long(update.message, full_text, "📝 Full Transcription")
+        timings['reply'] = time.perf_counter() - reply_start
+        metrics.observe_stages(timings)
+        metrics.inc('transcriptions_total', outcome='cached' if cached else 'transcribed')
+        
+    except JobCancelledError:
+        metrics.inc('transcriptions_total', outcome='cancelled')
+        if status is not None:
+            await status.finish("🛑 Transcription cancelled.")
         
-        # Cleanup
-        os.remove(input_path)
-        os.remove(output_path)
+    except JobInterruptedError:
+        metrics.inc('transcriptions_total', outcome='interrupted')
+        journal_id = None  # stays journaled: resumed after the restart
+        await status.finish(RESTARTING_TEXT, parse_mode='Markdown')
+        
+    except asyncio.CancelledError:
+        if asyncio.current_task() not in cancelled_transcriptions:
+            journal_id = None
+            raise
+        # /cancel while downloading, decoding or waiting for the result
+        asyncio.current_task().uncancel()
+        metrics.inc('transcriptions_total', outcome='cancelled')
+        await status.finish("🛑 Transcription cancelled.")
+        
+    except RateLimitedError as e:
+        metrics.inc('rate_limited_total', outcome='refused')
+        metrics.inc('transcriptions_total', outcome='rate_limited')
+        logger.info(f'Rate limited user {user_id} in chat {chat_id}: {e}')
+        await status.finish(rate_limited_text(update.message.chat, e.wait), parse_mode='Markdown')
+        
+    except DownloadRejected as e:
+        metrics.inc('transcriptions_total', outcome='refused')
+        await status.finish(str(e))
         
     except Exception as e:
+        metrics.inc('transcriptions_total', outcome='error')
+        metrics.inc('transcription_errors_total', type=type(e).__name__)
         logger.error(f'Transcription error: {e}')
-        await update.message.reply_text(
+        if status is not None:
+            await status.close()
+        await output.call(
+            chat_id, update.message.reply_text,
             f"❌ *Error*\n\n{str(e)}\n\nPlease try again.",
             parse_mode='Markdown'
         )
+    
+    finally:
+        active_transcriptions.pop(asyncio.current_task(), None)
+        cancelled_transcriptions.discard(asyncio.current_task())
+        if journal_id is not None:
+            await journal.afinish(journal_id)
+        if charge is not None and not transcribed:
+            # Refused, failed, cancelled, interrupted or cached: no Whisper time was spent
+            await take_audio_tokens(charge[0], -charge[1])
+
+LANGUAGE_NAMES = {
+    'en': 'English', 'es': 'Spanish', 'fr': 'French', 'de': 'German',
+    'it': 'Italian', 'pt': 'Portuguese', 'ru': 'Russian', 'zh': 'Chinese',
+    'ja': 'Japanese', 'ko': 'Korean', 'ar': 'Arabic', 'hi': 'Hindi',
+    'tr': 'Turkish', 'pl': 'Polish', 'nl': 'Dutch', 'sv': 'Swedish',
+    'no': 'Norwegian', 'da': 'Danish', 'fi': 'Finnish', 'el': 'Greek',
+    'cs': 'Czech', 'hu': 'Hungarian', 'ro': 'Romanian', 'uk': 'Ukrainian',
+    'vi': 'Vietnamese', 'th': 'Thai', 'id': 'Indonesian'
+}
 
 def get_language_name(code):
     """Convert language code to name."""
-    lang_map = {
-        'en': 'English', 'es': 'Spanish', 'fr': 'French', 'de': 'German',
-        'it': 'Italian', 'pt': 'Portuguese', 'ru': 'Russian', 'zh': 'Chinese',
-        'ja': 'Japanese', 'ko': 'Korean', 'ar': 'Arabic', 'hi': 'Hindi',
-        'tr': 'Turkish', 'pl': 'Polish', 'nl': 'Dutch', 'sv': 'Swedish',
-        'no': 'Norwegian', 'da': 'Danish', 'fi': 'Finnish', 'el': 'Greek',
-        'cs': 'Czech', 'hu': 'Hungarian', 'ro': 'Romanian', 'uk': 'Ukrainian',
-        'vi': 'Vietnamese', 'th': 'Thai', 'id': 'Indonesian'
-    }
-    return lang_map.get(code, code.upper())
+    return LANGUAGE_NAMES.get(code, code.upper())
+
+def parse_language(text):
+    """A Whisper language code from a code or an English name, else None."""
+    from faster_whisper.tokenizer import _LANGUAGE_CODES
+    text = text.strip().lower()
+    if text in _LANGUAGE_CODES:
+        return text
+    for code, name in LANGUAGE_NAMES.items():
+        if name.lower() == text:
+            return code
+    return None
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Detailed statistics."""
     user_id = update.effective_user.id
-    stats = get_user_stats(user_id)
+    stats = await get_user_stats(user_id)
     
     avg = stats.total_duration / stats.total_transcriptions if stats.total_transcriptions > 0 else 0
     
@@ -459,19 +3445,24 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     if stats.languages:
-        for lang, count in sorted(stats.languages.items(), key=lambda x: x[1], reverse=True)[:5]:
+        for lang, count in stats.languages.most_common(5):
             pct = (count/stats.total_transcriptions)*100
-            stats_text += f"   • {lang}: {count} times ({pct:.1f}%)\n"
+            stats_text += f"   • {get_language_name(lang)}: {count} times ({pct:.1f}%)\n"
     else:
         stats_text += "   No transcriptions yet!\n"
     
+    if stats.models:
+        stats_text += "\n🧠 *Models Used:*\n"
+        for name, count in stats.models.most_common():
+            stats_text += f"   • {model_display_name(name)}: {count} times\n"
+    
     stats_text += (
-        f"\n💎 *Your Access:*\n"
-        f"   ✅ Unlimited transcriptions\n"
-        f"   ✅ All 100+ languages\n"
-        f"   ✅ OpenAI Whisper AI\n"
-        f"   ✅ Advanced features\n"
-        f"   ✅ No ads, 100% free!"
+        "\n💎 *Your Access:*\n"
+        "   ✅ Unlimited transcriptions\n"
+        "   ✅ All 100+ languages\n"
+        "   ✅ OpenAI Whisper AI\n"
+        "   ✅ Advanced features\n"
+        "   ✅ No ads, 100% free!"
     )
     
     await update.message.reply_text(stats_text, parse_mode='Markdown')
@@ -499,27 +3490,99 @@ async def languages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(langs_text, parse_mode='Markdown')
 
+async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or set the transcription language."""
+    user_id = update.effective_user.id
+    if not context.args:
+        preferences, stats = await asyncio.gather(get_user_preferences(user_id), get_user_stats(user_id))
+        current = preferences.get('language')
+        _, prior = resolve_language(preferences, stats)
+        if current:
+            setting = f"*{get_language_name(current)}* (detection off)"
+        elif prior:
+            setting = f"Auto-detect, falling back to *{get_language_name(prior)}* when unsure"
+        else:
+            setting = "Auto-detect"
+        await update.message.reply_text(
+            f"🌍 *TRANSCRIPTION LANGUAGE*\n\n"
+            f"Current: {setting}\n\n"
+            f"• `/lang es` or `/lang spanish` - always transcribe as Spanish\n"
+            f"• `/lang auto` - detect the language of every file",
+            parse_mode='Markdown'
+        )
+        return
+    
+    choice = ' '.join(context.args)
+    if choice.lower() == 'auto':
+        await set_user_preference(user_id, 'language', None)
+        await update.message.reply_text("🌍 Language detection is back to automatic.")
+        return
+    code = parse_language(choice)
+    if code is None:
+        await update.message.reply_text(
+            f"❌ Unknown language: {choice}\n"
+            f"Use a code like en, es or de, or see /languages."
+        )
+        return
+    await set_user_preference(user_id, 'language', code)
+    await update.message.reply_text(
+        f"🌍 Transcribing as *{get_language_name(code)}* from now on.\n"
+        f"Send `/lang auto` to detect the language again.",
+        parse_mode='Markdown'
+    )
+
+async def subtitles_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Turn word-level timings (for SRT/VTT exports) on or off."""
+    user_id = update.effective_user.id
+    choice = context.args[0].lower() if context.args else None
+    if choice not in ('on', 'off'):
+        enabled = (await get_user_preferences(user_id)).get('subtitles') == 'on'
+        await update.message.reply_text(
+            f"🎬 *SUBTITLE TIMING*\n\n"
+            f"Current: *{'Word by word' if enabled else 'Sentence by sentence'}*\n\n"
+            f"• `/subtitles on` - time every word, for the best SRT/VTT (a little slower)\n"
+            f"• `/subtitles off` - time each sentence and spread its words evenly",
+            parse_mode='Markdown'
+        )
+        return
+    await set_user_preference(user_id, 'subtitles', 'on' if choice == 'on' else None)
+    if choice == 'on':
+        await update.message.reply_text("🎬 Your next files get word-by-word timings for subtitles.")
+    else:
+        await update.message.reply_text("🎬 Word timings off: subtitles are timed sentence by sentence.")
+
 async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Export last transcription."""
-    if 'last_transcription' not in context.user_data:
+    """Export one of the recent transcriptions."""
+    items = await export_store.arecent(update.effective_user.id)
+    if not items:
         await update.message.reply_text(
             "❌ No transcription to export.\n"
             "Transcribe an audio file first!"
         )
         return
     
+    if len(items) == 1:
+        await update.message.reply_text(
+            "📤 *EXPORT OPTIONS*\n\n"
+            "Choose your preferred format:",
+            parse_mode='Markdown',
+            reply_markup=export_keyboard(items[0][0])
+        )
+        return
+    
     keyboard = [
-        [InlineKeyboardButton("📄 Plain Text", callback_data='export_txt'),
-         InlineKeyboardButton("🎬 SRT Subtitles", callback_data='export_srt')],
-        [InlineKeyboardButton("📊 JSON Data", callback_data='export_json')]
+        [InlineKeyboardButton(
+            f"{datetime.fromtimestamp(created).strftime('%d %b %H:%M')} · {title}",
+            callback_data=f'exportpick:{item_id}'
+        )]
+        for item_id, created, title in items
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
-        "📤 *EXPORT OPTIONS*\n\n"
-        "Choose your preferred format:",
+        f"📤 *EXPORT OPTIONS*\n\n"
+        f"Your last {len(items)} transcriptions, newest first.\n"
+        f"Choose one to export:",
         parse_mode='Markdown',
-        reply_markup=reply_markup
+        reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
 async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -552,6 +3615,24 @@ async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(quality_text, parse_mode='Markdown')
 
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel queued and running transcriptions, and files still downloading or decoding."""
+    user_id = update.effective_user.id
+    jobs = scheduler.cancel_user(user_id)
+    tasks = [task for task, owner in active_transcriptions.items() if owner == user_id and not task.done()]
+    for task in tasks:
+        cancelled_transcriptions.add(task)
+        task.cancel()
+    deferred = deferred_transcriptions.pop(user_id, {})
+    for woken in deferred:
+        woken.set()
+    cancelled = len(tasks) + len(deferred) or jobs
+    
+    if cancelled:
+        await update.message.reply_text(f"🛑 Cancelled {cancelled} transcription(s).")
+    else:
+        await update.message.reply_text("Nothing to cancel.")
+
 async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Feedback."""
     await update.message.reply_text(
@@ -564,6 +3645,184 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+def warm_up_model(model_name):
+    """Load a model and run one dummy inference so the first user doesn't pay for it."""
+    with models.use(model_name) as model:
+        segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language='en', beam_size=1)
+        list(segments)
+    return get_device()
+
+def warm_up():
+    """Background startup: load and warm the default model in the worker pool."""
+    readiness['state'] = 'warming'
+    try:
+        if scheduler.pool_kind == 'process':
+            # Start every process; the pool initializer warms each one's model
+            futures = [scheduler.executor.submit(get_device) for _ in range(scheduler.workers)]
+        elif scheduler.pool_kind == 'queue':
+            # queue_worker_main warms its model before claiming, so the first
+            # job back means a worker is ready
+            futures = [scheduler.executor.submit(get_device)]
+        else:
+            futures = [scheduler.executor.submit(warm_up_model, DEFAULT_MODEL)]
+        device, compute_type = futures[0].result()
+        for future in futures[1:]:
+            future.result()
+    except Exception as e:
+        logger.error(f'Model warm-up failed: {e}')
+        readiness['state'] = 'failed'
+        readiness['error'] = str(e)
+        return
+    if readiness['state'] == 'stopping':
+        return
+    readiness['state'] = 'ready'
+    logger.info(f'Model ready after {time.time() - readiness["since"]:.1f}s | Device: {device} | Compute: {compute_type}')
+
+SPOOL_FILE = re.compile(r'longform-[a-z0-9_]{8}\.f32')  # spool_audio(), left by a crash
+
+def sweep_temp_files(min_age=3600):
+    """Delete this user's leftover long-form spools. Returns the count.
+    
+    Downloads and exports stay in memory; the only temp files written are
+    long-form spools in process and queue mode, removed when their job ends.
+    A crash can still leave one in a persistent /tmp. Only names with the
+    spool prefix are touched: bare tmpXXXXXXXX files in a shared temp
+    directory may belong to anything else running as this user.
+    """
+    directory = tempfile.gettempdir()
+    removed = 0
+    for entry in os.scandir(directory):
+        try:
+            info = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if (entry.is_file(follow_symlinks=False) and SPOOL_FILE.fullmatch(entry.name)
+                and info.st_uid == os.getuid() and time.time() - info.st_mtime > min_age):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+async def resume_journal(application):
+    """Startup: replay the transcriptions a restart interrupted, then wait for them."""
+    replays = []
+    removed = await asyncio.to_thread(sweep_temp_files)
+    if removed:
+        logger.info(f'Removed {removed} orphaned temp file(s)')
+    for job_id, attempts, created, update_json in await journal.aunfinished():
+        update = Update.de_json(json.loads(update_json), application.bot)
+        if attempts >= JOURNAL_MAX_ATTEMPTS or time.time() - created > JOURNAL_MAX_AGE_HOURS * 3600:
+            # Keeps crashing the bot, or too old for the user to still be waiting
+            logger.warning(f'Dropping journaled job {job_id} after {attempts} attempt(s)')
+            await journal.afinish(job_id)
+            metrics.inc('journal_jobs_total', outcome='dropped')
+            message = update.effective_message
+            try:
+                await output.call(
+                    message.chat_id, application.bot.send_message, message.chat_id,
+                    "❌ A restart interrupted this transcription and it could not be resumed. "
+                    "Please send the file again.",
+                    reply_to_message_id=message.message_id
+                )
+            except TelegramError as e:
+                logger.debug(f'Could not tell chat {message.chat_id} about job {job_id}: {e}')
+            continue
+        logger.info(f'Resuming journaled job {job_id} (attempt {attempts + 1})')
+        metrics.inc('journal_jobs_total', outcome='resumed')
+        replays.append(asyncio.create_task(application.process_update(update)))
+    await asyncio.gather(*replays, return_exceptions=True)
+
+async def drain_transcriptions(grace):
+    """SIGTERM: let running transcriptions finish for up to grace seconds.
+    
+    Jobs still running after that are interrupted; their users are told and
+    their journal entries (with any finished chunks) are resumed on startup.
+    """
+    readiness['state'] = 'stopping'
+    # Files sitting out a rate limit would not start in time: interrupt them now
+    deferred = [task for waiting in deferred_transcriptions.values() for task in waiting.values()]
+    for waiting in deferred_transcriptions.values():
+        for woken in waiting:
+            woken.set()
+    if active_transcriptions or deferred:
+        logger.info(f'Draining {len(active_transcriptions)} transcription(s) for up to {grace:g}s '
+                    f'({len(deferred)} rate-limited file(s) interrupted)...')
+        await asyncio.wait(set(active_transcriptions) | set(deferred), timeout=grace)
+    interrupted = scheduler.interrupt_all()
+    if active_transcriptions:
+        logger.info(f'Interrupted {len(active_transcriptions)} transcription(s); they resume after the restart')
+        # Give them a moment to checkpoint and tell their users
+        await asyncio.wait(set(active_transcriptions), timeout=5)
+    elif interrupted:
+        logger.info(f'Interrupted {interrupted} queued job(s)')
+    scheduler.close()
+
+async def start_polling_services(application):
+    """post_init hook for polling: health checks, SIGTERM drain and journal resume."""
+    application.bot_data['http_server'] = await start_http_server()
+    loop = asyncio.get_running_loop()
+    
+    async def stop():
+        await drain_transcriptions(SHUTDOWN_GRACE_SECONDS)
+        application.stop_running()
+    
+    def on_signal():
+        if readiness['state'] != 'stopping':
+            asyncio.create_task(stop())
+    
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, on_signal)
+    application.bot_data['resume'] = asyncio.create_task(resume_journal(application))
+
+async def stop_health_server(application):
+    server = application.bot_data.pop('http_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+
+async def run_webhook(application):
+    """Serve Telegram updates and health checks from one asyncio HTTP server."""
+    if not WEBHOOK_URL:
+        raise ValueError('WEBHOOK_URL must be set when BOT_MODE=webhook')
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    # Without a configured secret, a fresh one per start still keeps strangers out
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    receiver = WebhookReceiver(
+        application.bot, application.process_update, secret,
+        UPDATE_CONCURRENCY, WEBHOOK_MAX_PENDING
+    )
+    http_routes[WEBHOOK_PATH] = (('POST',), receiver.handle)
+    
+    # Health checks answer before the Bot API handshake completes
+    server = await start_http_server()
+    try:
+        async with application:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            await application.start()
+            logger.info(f'Webhook set: {WEBHOOK_URL.rstrip("/")}{WEBHOOK_PATH}')
+            application.bot_data['resume'] = asyncio.create_task(resume_journal(application))
+            await stop.wait()
+            
+            logger.info('Stopping: finishing accepted updates...')
+            await drain_transcriptions(SHUTDOWN_GRACE_SECONDS)
+            await application.stop()
+            await receiver.drain()
+    finally:
+        server.close()
+        await server.wait_closed()
+
 def main():
     """Start the bot."""
     token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -571,26 +3830,40 @@ def main():
     if not token:
         raise ValueError('TELEGRAM_BOT_TOKEN not set!')
     
-    # Start Flask server in background thread
-    logger.info('Starting health check server...')
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    
-    application = Application.builder().token(token).build()
+    # Concurrent updates: a long transcription must not block other users' messages
+    builder = Application.builder().token(token).concurrent_updates(UPDATE_CONCURRENCY)
+    if BOT_MODE != 'webhook':
+        builder = builder.post_init(start_polling_services).post_shutdown(stop_health_server)
+    application = builder.build()
     
     # Handlers
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('stats', stats_command))
     application.add_handler(CommandHandler('languages', languages_command))
+    application.add_handler(CommandHandler('lang', lang_command))
+    application.add_handler(CommandHandler('subtitles', subtitles_command))
     application.add_handler(CommandHandler('export', export_command))
     application.add_handler(CommandHandler('quality', quality_command))
     application.add_handler(CommandHandler('feedback', feedback_command))
+    application.add_handler(CommandHandler('cancel', cancel_command))
     application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, transcribe_audio))
+    application.add_handler(MessageHandler(
+        filters.VOICE | filters.AUDIO | filters.VIDEO_NOTE | filters.VIDEO
+        | filters.Document.AUDIO | filters.Document.VIDEO,
+        transcribe_audio
+    ))
+    
+    # Updates are accepted right away; jobs arriving before warm-up finishes just wait for the model
+    Thread(target=warm_up, daemon=True, name='warm-up').start()
     
     logger.info('🚀 AI Transcription Bot started!')
-    logger.info(f'Device: {device} | Compute: {compute_type}')
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info(f'Mode: {BOT_MODE} | Workers: {WORKER_COUNT} ({WORKER_POOL}) | Max queue: {MAX_QUEUE_DEPTH}')
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        # Polling removes any webhook left over from a webhook deployment
+        # Signals are handled in start_polling_services, which drains first
+        application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,146 @@
+"""Replay recorded Telegram updates against the bot's webhook endpoint.
+
+Usage:
+    # Against a running bot (BOT_MODE=webhook)
+    python replay_updates.py updates.jsonl --url http://localhost:10000/telegram --secret $WEBHOOK_SECRET
+
+    # Self-contained check of the webhook server, no Telegram or model needed
+    python replay_updates.py --self-test
+
+Input may be JSON lines (one update per line), a JSON array of updates, or a
+saved getUpdates response ({"ok": true, "result": [...]}).
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('[') or content.startswith('{"ok"'):
+        data = json.loads(content)
+        return data['result'] if isinstance(data, dict) else data
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def sample_updates(count):
+    """Synthetic /start messages from a handful of users."""
+    updates = []
+    for i in range(count):
+        user = {'id': 1000 + i % 5, 'is_bot': False, 'first_name': f'User{i % 5}'}
+        updates.append({
+            'update_id': i + 1,
+            'message': {
+                'message_id': i + 1,
+                'date': int(time.time()),
+                'chat': {'id': user['id'], 'type': 'private'},
+                'from': user,
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            },
+        })
+    return updates
+
+
+def post(url, payload, secret, timeout=10):
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def replay(updates, url, secret, concurrency, delay=0.0):
+    """POST every update; returns (status counts, latencies)."""
+    def send(update):
+        if delay:
+            time.sleep(delay)
+        return post(url, update, secret)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, updates))
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return statuses, sorted(latency for _, latency in results)
+
+
+def report(statuses, latencies):
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f'{len(latencies)} updates | status {statuses} | p50 {p50:.1f}ms | p99 {p99:.1f}ms')
+
+
+def self_test(updates, concurrency):
+    """Run the webhook server in-process with a recording update handler."""
+    import bot_production as bot
+    from telegram import Bot
+
+    port = 18443
+    secret = 'replay-secret'
+    received = []
+
+    async def record(update):
+        await asyncio.sleep(0.01)
+        received.append(update.update_id)
+
+    loop = asyncio.new_event_loop()
+    receiver = bot.WebhookReceiver(Bot('123456:REPLAY'), record, secret, concurrency, len(updates) + 1)
+    bot.http_routes[bot.WEBHOOK_PATH] = (('POST',), receiver.handle)
+    server = loop.run_until_complete(bot.start_http_server(port))
+    Thread(target=loop.run_forever, daemon=True).start()
+
+    url = f'http://127.0.0.1:{port}{bot.WEBHOOK_PATH}'
+    statuses, latencies = replay(updates, url, secret, concurrency)
+    report(statuses, latencies)
+    asyncio.run_coroutine_threadsafe(receiver.drain(), loop).result()
+
+    failures = []
+    if sorted(received) != sorted(u['update_id'] for u in updates):
+        failures.append(f'received {len(received)} of {len(updates)} updates')
+    if post(url, updates[0], 'wrong-secret')[0] != 403:
+        failures.append('bad secret was not rejected')
+    if post(f'http://127.0.0.1:{port}/health', {}, None)[0] != 405:
+        failures.append('POST /health was not rejected')
+
+    loop.call_soon_threadsafe(server.close)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    print('OK' if not failures else 'FAILED')
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file', nargs='?', help='recorded updates (JSON lines or JSON array)')
+    parser.add_argument('--url', default='http://localhost:10000/telegram')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds between posts per sender')
+    parser.add_argument('--self-test', action='store_true')
+    parser.add_argument('--count', type=int, default=50, help='synthetic updates when no file is given')
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else sample_updates(args.count)
+    if args.self_test:
+        sys.exit(0 if self_test(updates, args.concurrency) else 1)
+    statuses, latencies = replay(updates, args.url, args.secret, args.concurrency, args.delay)
+    report(statuses, latencies)
+
+
+if __name__ == '__main__':
+    main()
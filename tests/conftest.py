@@ -0,0 +1,121 @@
+"""Shared fixtures: the bot on throwaway databases, the bench stubs and a stub model.
+
+Nothing here needs a Whisper model or the network. The bot reads its
+configuration at import time, so the database paths are pointed at a
+temporary directory before bot_production is first imported. Telegram
+objects and audio fixtures come from bench/, shared with the benchmarks.
+"""
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pytest
+
+DATA_DIR = tempfile.mkdtemp(prefix='bot-tests-')
+for variable, filename in (
+    ('CACHE_DB_PATH', 'cache.db'),
+    ('EXPORT_DB_PATH', 'exports.db'),
+    ('STATS_DB_PATH', 'stats.db'),
+    ('JOURNAL_DB_PATH', 'journal.db'),
+    ('JOB_QUEUE_PATH', 'job_queue.db'),
+):
+    os.environ[variable] = os.path.join(DATA_DIR, filename)
+# No Telegram flood limits to respect, and no reason to hold back progress edits
+os.environ['TELEGRAM_GLOBAL_RATE'] = os.environ['TELEGRAM_CHAT_RATE'] = '1000'
+os.environ['STREAM_EDIT_INTERVAL'] = '0.05'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+
+from fixtures import make_fixture  # noqa: E402
+from harness import StubChat, StubMessage, TelegramCalls, make_context, make_update  # noqa: E402
+
+_seeds = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def bot():
+    pytest.importorskip('telegram')
+    import bot_production
+    return bot_production
+
+
+def audio_fixture(seconds, declared=True):
+    """Speech-like 16 kHz WAV with a fresh seed, so no other test's cache entry matches."""
+    fixture = make_fixture(seconds, rate=16000, fmt='wav', seed=next(_seeds))
+    if not declared:
+        fixture['duration'] = None  # sent as a file: Telegram reports no duration
+    return fixture
+
+
+def send(bot, user_id, fixture, kind=None):
+    """Run one message through transcribe_audio; returns its TelegramCalls."""
+    calls = TelegramCalls()
+    asyncio.run(bot.transcribe_audio(make_update(user_id, fixture, calls, kind), make_context(calls)))
+    return calls
+
+
+def command_update(user_id, calls):
+    """A text command such as /cancel from user_id."""
+    return types.SimpleNamespace(
+        effective_user=types.SimpleNamespace(id=user_id), message=StubMessage(StubChat(user_id, calls), calls)
+    )
+
+
+async def until(condition, what, timeout=5):
+    """Poll condition() on the event loop; fail the test instead of hanging."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail(f'timed out after {timeout}s waiting for {what}')
+        await asyncio.sleep(0.01)
+
+
+Segment = namedtuple('Segment', 'start end text words')
+
+
+class FakeModel:
+    """Stands in for WhisperModel: a few one-second segments, produced slowly."""
+    feature_extractor = types.SimpleNamespace(n_samples=480000)
+
+    def __init__(self, segments=3, delay=0.0):
+        self.segments = segments
+        self.delay = delay
+        self.produced = 0
+
+    def transcribe(self, audio, language=None, **options):
+        info = types.SimpleNamespace(language=language or 'en', language_probability=0.99, duration=len(audio) / 16000)
+
+        def generate():
+            for index in range(self.segments):
+                time.sleep(self.delay)
+                self.produced += 1
+                yield Segment(index, index + 1, f' segment {index}.', None)
+        return generate(), info
+
+
+@pytest.fixture
+def fake_model(bot, monkeypatch):
+    """Replace models.use so every transcription runs on a FakeModel."""
+    model = FakeModel()
+
+    @contextmanager
+    def use(name):
+        yield model
+    monkeypatch.setattr(bot.models, 'use', use)
+    return model
+
+
+@pytest.fixture
+def handler(bot, fake_model, monkeypatch):
+    """Run transcribe_audio end to end: fresh scheduler, stub model, bot ready."""
+    scheduler = bot.TranscriptionScheduler(2, 20)
+    monkeypatch.setattr(bot, 'scheduler', scheduler)
+    monkeypatch.setitem(bot.readiness, 'state', 'ready')
+    yield fake_model
+    scheduler.close()
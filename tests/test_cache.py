@@ -0,0 +1,62 @@
+"""TranscriptionCache: keys, the in-memory LRU, and disk expiry and eviction."""
+import pytest
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.db')
+
+
+def test_keys_separate_what_changes_the_text(bot):
+    make_key = bot.TranscriptionCache.make_key
+    key = make_key('file', 'abc', 'base')
+    assert key == make_key('file', 'abc', 'base', language=None, word_timestamps=False)
+    assert len({
+        key,
+        make_key('sha256', 'abc', 'base'),
+        make_key('file', 'abd', 'base'),
+        make_key('file', 'abc', 'small'),
+        make_key('file', 'abc', 'base', language='de'),
+        make_key('file', 'abc', 'base', word_timestamps=True),
+    }) == 6
+
+
+def test_one_result_under_both_keys(bot, path):
+    cache = bot.TranscriptionCache(path, 10, 100, 30)
+    cache.put(['file-key', 'content-key'], {'text': 'hello'})
+    assert cache.get('file-key') == cache.get('content-key') == {'text': 'hello'}
+    assert cache.get('other') is None
+
+
+def test_results_survive_a_restart(bot, path):
+    bot.TranscriptionCache(path, 10, 100, 30).put(['key'], {'text': 'hello'})
+    assert bot.TranscriptionCache(path, 10, 100, 30).get('key') == {'text': 'hello'}
+
+
+def test_memory_keeps_the_most_recent(bot, path):
+    cache = bot.TranscriptionCache(path, 2, 100, 30)
+    for index in range(3):
+        cache.put([f'key-{index}'], {'text': str(index)})
+    assert list(cache._memory) == ['key-1', 'key-2']
+    # Dropped from memory only: read back from disk and remembered again
+    assert cache.get('key-0') == {'text': '0'}
+    assert list(cache._memory) == ['key-2', 'key-0']
+
+
+def test_expired_results_are_not_served(bot, path):
+    bot.TranscriptionCache(path, 10, 100, 30).put(['key'], {'text': 'old'})
+    cache = bot.TranscriptionCache(path, 10, 100, 30)
+    cache._db.execute('UPDATE cache SET created = created - 31 * 86400')
+    assert cache.get('key') is None
+
+
+def test_disk_keeps_the_most_recently_used(bot, path):
+    cache = bot.TranscriptionCache(path, 1, 5, 30)
+    for index in range(100):
+        cache.put([f'key-{index}'], {'text': str(index)})
+    cache._db.execute('UPDATE cache SET accessed = accessed - 1')
+    cache.get('key-0')  # read recently: kept despite its age
+    cache.put(['key-100'], {'text': '100'})  # the 101st put evicts
+    kept = {key for key, in cache._db.execute('SELECT key FROM cache')}
+    assert len(kept) == 5
+    assert {'key-0', 'key-100'} <= kept
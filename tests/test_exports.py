@@ -0,0 +1,59 @@
+"""ExportStore: per-user history, ownership and expiry."""
+import pytest
+
+
+@pytest.fixture
+def store(bot, tmp_path):
+    return bot.ExportStore(str(tmp_path / 'exports.db'), 3, 7)
+
+
+def age(store, item_id, days):
+    store._db.execute('UPDATE exports SET created = created - ? WHERE id = ?', (days * 86400, item_id))
+    store._db.commit()
+
+
+def stored_ids(store):
+    return {item_id for item_id, in store._db.execute('SELECT id FROM exports')}
+
+
+def test_items_round_trip_newest_first(bot, store):
+    first = store.add(1, {'text': 'one'}, 'One')
+    second = store.add(1, {'text': 'two'}, 'Two')
+    assert [(item_id, title) for item_id, _, title in store.recent(1)] == [(second, 'Two'), (first, 'One')]
+    assert store.get(1) == {'text': 'two'}
+    assert store.get(1, first) == {'text': 'one'}
+
+
+def test_users_only_see_their_own_items(bot, store):
+    item_id = store.add(1, {'text': 'private'}, 'Private')
+    assert store.get(2, item_id) is None
+    assert store.recent(2) == []
+
+
+def test_each_user_keeps_their_newest_items(bot, store):
+    ids = [store.add(1, {'text': str(index)}, str(index)) for index in range(5)]
+    store.add(2, {'text': 'other'}, 'Other')
+    assert [item_id for item_id, _, _ in store.recent(1)] == ids[:1:-1]
+    assert store.get(1, ids[0]) is None
+    assert len(store.recent(2)) == 1
+
+
+def test_expired_items_are_not_served(bot, store):
+    old = store.add(1, {'text': 'old'}, 'Old')
+    age(store, old, 8)
+    assert store.recent(1) == []
+    assert store.get(1) is None and store.get(1, old) is None
+    fresh = store.add(1, {'text': 'fresh'}, 'Fresh')
+    age(store, fresh, 6)  # still inside the window
+    assert store.get(1) == {'text': 'fresh'}
+
+
+def test_expired_items_are_deleted_as_new_ones_arrive(bot, tmp_path):
+    path = str(tmp_path / 'exports.db')
+    store = bot.ExportStore(path, 3, 7)
+    old = store.add(1, {'text': 'old'}, 'Old')
+    age(store, old, 8)
+    # The sweep runs on the first add of a store and every 100th after it
+    restarted = bot.ExportStore(path, 3, 7)
+    kept = restarted.add(2, {'text': 'new'}, 'New')
+    assert stored_ids(restarted) == {kept}
@@ -0,0 +1,75 @@
+"""The built-in HTTP server: request parsing and answers to malformed input."""
+import asyncio
+
+import pytest
+
+
+def parse(bot, data, eof=True, limit=2 ** 16):
+    async def main():
+        reader = asyncio.StreamReader(limit=limit)
+        reader.feed_data(data)
+        if eof:
+            reader.feed_eof()
+        return await bot.read_request(reader)
+    return asyncio.run(main())
+
+
+def test_a_request_with_a_body(bot):
+    request = parse(bot, b'POST /webhook?x=1 HTTP/1.1\r\nContent-Length: 2\r\nX-Token:  abc \r\n\r\n{}')
+    assert (request.method, request.path, request.body) == ('POST', '/webhook', b'{}')
+    assert request.headers == {'content-length': '2', 'x-token': 'abc'}
+
+
+def test_a_closed_connection_is_not_a_request(bot):
+    assert parse(bot, b'') is None
+    assert parse(bot, b'GET / HTTP/1.1\r\nHost: x') is None  # closed mid-head
+
+
+@pytest.mark.parametrize('data', [
+    b'GARBAGE\r\n\r\n',
+    b'GET /\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: 999999999\r\n\r\n',
+    b'GET / HTTP/1.1\r\n' + b'X-Padding: ' + b'a' * 100 + b'\r\n\r\n',
+])
+def test_malformed_requests_are_rejected(bot, data):
+    with pytest.raises(ValueError):
+        parse(bot, data, limit=64)
+
+
+def test_a_truncated_body_is_rejected(bot):
+    with pytest.raises(asyncio.IncompleteReadError):
+        parse(bot, b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n{}')
+
+
+class StubWriter:
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('data', [
+    b'GARBAGE\r\n\r\n',
+    b'GET / HTTP/1.1\r\nContent-Length: x\r\n\r\n',
+    b'GET / HTTP/1.1\r\nX-Padding: ' + b'a' * 2 ** 17 + b'\r\n\r\n',
+])
+def test_the_server_answers_400_and_closes(bot, data):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        writer = StubWriter()
+        await asyncio.wait_for(bot.serve_http_connection(reader, writer), 5)
+        return writer
+    writer = asyncio.run(main())
+    assert writer.data.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert writer.closed
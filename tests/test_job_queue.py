@@ -0,0 +1,91 @@
+"""Durable job queue: claims, leases, retries after a worker crash and acks."""
+import pickle
+
+import pytest
+
+
+@pytest.fixture
+def queue(bot, tmp_path):
+    return bot.JobQueue(str(tmp_path / 'queue.db'))
+
+
+def test_claim_runs_jobs_oldest_first(queue):
+    first = queue.put(b'first')
+    second = queue.put(b'second')
+    assert queue.claim('worker-0') == (first, b'first')
+    assert queue.claim('worker-1') == (second, b'second')
+    assert queue.claim('worker-2') is None
+
+
+def test_ack_is_collected_once(queue):
+    job_id = queue.put(b'job')
+    queue.claim('worker-0')
+    assert queue.collect() == []
+    queue.finish(job_id, 'worker-0', 'done', pickle.dumps('text'))
+    [(collected_id, state, result)] = queue.collect()
+    assert (collected_id, state, pickle.loads(result)) == (job_id, 'done', 'text')
+    assert queue.collect() == []
+
+
+def test_crashed_worker_job_is_retried(queue):
+    job_id = queue.put(b'job')
+    queue.claim('worker-0')
+    queue.release('worker-0')  # the monitor saw worker-0 die
+    assert queue.claim('worker-1') == (job_id, b'job')
+    # The dead worker's late answer must not overwrite the retry's
+    queue.finish(job_id, 'worker-0', 'failed', pickle.dumps(RuntimeError('late')))
+    assert queue.collect() == []
+    queue.finish(job_id, 'worker-1', 'done', pickle.dumps('retried'))
+    [(_, state, result)] = queue.collect()
+    assert (state, pickle.loads(result)) == ('done', 'retried')
+
+
+def test_expired_lease_is_claimed_again(bot, queue, monkeypatch):
+    job_id = queue.put(b'job')
+    monkeypatch.setattr(bot, 'JOB_LEASE_SECONDS', -1)  # every lease is already over
+    assert queue.claim('worker-0') == (job_id, b'job')
+    assert queue.claim('worker-1') == (job_id, b'job')
+
+
+def test_renewed_lease_is_kept(bot, queue, monkeypatch):
+    queue.put(b'job')
+    monkeypatch.setattr(bot, 'JOB_LEASE_SECONDS', -1)
+    job_id, _ = queue.claim('worker-0')
+    monkeypatch.setattr(bot, 'JOB_LEASE_SECONDS', 30)
+    queue.renew(job_id, 'worker-0')
+    assert queue.claim('worker-1') is None
+
+
+def test_job_that_keeps_crashing_fails(bot, queue, monkeypatch):
+    job_id = queue.put(b'poison')
+    for attempt in range(bot.JOB_MAX_ATTEMPTS):
+        assert queue.claim(f'worker-{attempt}') == (job_id, b'poison')
+        queue.release(f'worker-{attempt}')
+    assert queue.claim('worker-9') is None
+    [(_, state, result)] = queue.collect()
+    assert state == 'failed'
+    assert 'crashed its worker' in str(pickle.loads(result))
+
+
+class InterruptedClaim:
+    """Connection wrapper that raises right after the first claiming UPDATE ran."""
+    def __init__(self, db):
+        self._db = db
+        self.interrupted = False
+
+    def execute(self, sql, *args):
+        cursor = self._db.execute(sql, *args)
+        if sql.startswith("UPDATE jobs SET state = 'running'") and not self.interrupted:
+            self.interrupted = True
+            raise KeyboardInterrupt()
+        return cursor
+
+
+def test_failed_claim_is_rolled_back(queue):
+    job_id = queue.put(b'job')
+    queue._db = InterruptedClaim(queue._db)
+    with pytest.raises(KeyboardInterrupt):
+        queue.claim('worker-0')
+    # The half-done claim is rolled back: the job is still queued, no attempt used
+    assert queue.claim('worker-1') == (job_id, b'job')
+    assert queue._db.execute('SELECT attempts FROM jobs').fetchone() == (1,)
@@ -0,0 +1,137 @@
+"""Job journal: what a restart leaves behind, and how it is resumed."""
+import asyncio
+import os
+import time
+
+import pytest
+
+import harness
+
+from conftest import TelegramCalls, audio_fixture, make_context, make_update, until
+
+
+SMALL = {'data': b'audio', 'duration': 1, 'mime_type': 'audio/ogg', 'unique_id': 'journal-test'}
+
+
+@pytest.fixture
+def journal(bot, tmp_path, monkeypatch):
+    journal = bot.JobJournal(str(tmp_path / 'journal.db'))
+    monkeypatch.setattr(bot, 'journal', journal)
+    return journal
+
+
+def test_replayed_update_reopens_its_job(journal):
+    update = make_update(1, SMALL, TelegramCalls())
+    job_id = journal.start(update)
+    assert journal.start(update) == job_id
+    [(unfinished_id, attempts, _, update_json)] = journal.unfinished()
+    assert (unfinished_id, attempts, update_json) == (job_id, 2, update.to_json())
+
+
+def test_chunks_survive_until_the_job_finishes(journal):
+    job_id = journal.start(make_update(1, SMALL, TelegramCalls()))
+    segments = [{'start': 0.0, 'end': 1.5, 'text': 'Hello.'}]
+    journal.checkpoint(job_id, 0, 480000, segments)
+    assert journal.chunks(job_id) == {(0, 480000): segments}
+    journal.finish(job_id)
+    assert journal.unfinished() == []
+    assert journal.chunks(job_id) == {}
+
+
+def test_late_checkpoint_of_a_finished_job_is_dropped(journal):
+    job_id = journal.start(make_update(1, SMALL, TelegramCalls()))
+    journal.finish(job_id)
+    journal.checkpoint(job_id, 0, 480000, [])  # a worker that outlived its job
+    journal.unfinished()
+    assert journal.chunks(job_id) == {}
+
+
+class StubBot(harness.StubBot):
+    """Also remembers which chats were messaged."""
+    def __init__(self, calls):
+        super().__init__(calls)
+        self.chats = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.chats.append(chat_id)
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+class StubApplication:
+    def __init__(self):
+        self.bot = StubBot(TelegramCalls())
+        self.replayed = []
+
+    async def process_update(self, update):
+        self.replayed.append(update)
+
+
+def test_resume_replays_and_drops(bot, journal):
+    resumed = make_update(1, SMALL, TelegramCalls())
+    journal.start(resumed)
+    crashing = make_update(2, SMALL, TelegramCalls())
+    for _ in range(bot.JOURNAL_MAX_ATTEMPTS):
+        journal.start(crashing)
+    stale = make_update(3, SMALL, TelegramCalls())
+    stale_id = journal.start(stale)
+    journal._db.execute('UPDATE jobs SET created = ? WHERE id = ?',
+                        (time.time() - bot.JOURNAL_MAX_AGE_HOURS * 3600 - 1, stale_id))
+    journal._db.commit()
+
+    application = StubApplication()
+    asyncio.run(bot.resume_journal(application))
+    assert [update.effective_message.message_id for update in application.replayed] == [
+        resumed.message.message_id
+    ]
+    assert application.bot.chats == [2, 3]
+    # The replayed job stays journaled until its handler answers
+    assert len(journal.unfinished()) == 1
+
+
+def test_answered_job_leaves_the_journal(bot, handler, journal):
+    calls = TelegramCalls()
+    asyncio.run(bot.transcribe_audio(make_update(201, audio_fixture(5), calls), make_context(calls)))
+    assert calls.texts[-1].startswith('✅')
+    assert journal.unfinished() == []
+
+
+def test_shutdown_interrupts_a_deferred_file(bot, handler, journal, monkeypatch):
+    monkeypatch.setattr(bot, 'USER_AUDIO_MINUTES_PER_HOUR', 6)  # 0.1 s per second
+    monkeypatch.setattr(bot, 'USER_AUDIO_BURST_MINUTES', 0.5)
+
+    calls = TelegramCalls()
+
+    async def main():
+        first = TelegramCalls()
+        await bot.transcribe_audio(make_update(202, audio_fixture(25), first), make_context(first))
+        update = make_update(202, audio_fixture(10), calls)
+        task = asyncio.create_task(bot.transcribe_audio(update, make_context(calls)))
+        await until(lambda: 202 in bot.deferred_transcriptions, 'the second file to be deferred')
+        started = time.monotonic()
+        await bot.drain_transcriptions(30)
+        # Not held until the 50 s rate-limit wait is over
+        assert time.monotonic() - started < 5
+        assert task.done()
+        return update
+
+    update = asyncio.run(main())
+    assert calls.texts[-1] == bot.RESTARTING_TEXT
+    [(_, _, _, update_json)] = journal.unfinished()
+    assert update_json == update.to_json()
+
+    application = StubApplication()
+    asyncio.run(bot.resume_journal(application))
+    assert [replayed.effective_message.message_id for replayed in application.replayed] == [
+        update.message.message_id
+    ]
+
+
+def test_sweep_removes_only_old_spools(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot.tempfile, 'tempdir', str(tmp_path))
+    names = ['longform-abc_1234.f32', 'longform-new12345.f32', 'tmpabcd1234.wav', 'tmpabcd1234.json', 'notes.txt']
+    for name in names:
+        (tmp_path / name).write_bytes(b'x')
+        if name != 'longform-new12345.f32':
+            os.utime(tmp_path / name, (time.time() - 7200,) * 2)
+    assert bot.sweep_temp_files() == 1
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
@@ -0,0 +1,71 @@
+"""Long-form chunk planning and stitching."""
+import numpy as np
+import pytest
+
+RATE = 16000
+
+
+@pytest.fixture
+def speech(bot, monkeypatch):
+    """Set the speech spans (in seconds) that VAD reports; chunks are 10 s at most."""
+    vad = pytest.importorskip('faster_whisper.vad')
+    monkeypatch.setattr(bot, 'CHUNK_SECONDS', 10)
+    spans = []
+    monkeypatch.setattr(vad, 'get_speech_timestamps', lambda audio, options: [
+        {'start': int(start * RATE), 'end': int(end * RATE)} for start, end in spans
+    ])
+    return spans
+
+
+def test_short_audio_is_one_chunk(bot, speech):
+    boundaries, _ = bot.plan_chunks(np.zeros(8 * RATE, dtype=np.float32))
+    assert boundaries == [0, 8 * RATE]
+
+
+def test_cuts_fall_in_the_middle_of_the_latest_silence(bot, speech):
+    speech[:] = [(0, 4), (5, 8), (9, 14), (15, 19), (20, 25)]
+    boundaries, _ = bot.plan_chunks(np.zeros(25 * RATE, dtype=np.float32))
+    assert boundaries == [0, int(8.5 * RATE), int(14.5 * RATE), int(19.5 * RATE), 25 * RATE]
+
+
+def test_without_silence_the_cut_is_hard(bot, speech):
+    speech[:] = [(0, 25)]
+    boundaries, _ = bot.plan_chunks(np.zeros(25 * RATE, dtype=np.float32))
+    assert boundaries == [0, 10 * RATE, 20 * RATE, 25 * RATE]
+
+
+def test_no_tiny_chunk_for_an_early_silence(bot, speech):
+    speech[:] = [(0, 1), (2, 25)]  # the only silence is 1.5 s in
+    boundaries, _ = bot.plan_chunks(np.zeros(25 * RATE, dtype=np.float32))
+    assert boundaries[1] == 10 * RATE
+    assert all(b - a <= 10 * RATE for a, b in zip(boundaries, boundaries[1:]))
+
+
+def segment(start, end, text):
+    return {'start': start, 'end': end, 'text': text}
+
+
+def test_stitch_keeps_each_segment_in_the_chunk_that_owns_its_middle(bot):
+    boundaries = [0, 10 * RATE, 20 * RATE]
+    chunks = [
+        # The first chunk ran 1 s into the second for context
+        [segment(0, 4, 'one'), segment(4, 9.8, 'two'), segment(9.8, 10.8, 'three')],
+        [segment(9.8, 10.8, 'three'), segment(10.8, 15, 'four'), segment(15, 21, 'five')],
+    ]
+    assert [s['text'] for s in bot.stitch_segments(chunks, boundaries)] == ['one', 'two', 'three', 'four', 'five']
+
+
+def test_stitch_drops_a_repeat_across_the_cut(bot):
+    boundaries = [0, 10 * RATE, 20 * RATE]
+    chunks = [
+        [segment(0, 9.9, 'Hello there.')],
+        # Re-heard in the overlap, with its middle just past the cut
+        [segment(9.6, 10.6, 'hello there.'), segment(10.6, 18, 'Bye.')],
+    ]
+    assert [s['text'] for s in bot.stitch_segments(chunks, boundaries)] == ['Hello there.', 'Bye.']
+
+
+def test_stitch_keeps_a_real_repeat_later_on(bot):
+    boundaries = [0, 10 * RATE, 20 * RATE]
+    chunks = [[segment(0, 2, 'Yes.')], [segment(12, 13, 'Yes.')]]
+    assert len(bot.stitch_segments(chunks, boundaries)) == 2
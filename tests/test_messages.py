@@ -0,0 +1,57 @@
+"""Splitting long transcripts into Telegram-sized messages."""
+import asyncio
+import random
+
+import pytest
+
+from conftest import StubChat, StubMessage, TelegramCalls
+
+
+def sentences(count, seed=0):
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta']
+    rng = random.Random(seed)
+    return ' '.join(
+        ' '.join(rng.choice(words) for _ in range(rng.randint(1, 30))) + rng.choice('.!?')
+        for _ in range(count)
+    )
+
+
+@pytest.mark.parametrize('limit', [20, 50, 100, 4096])
+def test_every_chunk_fits_and_nothing_is_lost(bot, limit):
+    text = sentences(200, seed=limit)
+    chunks = bot.split_message(text, limit)
+    assert all(0 < len(chunk) <= limit for chunk in chunks)
+    assert ' '.join(chunks).split() == text.split()
+
+
+def test_chunks_end_at_sentence_ends_when_they_can(bot):
+    text = 'One two three. Four five six. Seven eight nine.'
+    assert bot.split_message(text, 30) == ['One two three. Four five six.', 'Seven eight nine.']
+
+
+def test_an_overlong_sentence_is_cut_at_spaces(bot):
+    chunks = bot.split_message('Short. ' + 'word ' * 30 + 'end.', 24)
+    assert chunks[0] == 'Short.'
+    assert all(len(chunk) <= 24 for chunk in chunks)
+    assert all(not chunk.startswith(' ') and not chunk.endswith(' ') for chunk in chunks)
+
+
+def test_text_without_spaces_is_cut_hard(bot):
+    text = '这是一个没有空格的很长的句子' * 10
+    chunks = bot.split_message(text, 25)
+    assert all(len(chunk) <= 25 for chunk in chunks)
+    assert ''.join(chunks) == text
+
+
+def test_empty_text_has_no_chunks(bot):
+    assert bot.split_message('   ', 10) == []
+
+
+def test_sent_messages_stay_under_the_telegram_limit(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'LONG_TEXT_MAX_MESSAGES', 100)
+    calls = TelegramCalls()
+    message = StubMessage(StubChat(1, calls), calls)
+    text = sentences(2000)
+    asyncio.run(bot.output.send_long(message, text, '📝 Transcription'))
+    assert len(calls.texts) > 1
+    assert all(len(sent) <= bot.TELEGRAM_MESSAGE_LIMIT for sent in calls.texts)
@@ -0,0 +1,65 @@
+"""Silence trimming, loudness normalization and the TimeMap back to the original."""
+import numpy as np
+import pytest
+
+RATE = 16000
+
+
+def recording(*parts):
+    """Concatenate (seconds, amplitude) parts: a 440 Hz tone, or silence at 0."""
+    pieces = []
+    for seconds, amplitude in parts:
+        t = np.arange(int(seconds * RATE)) / RATE
+        pieces.append((amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.float32))
+    return np.concatenate(pieces)
+
+
+def test_long_pauses_and_the_edges_are_trimmed(bot):
+    original = recording((1, 0), (2, 0.1), (5, 0), (2, 0.1), (1, 0))
+    audio, timemap, removed = bot.preprocess_audio(original.copy())
+    # Half a second is kept next to speech: 0.5-3.5 s and 7.5-10.5 s remain
+    assert removed == pytest.approx(5.0)
+    assert len(audio) == 6 * RATE
+    gain = audio[RATE] / original[int(1.5 * RATE)]
+    assert gain == pytest.approx(np.sqrt(2), rel=0.01)  # peak 0.1 at RMS 0.0707 is raised to RMS 0.1
+    np.testing.assert_allclose(audio[:3 * RATE], original[RATE // 2:int(3.5 * RATE)] * gain, atol=1e-5)
+    np.testing.assert_allclose(audio[3 * RATE:], original[int(7.5 * RATE):int(10.5 * RATE)] * gain, atol=1e-5)
+
+
+def test_times_map_back_to_the_original(bot):
+    _, timemap, _ = bot.preprocess_audio(recording((1, 0), (2, 0.1), (5, 0), (2, 0.1), (1, 0)))
+    assert timemap(0) == pytest.approx(0.5)
+    assert timemap(2.9) == pytest.approx(3.4)
+    assert timemap(3.0) == pytest.approx(7.5)
+    assert timemap(6.0) == pytest.approx(10.5)
+
+
+def test_short_pauses_are_left_alone(bot):
+    original = recording((2, 0.1), (1.5, 0), (2, 0.1))
+    audio, timemap, removed = bot.preprocess_audio(original.copy())
+    assert removed == 0 and len(audio) == len(original)
+    assert timemap(4.0) == 4.0
+
+
+def test_silence_is_left_to_the_vad(bot):
+    original = recording((3, 0))
+    audio, timemap, removed = bot.preprocess_audio(original.copy())
+    assert removed == 0 and np.array_equal(audio, original)
+    assert timemap(1.5) == 1.5
+
+
+def test_disabled_preprocessing_changes_nothing(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'PREPROCESS_AUDIO', False)
+    original = recording((3, 0), (1, 0.01))
+    audio, _, removed = bot.preprocess_audio(original.copy())
+    assert removed == 0 and np.array_equal(audio, original)
+
+
+def test_segments_and_words_are_restored(bot):
+    timemap = bot.TimeMap()
+    timemap.add(0.0, 0.5)
+    timemap.add(3.0, 7.5)
+    restored = timemap.segment({'start': 2.0, 'end': 4.0, 'text': 'hi there',
+                                'words': [[2.0, 2.9, ' hi'], [3.1, 4.0, ' there']]})
+    assert (restored['start'], restored['end']) == (2.5, 8.5)
+    assert restored['words'] == [[2.5, 3.4, ' hi'], [7.6, 8.5, ' there']]
@@ -0,0 +1,25 @@
+"""probe_duration: the length of a file sent without a declared duration."""
+import io
+
+import pytest
+
+from conftest import make_fixture
+
+
+@pytest.mark.parametrize('fmt', ['wav', 'opus', 'mp3', 'flac', 'm4a', 'mp4'])
+def test_length_comes_from_the_file(bot, fmt):
+    fixture = make_fixture(7, rate=16000 if fmt == 'opus' else 44100, fmt=fmt)
+    assert bot.probe_duration(fixture['data']) == pytest.approx(7, abs=0.1)
+
+
+def test_a_file_without_audio_is_rejected(bot):
+    av = pytest.importorskip('av')
+    fixtures = pytest.importorskip('fixtures')
+    buffer = io.BytesIO()
+    with av.open(buffer, 'w', format='mp4') as output:
+        video = output.add_stream('mpeg4', rate=fixtures.VIDEO_FPS)
+        video.width = video.height = fixtures.VIDEO_SIZE
+        video.pix_fmt = 'yuv420p'
+        fixtures.mux_video(output, video, 1)
+    with pytest.raises(bot.DownloadRejected):
+        bot.probe_duration(buffer.getvalue())
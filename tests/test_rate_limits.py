@@ -0,0 +1,125 @@
+"""Audio-second token buckets: charges, refunds and what the handler charges."""
+import asyncio
+
+import pytest
+
+from conftest import TelegramCalls, audio_fixture, command_update, make_context, make_update, send, until
+
+BUCKET = [('user:1', 1.0, 30)]  # one audio second per second, 30 s burst
+
+
+def test_charge_reserves_and_reports_the_wait(bot):
+    levels, wait = bot.charge_buckets({}, BUCKET, 20, now=100, max_wait=60)
+    assert (levels, wait) == ({'user:1': (10, 100)}, 0.0)
+    # 20 s more needs 10 s of refill; the balance goes negative as a reservation
+    levels, wait = bot.charge_buckets(levels, BUCKET, 20, now=100, max_wait=60)
+    assert (levels, wait) == ({'user:1': (-10, 100)}, 10.0)
+    # Refilled over time, never beyond the burst
+    levels, wait = bot.charge_buckets(levels, BUCKET, 0, now=1000, max_wait=60)
+    assert levels == {'user:1': (30, 1000)}
+
+
+def test_charge_over_max_wait_is_refused(bot):
+    levels = {'user:1': (0, 100)}
+    assert bot.charge_buckets(levels, BUCKET, 20, now=100, max_wait=10) == (None, 20.0)
+
+
+def test_file_longer_than_the_burst_needs_a_full_bucket(bot):
+    levels, wait = bot.charge_buckets({}, BUCKET, 100, now=100, max_wait=60)
+    assert (levels, wait) == ({'user:1': (-70, 100)}, 0.0)
+
+
+def test_negative_cost_refunds(bot):
+    levels, _ = bot.charge_buckets({}, BUCKET, 25, now=100, max_wait=60)
+    levels, wait = bot.charge_buckets(levels, BUCKET, -25, now=100, max_wait=60)
+    assert (levels, wait) == ({'user:1': (30, 100)}, 0.0)
+
+
+def test_every_bucket_is_charged_or_none(bot):
+    buckets = BUCKET + [('chat:-5', 1.0, 300)]
+    levels = {'user:1': (30, 100), 'chat:-5': (0, 100)}
+    assert bot.charge_buckets(levels, buckets, 20, now=100, max_wait=10) == (None, 20.0)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(bot, request, tmp_path):
+    if request.param == 'memory':
+        return bot.MemoryStatsBackend()
+    return bot.SQLiteStatsBackend(str(tmp_path / 'stats.db'), 60)
+
+
+def test_backend_charge_and_refund(backend):
+    buckets = [('user:1', 0.001, 30)]
+    assert backend.take_tokens(buckets, 25) == (True, 0.0)
+    taken, wait = backend.take_tokens(buckets, 25, max_wait=60)
+    assert not taken and wait == pytest.approx(20 / 0.001, rel=0.01)
+    backend.take_tokens(buckets, -25)
+    assert backend.take_tokens(buckets, 25, max_wait=60) == (True, 0.0)
+
+
+def test_replicas_share_one_balance(bot, tmp_path):
+    path = str(tmp_path / 'stats.db')
+    first, second = bot.SQLiteStatsBackend(path, 60), bot.SQLiteStatsBackend(path, 60)
+    buckets = [('user:1', 0.001, 30)]
+    assert first.take_tokens(buckets, 25) == (True, 0.0)
+    assert not second.take_tokens(buckets, 25, max_wait=60)[0]
+    second.take_tokens(buckets, -25)
+    assert first.take_tokens(buckets, 25, max_wait=60) == (True, 0.0)
+
+
+@pytest.fixture
+def limits(bot, handler, monkeypatch):
+    """A 30 s burst that refills at 0.01 s per second: effectively no refill."""
+    monkeypatch.setattr(bot, 'USER_AUDIO_MINUTES_PER_HOUR', 0.6)
+    monkeypatch.setattr(bot, 'USER_AUDIO_BURST_MINUTES', 0.5)
+    return monkeypatch
+
+
+def balance(bot, user_id):
+    row = bot.stats_store.db.execute(
+        'SELECT tokens FROM rate_limits WHERE key = ?', (f'user:{user_id}',)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def test_document_is_charged_its_measured_length(bot, limits):
+    texts = send(bot, 101, audio_fixture(20, declared=False), kind='document').texts
+    assert texts[-1].startswith('✅')
+    assert balance(bot, 101) == pytest.approx(10, abs=0.5)
+    # The next 20 s document would wait far longer than RATE_LIMIT_MAX_DEFER_SECONDS
+    texts = send(bot, 101, audio_fixture(20, declared=False), kind='document').texts
+    assert texts[-1].startswith('🚦')
+    assert balance(bot, 101) == pytest.approx(10, abs=0.5)
+
+
+def test_declared_duration_is_charged_up_front(bot, limits):
+    texts = send(bot, 102, audio_fixture(12)).texts
+    assert texts[-1].startswith('✅')
+    assert balance(bot, 102) == pytest.approx(18, abs=0.5)
+
+
+def test_cached_answer_is_refunded(bot, limits):
+    fixture = audio_fixture(12)
+    send(bot, 103, fixture)
+    # Same audio uploaded again as a new file: answered from the cache, no Whisper time
+    texts = send(bot, 103, dict(fixture, unique_id=fixture['unique_id'] + '-again')).texts
+    assert '(cached)' in texts[-1]
+    assert balance(bot, 103) == pytest.approx(18, abs=0.5)
+
+
+def test_cancelled_deferral_is_refunded(bot, limits):
+    limits.setattr(bot, 'USER_AUDIO_MINUTES_PER_HOUR', 6)  # 0.1 s per second: a 10 s file waits 50 s
+
+    async def main():
+        first = TelegramCalls()
+        await bot.transcribe_audio(make_update(104, audio_fixture(25), first), make_context(first))
+        calls = TelegramCalls()
+        task = asyncio.create_task(bot.transcribe_audio(make_update(104, audio_fixture(10), calls), make_context(calls)))
+        await until(lambda: 104 in bot.deferred_transcriptions, 'the second file to be deferred')
+        assert balance(bot, 104) == pytest.approx(-5, abs=0.5)
+        command = TelegramCalls()
+        await bot.cancel_command(command_update(104, command), make_context(command))
+        await asyncio.wait_for(task, 5)
+        assert calls.texts[-1] == '🛑 Transcription cancelled.'
+        assert balance(bot, 104) == pytest.approx(5, abs=0.5)
+    asyncio.run(main())
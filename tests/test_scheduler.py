@@ -0,0 +1,199 @@
+"""TranscriptionScheduler: fair-queue order, admission and /cancel."""
+import asyncio
+import time
+
+import harness
+import pytest
+
+from conftest import TelegramCalls, audio_fixture, command_update, make_context, make_update, until
+
+
+def queued(bot, submissions):
+    """Submit (user_id, cost) jobs to a scheduler whose workers never start."""
+    scheduler = bot.TranscriptionScheduler(1, 100)
+    scheduler._wakeup = asyncio.Event()  # no workers: jobs stay queued
+    jobs = [scheduler.submit(user_id, print, cost=cost) for user_id, cost in submissions]
+    return scheduler, jobs
+
+
+def test_short_file_goes_before_a_long_backlog(bot):
+    async def main():
+        scheduler, jobs = queued(bot, [(1, 600), (1, 600), (1, 600), (2, 10)])
+        assert [job.user_id for job in scheduler._dispatch_order()] == [2, 1, 1, 1]
+        assert scheduler.position(jobs[3]) == 0  # next for the free worker
+        assert scheduler.position(jobs[0]) == 1
+        assert [scheduler._next_job().user_id for _ in range(4)] == [2, 1, 1, 1]
+        assert scheduler.depth == 0
+    asyncio.run(main())
+
+
+def test_users_are_served_by_audio_seconds(bot):
+    async def main():
+        scheduler, _ = queued(bot, [(1, 60), (1, 60), (2, 30), (2, 30), (2, 30), (2, 30)])
+        # Each user gets the same audio seconds per round
+        assert [scheduler._next_job().user_id for _ in range(6)] == [2, 1, 2, 2, 1, 2]
+    asyncio.run(main())
+
+
+def test_premium_weight_scales_the_share(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'PREMIUM_USER_IDS', {1})
+    monkeypatch.setattr(bot, 'PREMIUM_QUEUE_WEIGHT', 2.0)
+
+    async def main():
+        scheduler, jobs = queued(bot, [(1, 60), (1, 60), (2, 60)])
+        assert [job.tag for job in jobs] == [30, 60, 60]
+        assert [scheduler._next_job().user_id for _ in range(3)] == [1, 1, 2]
+    asyncio.run(main())
+
+
+def test_idle_user_does_not_bank_credit(bot):
+    async def main():
+        scheduler, _ = queued(bot, [(1, 100), (1, 100)])
+        scheduler._next_job()
+        scheduler._next_job()
+        # A newcomer starts at the current virtual time, not at zero
+        late = scheduler.submit(2, print, cost=10)
+        assert late.tag == 200 + 10
+    asyncio.run(main())
+
+
+def test_full_queue_refuses_new_work(bot):
+    async def main():
+        scheduler = bot.TranscriptionScheduler(1, 2)
+        scheduler._wakeup = asyncio.Event()
+        scheduler.submit(1, print, cost=1)
+        scheduler.submit(2, print, cost=1)
+        with pytest.raises(bot.QueueFullError):
+            scheduler.submit(3, print, cost=1)
+        scheduler.submit(3, print, cost=1, force=True)  # follow-up work of an admitted job
+    asyncio.run(main())
+
+
+def test_cancel_user_fails_only_their_queued_jobs(bot):
+    async def main():
+        scheduler, jobs = queued(bot, [(1, 10), (2, 10), (1, 10)])
+        assert scheduler.cancel_user(1) == 2
+        assert scheduler.depth == 1
+        for job in (jobs[0], jobs[2]):
+            assert isinstance(job.future.exception(), bot.JobCancelledError)
+            assert job.cancel_event.is_set()
+        assert not jobs[1].future.done()
+    asyncio.run(main())
+
+
+def test_cancel_reaches_a_batch_being_collected(bot):
+    ran = []
+
+    async def main():
+        scheduler = bot.TranscriptionScheduler(1, 10, batch_size=4, batch_wait=5.0)
+        job = scheduler.submit(1, None, 'clip', cost=5, batch_fn=ran.extend, batch_key='base')
+        await until(lambda: scheduler._collecting, 'the batch window to open')
+        assert scheduler.cancel_user(1) == 1
+        with pytest.raises(bot.JobCancelledError):
+            await job.future
+        # The emptied batch is dropped right away, not run when the window closes
+        await until(lambda: not scheduler._collecting, 'the batch window to close', timeout=1)
+        scheduler.close()
+    asyncio.run(main())
+    assert ran == []
+
+
+def test_cancel_command_stops_a_running_transcription(bot, fake_model, monkeypatch):
+    fake_model.segments = 100
+    fake_model.delay = 0.02
+
+    async def main():
+        scheduler = bot.TranscriptionScheduler(1, 10)
+        monkeypatch.setattr(bot, 'scheduler', scheduler)
+        audio = audio_fixture(5)['data']
+        job = scheduler.submit(7, bot.run_transcription, 'base', audio, 'en', cost=5)
+        await until(lambda: fake_model.produced, 'the first segment')
+        calls = TelegramCalls()
+        await bot.cancel_command(command_update(7, calls), make_context(calls))
+        with pytest.raises(bot.JobCancelledError):
+            await job.future
+        assert calls.texts == ['🛑 Cancelled 1 transcription(s).']
+        # The worker thread notices the cancel event between segments
+        await until(lambda: not scheduler.in_flight, 'the worker to stop')
+        assert fake_model.produced < fake_model.segments
+        scheduler.close()
+    asyncio.run(main())
+
+
+def test_cancel_command_stops_a_download(bot, handler, monkeypatch):
+    downloading = asyncio.Event()
+
+    async def stalled(self, buf=None):
+        downloading.set()
+        await asyncio.sleep(3600)
+    monkeypatch.setattr(harness.StubFile, 'download_as_bytearray', stalled)
+
+    async def main():
+        calls = TelegramCalls()
+        task = asyncio.create_task(
+            bot.transcribe_audio(make_update(9, audio_fixture(5), calls), make_context(calls))
+        )
+        await asyncio.wait_for(downloading.wait(), 5)
+        command = TelegramCalls()
+        await bot.cancel_command(command_update(9, command), make_context(command))
+        await asyncio.wait_for(task, 5)  # ends normally: the user is told, nothing is raised
+        assert command.texts == ['🛑 Cancelled 1 transcription(s).']
+        assert calls.texts[-1] == '🛑 Transcription cancelled.'
+        assert not bot.active_transcriptions and not bot.cancelled_transcriptions
+        assert bot.journal.unfinished() == []
+    asyncio.run(main())
+
+
+def test_cancel_command_with_nothing_to_cancel(bot):
+    async def main():
+        calls = TelegramCalls()
+        await bot.cancel_command(command_update(8, calls), make_context(calls))
+        assert calls.texts == ['Nothing to cancel.']
+    asyncio.run(main())
+
+
+def batch_runs(bot):
+    """(count, clip total) of transcription_batch_size on /metrics."""
+    values = {}
+    for line in bot.metrics.render().splitlines():
+        if line.startswith(('transcription_batch_size_count', 'transcription_batch_size_sum')):
+            name, value = line.split()
+            values[name] = float(value)
+    return values.get('transcription_batch_size_count', 0), values.get('transcription_batch_size_sum', 0)
+
+
+def test_batches_are_measured_for_metrics(bot):
+    before = batch_runs(bot)
+
+    async def main():
+        scheduler = bot.TranscriptionScheduler(1, 10, batch_size=4, batch_wait=0.05)
+        jobs = [scheduler.submit(user_id, None, 'clip', cost=5, batch_fn=list, batch_key='base')
+                for user_id in (1, 2, 3)]
+        assert await asyncio.wait_for(asyncio.gather(*(job.future for job in jobs)), 5) == [('clip',)] * 3
+        scheduler.close()
+    asyncio.run(main())
+    count, clips = batch_runs(bot)
+    assert (count - before[0], clips - before[1]) == (1, 3)
+    assert 'transcription_batch_size_bucket{le="4"}' in bot.metrics.render()
+
+
+def test_realtime_factor_leaves_out_the_queue_wait(bot, handler, monkeypatch):
+    factors = []
+    observe = bot.metrics.observe
+
+    def record(name, value, **labels):
+        if name == 'transcription_realtime_factor':
+            factors.append(value)
+        observe(name, value, **labels)
+    monkeypatch.setattr(bot.metrics, 'observe', record)
+
+    async def main():
+        # Both workers are busy for a second before the file gets one
+        for user_id in (1, 2):
+            bot.scheduler.submit(user_id, lambda cancel_event=None: time.sleep(1), cost=1)
+        calls = TelegramCalls()
+        await bot.transcribe_audio(make_update(3, audio_fixture(5), calls), make_context(calls))
+        assert calls.texts[-1].startswith('✅')
+    asyncio.run(main())
+    # Measured over the queue wait it would be at most 5 s of audio per second
+    assert factors and factors[0] > 10
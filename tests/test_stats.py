@@ -0,0 +1,42 @@
+"""SQLiteStatsBackend: batched writes and reads that include unflushed ones."""
+
+
+def test_load_counts_flushed_and_pending_writes_once(bot, tmp_path):
+    stats = bot.SQLiteStatsBackend(str(tmp_path / 'stats.db'), 3600)
+    stats.record(1, 10.0, 'en', 'base')
+    stats.record(1, 5.0, 'de', 'base')
+    stats.flush()
+    stats.record(1, 1.0, 'en', 'small')
+    result = stats.load(1)
+    assert (result.total_transcriptions, result.total_duration) == (3, 16.0)
+    assert result.languages == {'en': 2, 'de': 1}
+    assert result.models == {'base': 2, 'small': 1}
+    assert stats.load(2).total_transcriptions == 0
+
+
+class FlushAfterRelease:
+    """The stats flush lock, with a flush squeezed in right after load() lets go."""
+    def __init__(self, stats):
+        self.stats = stats
+        self.lock = stats._flush_lock
+        self.armed = False
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        if self.armed:
+            self.armed = False
+            self.stats.flush()
+
+
+def test_a_flush_during_load_does_not_hide_pending_writes(bot, tmp_path):
+    stats = bot.SQLiteStatsBackend(str(tmp_path / 'stats.db'), 3600)
+    stats.record(1, 10.0, 'en', 'base')
+    stats.flush()
+    stats.record(1, 5.0, 'en', 'base')
+    stats._flush_lock = lock = FlushAfterRelease(stats)
+    lock.armed = True
+    assert stats.load(1).total_transcriptions == 2
+    assert stats.load(1).total_transcriptions == 2
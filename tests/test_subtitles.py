@@ -0,0 +1,60 @@
+"""Subtitle cues and their SRT/WebVTT rendering."""
+
+
+def segment(start, end, text, words=None):
+    return {'start': start, 'end': end, 'text': text, 'words': words}
+
+
+def timed(*words):
+    """Word timestamps, one second per word starting at 0."""
+    return [(float(index), index + 1.0, f' {word}') for index, word in enumerate(words)]
+
+
+def test_lines_respect_the_length_limit(bot):
+    words = ['subtitle'] * 12
+    cues = bot.build_cues([segment(0, 12, ' '.join(words))], max_chars=20, max_lines=2, max_duration=60)
+    assert [word for _, _, lines in cues for line in lines for word in line.split()] == words
+    for _, _, lines in cues:
+        assert len(lines) <= 2
+        assert all(len(line) <= 20 for line in lines)
+
+
+def test_a_pause_starts_a_new_cue(bot):
+    words = [(0.0, 0.5, ' Hello'), (0.5, 1.0, ' there'), (3.0, 3.5, ' again')]
+    cues = bot.build_cues([segment(0, 3.5, ' Hello there again', words)])
+    assert [lines for _, _, lines in cues] == [['Hello there'], ['again']]
+
+
+def test_cues_stay_within_the_duration_limit(bot):
+    cues = bot.build_cues([segment(0, 10, '', timed(*'abcdefghij'))], max_duration=3)
+    assert all(end - start <= 3 for start, end, _ in cues)
+    assert len(cues) == 4
+
+
+def test_short_cues_are_stretched_but_never_overlap(bot):
+    words = [(0.0, 0.2, ' Hi.'), (1.5, 1.7, ' Yes.'), (1.75, 1.9, ' No.')]
+    cues = bot.build_cues([segment(0, 0.2, '', words[:1]), segment(1.5, 1.9, '', words[1:])])
+    assert cues[0][:2] == (0.0, bot.SUBTITLE_MIN_SECONDS)
+    assert all(end <= following[0] for (_, end, _), following in zip(cues, cues[1:]))
+
+
+def test_segments_without_word_timings_are_spread_over_their_span(bot):
+    words = bot.segment_words(segment(10, 14, ' ab cd'))
+    assert [word for _, _, word in words] == ['ab', 'cd']
+    assert words[0][0] == 10 and words[-1][1] == 14
+    assert words[0][1] == words[1][0]
+
+
+def test_srt_rendering(bot):
+    data = {'segments': [segment(0, 2, '', timed('Hello', 'world.')),
+                         segment(3661.5, 3663, '', [(3661.5, 3663.0, ' Bye.')])]}
+    assert bot.create_srt(data) == (
+        '1\n00:00:00,000 --> 00:00:02,000\nHello world.\n\n'
+        '2\n01:01:01,500 --> 01:01:03,000\nBye.\n\n'
+    )
+
+
+def test_vtt_rendering(bot):
+    data = {'segments': [segment(0, 2, '', timed('Hello', 'world.'))]}
+    assert bot.create_vtt(data) == 'WEBVTT\n\n00:00:00.000 --> 00:00:02.000\nHello world.\n\n'
+    assert bot.create_vtt({'segments': []}) == ''